@@ -0,0 +1,114 @@
+"""
+Compare the temporal expression rules with the llm datetime extraction on
+synthetic chats (`chat_*.json` files written by synthetic_data_generation.py),
+reporting extraction latency, how many chats the rules answer on their own and
+how often they agree with the llm.
+
+    uv run python scripts/benchmark_datetime_extraction.py data/synthetic --model qwq:32b
+"""
+import argparse
+from datetime import datetime, timedelta, timezone
+import json
+from pathlib import Path
+import time
+
+from pydantic import BaseModel
+
+from conversations.extract_date_time_llm_model import extract_event as extract_event_with_llm
+from conversations.extract_date_time_rules import extract_event as extract_event_with_rules
+from datatypes import Message
+
+
+class ExtractorReport(BaseModel):
+    extractions: int = 0
+    seconds: float = 0.0
+
+    @property
+    def mean_latency_ms(self) -> float:
+        return self.seconds * 1000 / self.extractions if self.extractions else 0.0
+
+
+class BenchmarkReport(BaseModel):
+    chats: int
+    rules_mean_latency_ms: float
+    llm_mean_latency_ms: float
+    # share of chats the rules answer without the llm at the confidence threshold
+    rules_confident: float
+    # agreement with the llm, over the confident chats and over all of them
+    confident_agreement: float
+    agreement: float
+
+
+def load_chats(path: Path, start: datetime, interval_seconds: float) -> list[list[Message]]:
+    """The chats as conversations, timestamps `interval_seconds` apart from `start`."""
+    files = sorted(path.glob("chat_*.json")) if path.is_dir() else [path]
+    chats = []
+    for file in files:
+        messages = json.loads(file.read_text())["messages"]
+        chats.append([
+            Message(
+                seqid=idx,
+                ts=start + timedelta(seconds=idx * interval_seconds),
+                user=message["user"],
+                message=message["message"],
+            )
+            for idx, message in enumerate(messages)
+        ])
+    return chats
+
+
+def agree(rules: datetime | None, llm: datetime | None, reference: datetime, tolerance: timedelta) -> bool:
+    if rules is None or llm is None:
+        return rules is None and llm is None
+    # the llm answers without a time zone, read it in the time zone of the messages
+    if llm.tzinfo is None:
+        llm = llm.replace(tzinfo=reference.tzinfo)
+    return abs(rules - llm) <= tolerance
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark rule based against llm datetime extraction.")
+    parser.add_argument("chats", type=Path, help="chat json file or directory of them")
+    parser.add_argument("--model", type=str, default="qwq:32b")
+    parser.add_argument("--min-confidence", type=float, default=0.8)
+    parser.add_argument("--start", type=datetime.fromisoformat, default=datetime(2025, 3, 4, 9, 0, tzinfo=timezone.utc))
+    parser.add_argument("--interval-seconds", type=float, default=20.0)
+    parser.add_argument("--tolerance-minutes", type=float, default=1.0)
+    args = parser.parse_args()
+
+    chats = load_chats(args.chats, args.start, args.interval_seconds)
+    tolerance = timedelta(minutes=args.tolerance_minutes)
+    rules_report, llm_report = ExtractorReport(), ExtractorReport()
+    confident = confident_agreed = agreed = 0
+    for chat in chats:
+        if not chat:
+            continue
+        started = time.perf_counter()
+        rules = extract_event_with_rules(chat)
+        rules_report.seconds += time.perf_counter() - started
+        rules_report.extractions += 1
+
+        started = time.perf_counter()
+        llm = extract_event_with_llm(chat, args.model)
+        llm_report.seconds += time.perf_counter() - started
+        llm_report.extractions += 1
+
+        matched = agree(rules.event_datetime, llm.event_datetime if llm.datetime_exists else None, chat[-1].ts, tolerance)
+        agreed += matched
+        if rules.confidence >= args.min_confidence:
+            confident += 1
+            confident_agreed += matched
+
+    report = BenchmarkReport(
+        chats=rules_report.extractions,
+        rules_mean_latency_ms=rules_report.mean_latency_ms,
+        llm_mean_latency_ms=llm_report.mean_latency_ms,
+        rules_confident=confident / rules_report.extractions if rules_report.extractions else 0.0,
+        confident_agreement=confident_agreed / confident if confident else 0.0,
+        agreement=agreed / rules_report.extractions if rules_report.extractions else 0.0,
+    )
+    print(report.model_dump_json(indent=2))
+
+
+if __name__ == "__main__":
+    main()
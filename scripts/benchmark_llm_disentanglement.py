@@ -0,0 +1,96 @@
+"""
+Compare the pairwise and the multi-choice llm disentanglement modes on scenario
+files (`initial_state` conversations and a `new_message`), reporting llm calls,
+prompt size, latency and how often the two modes agree.
+
+    uv run python scripts/benchmark_llm_disentanglement.py tests/scenarios --model qwq:32b
+"""
+import argparse
+import json
+from pathlib import Path
+import time
+
+from pydantic import BaseModel
+
+from conversations.disentanglement.llm_based_classifier import (
+    build_multi_choice_prompt,
+    build_prompt,
+    choose_conversation,
+    classify_message,
+)
+from datatypes import ClassifiedMessage, Conversation
+
+
+class Scenario(BaseModel):
+    initial_state: list[Conversation]
+    new_message: ClassifiedMessage
+
+
+class ModeReport(BaseModel):
+    llm_calls: int = 0
+    prompt_chars: int = 0
+    seconds: float = 0.0
+
+
+class BenchmarkReport(BaseModel):
+    scenarios: int
+    pairwise: ModeReport
+    multi_choice: ModeReport
+    agreement: float
+
+
+def load_scenarios(path: Path) -> list[Scenario]:
+    files = sorted(path.glob("*.json")) if path.is_dir() else [path]
+    return [Scenario(**json.loads(file.read_text())) for file in files]
+
+
+def pairwise_matches(scenario: Scenario, model: str, report: ModeReport) -> set[int]:
+    matches = set()
+    started = time.perf_counter()
+    for idx, conversation in enumerate(scenario.initial_state):
+        report.llm_calls += 1
+        report.prompt_chars += len(build_prompt(conversation.lines, scenario.new_message))
+        if classify_message(conversation.lines, scenario.new_message, model).matches:
+            matches.add(idx)
+    report.seconds += time.perf_counter() - started
+    return matches
+
+
+def multi_choice_match(scenario: Scenario, model: str, recent_lines: int, report: ModeReport) -> int | None:
+    if not scenario.initial_state:
+        return None
+    started = time.perf_counter()
+    report.llm_calls += 1
+    report.prompt_chars += len(build_multi_choice_prompt(scenario.initial_state, scenario.new_message, recent_lines))
+    choice = choose_conversation(scenario.initial_state, scenario.new_message, model, recent_lines)
+    report.seconds += time.perf_counter() - started
+    return choice
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark pairwise against multi-choice llm disentanglement.")
+    parser.add_argument("scenarios", type=Path, help="scenario json file or directory of them")
+    parser.add_argument("--model", type=str, default="qwq:32b")
+    parser.add_argument("--recent-lines", type=int, default=6)
+    args = parser.parse_args()
+
+    scenarios = load_scenarios(args.scenarios)
+    pairwise, multi_choice = ModeReport(), ModeReport()
+    agreed = 0
+    for scenario in scenarios:
+        matches = pairwise_matches(scenario, args.model, pairwise)
+        choice = multi_choice_match(scenario, args.model, args.recent_lines, multi_choice)
+        # pairwise can match several conversations, the choice agrees if it is one of them
+        agreed += (choice in matches) if choice is not None else not matches
+
+    report = BenchmarkReport(
+        scenarios=len(scenarios),
+        pairwise=pairwise,
+        multi_choice=multi_choice,
+        agreement=agreed / len(scenarios) if scenarios else 0.0,
+    )
+    print(report.model_dump_json(indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,203 @@
-from transformers import pipeline
-from transformers import BertTokenizer
-from text_utils import clean_text
-from datatypes import Message, ClassifiedMessage
+from collections import OrderedDict
+import logging
+import os
+import threading
+import time
+from typing import TYPE_CHECKING
+from pydantic import BaseModel
+from model_registry import registry
+from text_utils import clean_texts
+from datatypes import CalendarClassification, Message, ClassifiedMessage
 
+if TYPE_CHECKING:
+    from prefilter import Prefilter, PrefilterStats
+
+
+logger = logging.getLogger(__name__)
 
 model_path = "model/bert_classifier_v1"
-classifier = pipeline(
-    "text-classification", 
-    model=model_path, 
-    tokenizer=BertTokenizer.from_pretrained('bert-base-uncased')
+# one of "torch", "onnx" or "onnx-int8", the onnx backends need `uv sync --extra onnx`
+backend = os.getenv("CALENDAR_CLASSIFIER_BACKEND", "torch")
+# trained with `uv run train_prefilter`, the prefilter is skipped when the file is missing
+prefilter_path = os.getenv("CALENDAR_PREFILTER_PATH", "model/prefilter_v1.joblib")
+# cleaned text -> classification entries kept in memory, 0 disables the cache
+cache_size = int(os.getenv("CLASSIFICATION_CACHE_SIZE", "10000"))
+cache_ttl = os.getenv("CLASSIFICATION_CACHE_TTL_SECONDS")
+
+
+CALENDAR_CLASSIFIER = "calendar_classifier"
+CALENDAR_PREFILTER = "calendar_prefilter"
+
+
+def _build_classifier(backend: str):
+    from transformers import pipeline
+    from transformers import BertTokenizer
+
+    tokenizer = BertTokenizer.from_pretrained('bert-base-uncased')
+    if backend == "torch":
+        return pipeline(
+            "text-classification", 
+            model=model_path, 
+            tokenizer=tokenizer
+        )
+    if backend in ("onnx", "onnx-int8"):
+        from onnx_classifier import OnnxTextClassifier, onnx_model_path
+        from inference_service import get_inference_service
+        # the same per worker share of the cores the torch backend gets
+        return OnnxTextClassifier(
+            onnx_model_path(model_path, quantized=backend == "onnx-int8"),
+            model_path,
+            tokenizer,
+            intra_op_threads=get_inference_service().intra_op_threads,
+        )
+    raise ValueError(f"Unknown calendar classifier backend: {backend}")
+
+
+def _load_prefilter() -> "Prefilter | None":
+    from prefilter import load_prefilter
+
+    if not os.path.exists(prefilter_path):
+        logger.info(f"No prefilter found at {prefilter_path}, every message goes to the classifier")
+        return None
+    prefilter = load_prefilter(prefilter_path)
+    recall_target = os.getenv("CALENDAR_PREFILTER_RECALL")
+    if recall_target:
+        prefilter.tune(float(recall_target))
+    return prefilter
+
+
+registry.register(CALENDAR_CLASSIFIER, lambda: _build_classifier(backend))
+registry.register(CALENDAR_PREFILTER, _load_prefilter)
+
+
+def prefilter_stats() -> "PrefilterStats | None":
+    prefilter = registry.get(CALENDAR_PREFILTER)
+    return prefilter.stats if prefilter else None
+
+
+def _prefiltered(texts: list[str], cleaned_texts: list[str]) -> list[dict | None]:
+    prefilter = registry.get(CALENDAR_PREFILTER)
+    if prefilter is None:
+        return [None] * len(texts)
+    return prefilter.classify(texts, cleaned_texts)
+
+
+class CacheStats(BaseModel):
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class ClassificationCache:
+    """
+    LRU cache of classifications keyed on the cleaned message text, `clean_text`
+    folds urls, mentions and channels into placeholders so repeated chatter
+    collapses onto the same key. Entries optionally expire after `ttl_seconds`.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: float | None = None):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.stats = CacheStats()
+        self._entries: OrderedDict[str, tuple[CalendarClassification, float]] = OrderedDict()
+        # classification runs on the inference pool threads
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, cleaned_text: str) -> CalendarClassification | None:
+        with self._lock:
+            entry = self._entries.get(cleaned_text)
+            if entry is not None and self.ttl_seconds is not None and entry[1] < time.monotonic():
+                del self._entries[cleaned_text]
+                self.stats.evictions += 1
+                entry = None
+            if entry is None:
+                self.stats.misses += 1
+                return None
+            self._entries.move_to_end(cleaned_text)
+            self.stats.hits += 1
+            return entry[0]
+
+    def put(self, cleaned_text: str, classification: CalendarClassification):
+        if self.max_size <= 0:
+            return
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds is not None else 0.0
+        with self._lock:
+            self._entries[cleaned_text] = (classification, expires_at)
+            self._entries.move_to_end(cleaned_text)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.stats.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.stats = CacheStats()
+
+
+classification_cache = ClassificationCache(
+    max_size=cache_size, ttl_seconds=float(cache_ttl) if cache_ttl else None
 )
 
 
-def is_calendar_event(data: Message) -> ClassifiedMessage:
-    cleaned_text = clean_text(data.message)
+def _classified_message(data: Message, classification: dict | CalendarClassification) -> ClassifiedMessage:
     return ClassifiedMessage(
         seqid=data.seqid,
         ts=data.ts,
         user=data.user,
         message=data.message,
-        classification=classifier(cleaned_text)[0]
+        classification=classification
     )
+
+
+def is_calendar_event(data: Message) -> ClassifiedMessage:
+    return classify_messages([data], batch_size=1)[0]
+
+
+def classify_messages(messages: list[Message], batch_size: int = 32) -> list[ClassifiedMessage]:
+    """
+    Classify a batch of messages, running one forward pass per `batch_size` texts.
+
+    Texts already in the classification cache and obvious negatives answered by the
+    prefilter never reach the pipeline, and a text repeated within the batch is only
+    classified once. The pipeline pads every forward pass to the longest text it holds,
+    so the texts are sorted by length first to keep similarly sized texts in the same pass.
+    Results are returned in the same order as `messages`.
+    """
+    if not messages:
+        return []
+    cleaned_texts = clean_texts([msg.message for msg in messages])
+    classifications: dict[str, CalendarClassification] = {}
+    uncached: dict[str, str] = {}
+    for msg, cleaned_text in zip(messages, cleaned_texts):
+        if cleaned_text in classifications or cleaned_text in uncached:
+            continue
+        cached = classification_cache.get(cleaned_text)
+        if cached is not None:
+            classifications[cleaned_text] = cached
+        else:
+            uncached[cleaned_text] = msg.message
+
+    if uncached:
+        pending = list(uncached)
+        predictions = dict(zip(pending, _prefiltered(list(uncached.values()), pending)))
+        unfiltered = sorted((text for text, prediction in predictions.items() if prediction is None), key=len)
+        if unfiltered:
+            classifier = registry.get(CALENDAR_CLASSIFIER)
+            predictions.update(zip(unfiltered, classifier(unfiltered, batch_size=batch_size)))
+        for cleaned_text, prediction in predictions.items():
+            classification = CalendarClassification.model_validate(prediction)
+            classification_cache.put(cleaned_text, classification)
+            classifications[cleaned_text] = classification
+
+    return [
+        _classified_message(msg, classifications[cleaned_text])
+        for msg, cleaned_text in zip(messages, cleaned_texts)
+    ]
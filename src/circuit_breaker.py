@@ -0,0 +1,211 @@
+import asyncio
+from collections import deque
+from enum import Enum
+import logging
+import os
+import threading
+import time
+from typing import Awaitable, Callable, TypeVar
+
+import numpy as np
+from pydantic import BaseModel
+
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class BreakerState(str, Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitBreakerStats(BaseModel):
+    state: BreakerState = BreakerState.CLOSED
+    calls: int = 0
+    failures: int = 0
+    slow_calls: int = 0
+    rejected: int = 0
+    trips: int = 0
+
+    @property
+    def failure_rate(self) -> float:
+        return self.failures / self.calls if self.calls else 0.0
+
+
+class CircuitBreaker:
+    """
+    Guards an llm backed stage. The breaker keeps the latency and outcome of the
+    last `window` calls and opens when, over at least `min_calls` of them, the
+    error rate exceeds `max_error_rate` or the p95 latency exceeds
+    `p95_budget_seconds`. A call slower than `deadline_seconds` counts as an
+    error. While open the callers use their fallback, after `reset_seconds` a
+    single probe call is let through (half open) and its outcome closes or
+    reopens the breaker.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        deadline_seconds: float | None = None,
+        p95_budget_seconds: float | None = None,
+        max_error_rate: float = 0.5,
+        window: int = 20,
+        min_calls: int = 5,
+        reset_seconds: float = 30.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.deadline_seconds = deadline_seconds
+        self.p95_budget_seconds = p95_budget_seconds
+        self.max_error_rate = max_error_rate
+        self.min_calls = min_calls
+        self.reset_seconds = reset_seconds
+        self.stats = CircuitBreakerStats()
+        self._clock = clock
+        self._outcomes: deque[tuple[float, bool]] = deque(maxlen=window)
+        self._opened_at = 0.0
+        self._probing = False
+        self._probe_started = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> BreakerState:
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> BreakerState:
+        if self.stats.state == BreakerState.OPEN and self._clock() - self._opened_at >= self.reset_seconds:
+            self._transition(BreakerState.HALF_OPEN)
+        return self.stats.state
+
+    def _transition(self, state: BreakerState):
+        if state != self.stats.state:
+            logger.warning(f"Circuit breaker {self.name}: {self.stats.state.value} -> {state.value}")
+        self.stats.state = state
+        if state == BreakerState.OPEN:
+            self.stats.trips += 1
+            self._opened_at = self._clock()
+        self._probing = False
+
+    @property
+    def p95_seconds(self) -> float:
+        with self._lock:
+            return self._p95()
+
+    def _p95(self) -> float:
+        if not self._outcomes:
+            return 0.0
+        return float(np.percentile([latency for latency, _ in self._outcomes], 95))
+
+    @property
+    def error_rate(self) -> float:
+        with self._lock:
+            return self._error_rate()
+
+    def _error_rate(self) -> float:
+        if not self._outcomes:
+            return 0.0
+        return sum(failed for _, failed in self._outcomes) / len(self._outcomes)
+
+    def allow(self) -> bool:
+        """Whether the guarded call should run, the caller falls back when it should not."""
+        with self._lock:
+            state = self._current_state()
+            if state == BreakerState.CLOSED:
+                return True
+            # a probe that never reported back does not keep the breaker half open forever
+            stale_probe = self._probing and self._clock() - self._probe_started >= self.reset_seconds
+            if state == BreakerState.HALF_OPEN and (not self._probing or stale_probe):
+                self._probing = True
+                self._probe_started = self._clock()
+                return True
+            self.stats.rejected += 1
+            return False
+
+    def release_probe(self):
+        """Hand back a half open probe that ended without calling the llm, the next caller probes instead."""
+        with self._lock:
+            self._probing = False
+
+    def record_success(self, latency_seconds: float):
+        slow = self.deadline_seconds is not None and latency_seconds > self.deadline_seconds
+        with self._lock:
+            self.stats.slow_calls += slow
+        self._record(latency_seconds, failed=slow)
+
+    def record_failure(self, latency_seconds: float | None = None):
+        self._record(latency_seconds if latency_seconds is not None else self.deadline_seconds or 0.0, failed=True)
+
+    def _record(self, latency_seconds: float, failed: bool):
+        with self._lock:
+            self.stats.calls += 1
+            self.stats.failures += failed
+            self._outcomes.append((latency_seconds, failed))
+            state = self._current_state()
+            if state == BreakerState.HALF_OPEN:
+                if failed:
+                    self._transition(BreakerState.OPEN)
+                else:
+                    self._outcomes.clear()
+                    self._transition(BreakerState.CLOSED)
+            elif state == BreakerState.CLOSED and len(self._outcomes) >= self.min_calls:
+                too_slow = self.p95_budget_seconds is not None and self._p95() > self.p95_budget_seconds
+                if too_slow or self._error_rate() > self.max_error_rate:
+                    self._transition(BreakerState.OPEN)
+
+    def call(self, function: Callable[..., T], *args, fallback: Callable[..., T], **kwargs) -> T:
+        """
+        `function(*args, **kwargs)` when the breaker allows it, `fallback(*args, **kwargs)`
+        when it is open or the call raises.
+        """
+        if not self.allow():
+            return fallback(*args, **kwargs)
+        started = time.perf_counter()
+        try:
+            result = function(*args, **kwargs)
+        except Exception as e:
+            self.record_failure(time.perf_counter() - started)
+            logger.warning(f"Circuit breaker {self.name}: call failed, using the fallback: {e}")
+            return fallback(*args, **kwargs)
+        self.record_success(time.perf_counter() - started)
+        return result
+
+    async def acall(self, function: Callable[..., Awaitable[T]], *args, fallback: Callable[..., T], **kwargs) -> T:
+        """
+        Async version of `call`, `function` is awaited and `fallback` stays a plain
+        function. Unlike a blocking call the await is cancelled at `deadline_seconds`,
+        which counts as a failure and returns the fallback.
+        """
+        if not self.allow():
+            return fallback(*args, **kwargs)
+        started = time.perf_counter()
+        try:
+            async with asyncio.timeout(self.deadline_seconds):
+                result = await function(*args, **kwargs)
+        except TimeoutError:
+            self.record_failure(time.perf_counter() - started)
+            logger.warning(f"Circuit breaker {self.name}: call missed its {self.deadline_seconds}s deadline, using the fallback")
+            return fallback(*args, **kwargs)
+        except Exception as e:
+            self.record_failure(time.perf_counter() - started)
+            logger.warning(f"Circuit breaker {self.name}: call failed, using the fallback: {e}")
+            return fallback(*args, **kwargs)
+        self.record_success(time.perf_counter() - started)
+        return result
+
+
+def breaker_from_env(name: str, deadline_env: str) -> CircuitBreaker:
+    """Breaker configured from the LLM_BREAKER_* settings with its deadline read from `deadline_env`."""
+    deadline_seconds = os.getenv(deadline_env)
+    p95_budget_seconds = os.getenv("LLM_BREAKER_P95_SECONDS")
+    return CircuitBreaker(
+        name,
+        deadline_seconds=float(deadline_seconds) if deadline_seconds else None,
+        p95_budget_seconds=float(p95_budget_seconds) if p95_budget_seconds else None,
+        max_error_rate=float(os.getenv("LLM_BREAKER_MAX_ERROR_RATE", "0.5")),
+        window=int(os.getenv("LLM_BREAKER_WINDOW", "20")),
+        reset_seconds=float(os.getenv("LLM_BREAKER_RESET_SECONDS", "30")),
+    )
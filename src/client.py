@@ -1,15 +1,43 @@
 import asyncio
+import copy
 from datetime import datetime, timezone
 import os
-from pydantic import BaseModel
+import time
+from typing import Any, Awaitable, Callable
+from pydantic import BaseModel, ConfigDict, Field
 import websockets
 from websockets.exceptions import ConnectionClosedOK, ConnectionClosedError, InvalidURI
-from calendar_event_classifier import is_calendar_event
-from conversations.ops import disentangle_message, update_completed_conversation, update_suspended_conversation
-from conversations.disentanglement.rule_based_classifier import rule_based_classifier
-from conversations.disentanglement.llm_based_classifier import llm_based_classifier
-from conversations.extract_date_time_llm_model import model as event_datetime_extractor
-from datatypes import Message, Conversation
+from calendar_event_classifier import CALENDAR_CLASSIFIER, CALENDAR_PREFILTER, is_calendar_event
+from circuit_breaker import CircuitBreaker, breaker_from_env
+from embedding_service import EmbeddingService
+from inference_service import get_inference_service
+from llm_cache import get_llm_cache
+from llm_gateway import log_llm_gateway_stats
+from llm_utils import llm_usage
+from model_registry import warmup
+from conversations.candidate_index import CandidateIndex
+from conversations.ops import (
+    disentangle_message,
+    disentangle_message_async,
+    disentangle_message_batched,
+    disentangle_message_choice_async,
+    update_completed_conversation,
+    update_suspended_conversation,
+)
+from conversations.disentanglement.cascade_classifier import CascadeClassifier
+from conversations.disentanglement.rule_based_classifier import unencoded_messages
+from conversations.disentanglement.vectorized_rule_classifier import VectorizedRuleClassifier
+from conversations.disentanglement.llm_based_classifier import (
+    async_choose_conversation,
+    async_llm_based_classifier,
+    llm_based_classifier,
+)
+from conversations.extract_date_time_llm_model import (
+    async_model as async_event_datetime_extractor,
+    model as event_datetime_extractor,
+)
+from conversations.extract_date_time_rules import extract_event as extract_event_with_rules, min_rule_confidence
+from datatypes import ClassifiedMessage, Message, Conversation
 from dotenv import load_dotenv
 import aiofiles as aiof
 import logging
@@ -17,8 +45,52 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+class ExtractionStats(BaseModel):
+    extractions: int = 0
+    # confident enough temporal expression rules, the llm was not asked
+    rule_extractions: int = 0
+    # suspended conversations whose lines did not change since their last extraction
+    unchanged: int = 0
+    # new lines without any temporal cue, only counted when extraction is gated on them
+    no_temporal_cue: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.extractions + self.rule_extractions + self.unchanged + self.no_temporal_cue
+        return (self.unchanged + self.no_temporal_cue) / total if total else 0.0
+
+
 class AppState(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
     calender_conversations: list[Conversation] = []
+    # bounds how many conversations each message is compared against
+    candidate_index: CandidateIndex = Field(
+        default_factory=lambda: CandidateIndex(top_k=int(os.getenv("DISENTANGLE_TOP_K", "10"))),
+        exclude=True,
+    )
+    # rule scores of all open conversations kept as arrays for the fallback classifier
+    rule_classifier: VectorizedRuleClassifier = Field(default_factory=VectorizedRuleClassifier, exclude=True)
+    # `cascade` mode: rules decide unless their confidence falls inside this band
+    cascade_classifier: CascadeClassifier = Field(
+        default_factory=lambda: CascadeClassifier(
+            low=float(os.getenv("DISENTANGLE_CASCADE_LOW", "0.2")),
+            high=float(os.getenv("DISENTANGLE_CASCADE_HIGH", "0.8")),
+        ),
+        exclude=True,
+    )
+    # the llm stages fall back to the rules, or keep the previous datetime, while their breaker is open
+    disentangle_breaker: CircuitBreaker = Field(
+        default_factory=lambda: breaker_from_env("disentangle", "LLM_DISENTANGLE_DEADLINE_SECONDS"),
+        exclude=True,
+    )
+    extraction_breaker: CircuitBreaker = Field(
+        default_factory=lambda: breaker_from_env("extract_datetime", "LLM_EXTRACTION_DEADLINE_SECONDS"),
+        exclude=True,
+    )
+    extraction_stats: ExtractionStats = Field(default_factory=ExtractionStats, exclude=True)
+    # whether the last llm disentanglement call reached the model
+    llm_reachable: bool = True
 
 
 async def store_probable_calendar_conversations(conv: Conversation):
@@ -28,33 +100,176 @@ async def store_probable_calendar_conversations(conv: Conversation):
 
 
 def process_message(state: AppState, message: Message) -> AppState:
-    classified_message = is_calendar_event(message)
-    logger.debug(f"Classified message: {classified_message}")
-    
-    confident_it_is_a_calendar_event = (
+    return process_classified_message(state, is_calendar_event(message))
+
+
+def is_confident_calendar_event(classified_message: ClassifiedMessage) -> bool:
+    return (
         classified_message.classification.label == "LABEL_1"
         and classified_message.classification.score > 0.8
     )
+
+
+def _disentangle_with_rules(state: AppState, classified_message: ClassifiedMessage) -> AppState:
+    state.calender_conversations = disentangle_message_batched(
+        state.calender_conversations, 
+        classified_message, 
+        state.rule_classifier,
+    )
+    return state
+
+
+async def _adisentangle_with_rules(
+    state: AppState, classified_message: ClassifiedMessage, embedding_service: EmbeddingService | None
+) -> AppState:
+    if embedding_service is not None:
+        # encode what the rules need on the inference pool, the first fallback also loads the model there
+        await embedding_service.embed_messages(
+            unencoded_messages(state.calender_conversations, classified_message)
+        )
+    return _disentangle_with_rules(state, classified_message)
+
+
+class _LLMCalls:
+    """
+    Counts the llm calls of one disentanglement. Without candidates, or when the
+    cascade rules decide every comparison, no call is made and the breaker has
+    nothing to learn from.
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def wrap(self, function: Callable[..., Any]) -> Callable[..., Any]:
+        def counted(*args, **kwargs):
+            self.count += 1
+            return function(*args, **kwargs)
+        return counted
+
+    def awrap(self, function: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+        async def counted(*args, **kwargs):
+            self.count += 1
+            return await function(*args, **kwargs)
+        return counted
+
+    def cascade(self, cascade: CascadeClassifier) -> CascadeClassifier:
+        """The cascade with its llm counted, the rules and the stats stay shared with `cascade`."""
+        counted = copy.copy(cascade)
+        counted.llm_classifier = self.wrap(cascade.llm_classifier)
+        counted.async_llm_classifier = self.awrap(cascade.async_llm_classifier)
+        return counted
+
+
+def _record_llm_outcome(state: AppState, calls: _LLMCalls, started: float, failed: bool):
+    breaker = state.disentangle_breaker
+    if not calls.count:
+        # the llm was never asked, a half open probe goes to the next message instead
+        breaker.release_probe()
+        return
+    if failed:
+        breaker.record_failure(time.perf_counter() - started)
+    else:
+        breaker.record_success(time.perf_counter() - started)
+    state.llm_reachable = not failed
+
+
+def _log_calendar_message(classified_message: ClassifiedMessage):
+    logger.info(
+        f"Received new message: '{classified_message.message}'"
+        f" with confidence {classified_message.classification.score}"
+    )
+
+
+def process_classified_message(
+    state: AppState, classified_message: ClassifiedMessage, mode: str = "pairwise"
+) -> AppState:
+    logger.debug(f"Classified message: {classified_message}")
     
-    if confident_it_is_a_calendar_event:
+    if is_confident_calendar_event(classified_message):
+        breaker = state.disentangle_breaker
+        if not breaker.allow():
+            state.llm_reachable = False
+            state = _disentangle_with_rules(state, classified_message)
+            _log_calendar_message(classified_message)
+            return state
         # TODO: add ollama docker and compose these two together
+        calls = _LLMCalls()
+        started = time.perf_counter()
         try:
             state.calender_conversations = disentangle_message(
                 state.calender_conversations, 
                 classified_message, 
-                llm_based_classifier
+                calls.cascade(state.cascade_classifier) if mode == "cascade" else calls.wrap(llm_based_classifier),
+                state.candidate_index,
             )
-        except ConnectionError:
-            state.calender_conversations = disentangle_message(
-                state.calender_conversations, 
-                classified_message, 
-                rule_based_classifier
-            )
-        
-        logger.info(
-            f"Received new message: '{classified_message.message}'"
-            f" with confidence {classified_message.classification.score}"
-        )
+            # a slow call can not be interrupted here, the breaker counts it as an error afterwards
+            _record_llm_outcome(state, calls, started, failed=False)
+        except Exception as e:
+            # ollama down or erroring, or a response that does not parse, like CircuitBreaker.call
+            logger.warning(f"LLM disentanglement failed for message {classified_message.seqid}, using the rules: {e}")
+            _record_llm_outcome(state, calls, started, failed=True)
+            state = _disentangle_with_rules(state, classified_message)
+        _log_calendar_message(classified_message)
+    return state
+
+
+async def aprocess_classified_message(
+    state: AppState,
+    classified_message: ClassifiedMessage,
+    max_concurrency: int = 4,
+    deadline_seconds: float | None = None,
+    mode: str = "pairwise",
+    embedding_service: EmbeddingService | None = None,
+) -> AppState:
+    """
+    Same as `process_classified_message` through the async ollama client so the
+    loop keeps running while the llm works. In `pairwise` mode the candidate
+    conversations are compared concurrently, in `multi_choice` mode a single call
+    picks one of them and in `cascade` mode only the comparisons the rules are
+    unsure about reach the llm. Falls back to the rules when the llm call fails,
+    the deadline passes or the disentanglement breaker is open, the texts the
+    rules compare are then encoded through `embedding_service` when given.
+    """
+    logger.debug(f"Classified message: {classified_message}")
+
+    if is_confident_calendar_event(classified_message):
+        breaker = state.disentangle_breaker
+        if not breaker.allow():
+            state.llm_reachable = False
+            state = await _adisentangle_with_rules(state, classified_message, embedding_service)
+            _log_calendar_message(classified_message)
+            return state
+        calls = _LLMCalls()
+        started = time.perf_counter()
+        try:
+            if mode == "multi_choice":
+                state.calender_conversations = await disentangle_message_choice_async(
+                    state.calender_conversations,
+                    classified_message,
+                    calls.awrap(async_choose_conversation),
+                    state.candidate_index,
+                    deadline_seconds=deadline_seconds,
+                )
+            else:
+                state.calender_conversations = await disentangle_message_async(
+                    state.calender_conversations,
+                    classified_message,
+                    calls.cascade(state.cascade_classifier).classify_async if mode == "cascade"
+                    else calls.awrap(async_llm_based_classifier),
+                    state.candidate_index,
+                    max_concurrency=max_concurrency,
+                    deadline_seconds=deadline_seconds,
+                )
+            _record_llm_outcome(state, calls, started, failed=False)
+        except TimeoutError:
+            logger.warning(f"LLM disentanglement missed its deadline for message {classified_message.seqid}")
+            _record_llm_outcome(state, calls, started, failed=True)
+            state = await _adisentangle_with_rules(state, classified_message, embedding_service)
+        except Exception as e:
+            logger.warning(f"LLM disentanglement failed for message {classified_message.seqid}, using the rules: {e}")
+            _record_llm_outcome(state, calls, started, failed=True)
+            state = await _adisentangle_with_rules(state, classified_message, embedding_service)
+        _log_calendar_message(classified_message)
     return state
 
 
@@ -75,13 +290,83 @@ def mark_completed_conversations(state: AppState):
     return state
 
 
-def extract_calendar_datetime_from_conversations(state: AppState): 
-    updated_conversations = []
+def _extract_event_datetime(state: AppState, conversation: Conversation) -> datetime | None:
+    event_datetime = event_datetime_extractor(conversation)
+    # only a successful extraction is remembered, a failed one is retried with the next message
+    conversation.extraction_state.mark(conversation.lines)
+    state.extraction_stats.extractions += 1
+    return event_datetime
+
+
+async def _aextract_event_datetime(state: AppState, conversation: Conversation) -> datetime | None:
+    lines = list(conversation.lines)
+    event_datetime = await async_event_datetime_extractor(conversation)
+    conversation.extraction_state.mark(lines)
+    state.extraction_stats.extractions += 1
+    return event_datetime
+
+
+def _conversations_for_llm(
+    state: AppState, temporal_cues_only: bool, min_confidence: float | None
+) -> list[tuple[Conversation, datetime | None]]:
+    """
+    Settle the suspended conversations the llm is not needed for, and return the
+    others with the datetime to keep should the llm fail.
+    """
+    min_confidence = min_rule_confidence() if min_confidence is None else min_confidence
+    pending = []
     for conversation in state.calender_conversations:
-        if conversation.suspended:
-            conversation.event_datetime = event_datetime_extractor(conversation)
-        updated_conversations.append(conversation)
-    state.calender_conversations = updated_conversations
+        if not conversation.suspended:
+            continue
+        extraction = conversation.extraction_state
+        if not extraction.changed(conversation.lines):
+            state.extraction_stats.unchanged += 1
+        elif temporal_cues_only and not extraction.new_temporal_cue(conversation.lines):
+            extraction.mark(conversation.lines)
+            state.extraction_stats.no_temporal_cue += 1
+        else:
+            rules = extract_event_with_rules(conversation.lines)
+            if rules.confidence >= min_confidence:
+                conversation.event_datetime = rules.event_datetime
+                extraction.mark(conversation.lines)
+                state.extraction_stats.rule_extractions += 1
+            else:
+                # while the llm is unavailable the rules' best guess beats no datetime at all
+                pending.append((conversation, rules.event_datetime or conversation.event_datetime))
+    return pending
+
+
+def extract_calendar_datetime_from_conversations(
+    state: AppState, temporal_cues_only: bool = False, min_confidence: float | None = None
+):
+    """
+    Extract the event datetime of the suspended conversations that gained lines
+    since their last extraction. With `temporal_cues_only` the new lines also need
+    to mention a time or date, otherwise the previous datetime is kept. The
+    temporal expression rules answer when their confidence reaches
+    `min_confidence`, the llm is only asked about the other conversations.
+    """
+    for conversation, fallback_datetime in _conversations_for_llm(state, temporal_cues_only, min_confidence):
+        conversation.event_datetime = state.extraction_breaker.call(
+            _extract_event_datetime, state, conversation,
+            fallback=lambda *_: fallback_datetime,
+        )
+    return state
+
+
+async def aextract_calendar_datetime_from_conversations(
+    state: AppState, temporal_cues_only: bool = False, min_confidence: float | None = None
+):
+    """
+    Same as `extract_calendar_datetime_from_conversations` through the async ollama
+    client. The llm gateway slots are awaited, a blocking wait on the loop would
+    keep the disentanglement calls holding them from ever releasing.
+    """
+    for conversation, fallback_datetime in _conversations_for_llm(state, temporal_cues_only, min_confidence):
+        conversation.event_datetime = await state.extraction_breaker.acall(
+            _aextract_event_datetime, state, conversation,
+            fallback=lambda *_: fallback_datetime,
+        )
     return state
 
 
@@ -93,6 +378,16 @@ async def write_completed_conversations(conversations: list[Conversation]):
 
 async def listen(url):
     state = AppState()
+    inference_service = get_inference_service()
+    embedding_service = EmbeddingService(
+        max_batch_size=int(os.getenv("EMBEDDING_MAX_BATCH_SIZE", "64")),
+        max_wait_seconds=float(os.getenv("EMBEDDING_MAX_WAIT_MS", "10")) / 1000,
+        inference_service=inference_service,
+    )
+    max_concurrency = int(os.getenv("LLM_DISENTANGLE_CONCURRENCY", "4"))
+    mode = os.getenv("LLM_DISENTANGLE_MODE", "pairwise")
+    deadline_seconds = os.getenv("LLM_DISENTANGLE_DEADLINE_SECONDS")
+    temporal_cues_only = os.getenv("EXTRACTION_TEMPORAL_CUES_ONLY", "false").lower() in ("1", "true", "yes")
     try:
         async with websockets.connect(url) as websocket:
             while True:
@@ -100,9 +395,23 @@ async def listen(url):
                     await websocket.recv(decode=True)
                 )
                 
-                state = process_message(state, message)
+                # classification runs on the inference pool so the loop is not blocked
+                classified_message = await inference_service.run(is_calendar_event, message)
+                if mode == "cascade" and is_confident_calendar_event(classified_message):
+                    # encode everything the rules need in one batch off the loop
+                    await embedding_service.embed_messages(
+                        unencoded_messages(state.calender_conversations, classified_message)
+                    )
+                state = await aprocess_classified_message(
+                    state,
+                    classified_message,
+                    max_concurrency=max_concurrency,
+                    deadline_seconds=float(deadline_seconds) if deadline_seconds else None,
+                    mode=mode,
+                    embedding_service=embedding_service,
+                )
                 state = mark_suspended_conversations(state)
-                state = extract_calendar_datetime_from_conversations(state)
+                state = await aextract_calendar_datetime_from_conversations(state, temporal_cues_only)
                 state = mark_completed_conversations(state)
 
                 logger.debug(f"Updated State: {state}")
@@ -120,6 +429,44 @@ async def listen(url):
     except InvalidURI:
         logger.error(f"Invalid WebSocket URI: {url}")
 
+    finally:
+        await embedding_service.aclose()
+        logger.info(
+            f"Encoded {embedding_service.stats.texts} texts in {embedding_service.stats.batches} batches,"
+            f" mean batch size {embedding_service.stats.mean_batch_size:.1f},"
+            f" mean latency {embedding_service.stats.mean_latency_ms:.1f}ms"
+        )
+        for name, usage in llm_usage.items():
+            logger.info(
+                f"LLM {name}: {usage.calls} calls, {usage.prompt_tokens} prompt tokens,"
+                f" {usage.mean_response_tokens:.1f} response tokens per call"
+            )
+        extraction_stats = state.extraction_stats
+        logger.info(
+            f"Datetime extraction: {extraction_stats.rule_extractions} by the rules, {extraction_stats.extractions} by the llm,"
+            f" {extraction_stats.unchanged} unchanged and {extraction_stats.no_temporal_cue} without a temporal cue skipped,"
+            f" hit rate {extraction_stats.hit_rate:.2f}"
+        )
+        for breaker in (state.disentangle_breaker, state.extraction_breaker):
+            logger.info(
+                f"Circuit breaker {breaker.name}: {breaker.stats.state.value}, {breaker.stats.trips} trips,"
+                f" {breaker.stats.rejected} calls sent to the fallback, p95 {breaker.p95_seconds:.2f}s,"
+                f" error rate {breaker.error_rate:.2f}"
+            )
+        if mode == "cascade":
+            cascade_stats = state.cascade_classifier.stats
+            logger.info(
+                f"Cascade: {cascade_stats.decisions} decisions, {cascade_stats.rule_rate:.2f} by the rules,"
+                f" {cascade_stats.llm_rate:.2f} escalated to the llm"
+            )
+        log_llm_gateway_stats()
+        llm_cache = get_llm_cache()
+        if llm_cache is not None:
+            logger.info(
+                f"LLM cache: {llm_cache.stats.hits} hits, {llm_cache.stats.misses} misses,"
+                f" hit rate {llm_cache.stats.hit_rate:.2f}, {llm_cache.stats.evictions} evictions"
+            )
+
 
 async def write_out_partial_conversations(state: AppState):
     for conv in state.calender_conversations:
@@ -132,6 +479,8 @@ def main():
         format="%(asctime)s [%(levelname)s] %(message)s",
         datefmt="%Y-%m-%d %H:%M:%S"
     )
+    # the sentence transformer is only loaded if the rule based fallback is used
+    warmup(CALENDAR_CLASSIFIER, CALENDAR_PREFILTER)
     asyncio.run(listen(os.getenv("WS_SOCK")))
 
 
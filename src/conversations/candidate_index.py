@@ -0,0 +1,136 @@
+from collections import defaultdict
+from datetime import datetime
+import logging
+import re
+
+from pydantic import BaseModel
+
+from datatypes import ClassifiedMessage, Conversation
+
+
+logger = logging.getLogger(__name__)
+
+# `@nick` anywhere in the message, or the IRC style `nick: ...` address at its start
+_ADDRESS_PATTERN = re.compile(r"@(\w+)|^([^\s:]+):\s")
+
+
+def addressed_users(text: str) -> set[str]:
+    return {mention or address for mention, address in _ADDRESS_PATTERN.findall(text)}
+
+
+class CandidateIndexStats(BaseModel):
+    messages: int = 0
+    compared: int = 0
+    pruned: int = 0
+
+    @property
+    def pruned_rate(self) -> float:
+        total = self.compared + self.pruned
+        return self.pruned / total if total else 0.0
+
+
+class _Entry(BaseModel):
+    conversation: Conversation
+    lines: int = 0
+    last_activity: float = 0.0
+    bucket: int | None = None
+
+
+class CandidateIndex:
+    """
+    Index of the open conversations by participant, by the users addressed in them
+    and by the time bucket of their last line. `candidates` ranks the conversations
+    sharing a key with the new message and keeps the `top_k` best, so the classifier
+    only runs against a bounded set of conversations.
+    """
+
+    def __init__(self, top_k: int = 10, bucket_seconds: int = 60, recent_buckets: int = 5):
+        self.top_k = top_k
+        self.bucket_seconds = bucket_seconds
+        self.recent_buckets = recent_buckets
+        self.stats = CandidateIndexStats()
+        self._entries: dict[int, _Entry] = {}
+        self._participants: dict[str, set[int]] = defaultdict(set)
+        self._addressed: dict[str, set[int]] = defaultdict(set)
+        self._buckets: dict[int, set[int]] = defaultdict(set)
+
+    def _bucket(self, ts: datetime) -> int:
+        return int(ts.timestamp()) // self.bucket_seconds
+
+    def update(self, conversation: Conversation):
+        """Index the lines appended to the conversation since it was last indexed."""
+        conversation_id = id(conversation)
+        entry = self._entries.get(conversation_id)
+        if entry is None:
+            entry = self._entries[conversation_id] = _Entry(conversation=conversation)
+        pending = conversation.lines[entry.lines:]
+        if not pending:
+            return
+
+        for line in pending:
+            self._participants[line.user].add(conversation_id)
+            for user in addressed_users(line.message):
+                self._addressed[user].add(conversation_id)
+        entry.lines = len(conversation.lines)
+        entry.last_activity = conversation.lines[-1].ts.timestamp()
+
+        bucket = self._bucket(conversation.lines[-1].ts)
+        if bucket != entry.bucket:
+            if entry.bucket is not None:
+                self._buckets[entry.bucket].discard(conversation_id)
+            self._buckets[bucket].add(conversation_id)
+            entry.bucket = bucket
+
+    def remove(self, conversation: Conversation):
+        conversation_id = id(conversation)
+        entry = self._entries.pop(conversation_id, None)
+        if entry is None:
+            return
+        for conversation_ids in (*self._participants.values(), *self._addressed.values()):
+            conversation_ids.discard(conversation_id)
+        if entry.bucket is not None:
+            self._buckets[entry.bucket].discard(conversation_id)
+
+    def sync(self, conversations: list[Conversation]):
+        """Drop conversations that left the list and index the new or updated ones."""
+        live = {id(conversation): conversation for conversation in conversations}
+        for conversation_id, entry in list(self._entries.items()):
+            if live.get(conversation_id) is not entry.conversation:
+                self.remove(entry.conversation)
+        for conversation in conversations:
+            self.update(conversation)
+
+    def candidates(
+        self, conversations: list[Conversation], message: ClassifiedMessage
+    ) -> list[Conversation]:
+        self.sync(conversations)
+
+        scores: dict[int, int] = defaultdict(int)
+        for conversation_id in self._participants.get(message.user, ()):
+            scores[conversation_id] += 2
+        for user in addressed_users(message.message):
+            for conversation_id in self._participants.get(user, ()):
+                scores[conversation_id] += 3
+        for conversation_id in self._addressed.get(message.user, ()):
+            scores[conversation_id] += 2
+        bucket = self._bucket(message.ts)
+        for recent_bucket in range(bucket - self.recent_buckets + 1, bucket + 1):
+            for conversation_id in self._buckets.get(recent_bucket, ()):
+                scores[conversation_id] += 1
+
+        ranked = sorted(
+            scores,
+            key=lambda conversation_id: (scores[conversation_id], self._entries[conversation_id].last_activity),
+            reverse=True,
+        )
+        selected = set(ranked[:self.top_k])
+        candidates = [conversation for conversation in conversations if id(conversation) in selected]
+
+        self.stats.messages += 1
+        self.stats.compared += len(candidates)
+        self.stats.pruned += len(conversations) - len(candidates)
+        logger.debug(
+            f"Comparing message {message.seqid} against {len(candidates)}"
+            f" of {len(conversations)} conversations"
+        )
+        return candidates
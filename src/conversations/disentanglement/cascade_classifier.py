@@ -0,0 +1,128 @@
+import logging
+from typing import Awaitable, Callable, Mapping
+
+from pydantic import BaseModel
+
+from conversations.disentanglement.rule_based_classifier import (
+    DECISION,
+    RULE_BOOK,
+    Condition,
+    LazyScores,
+    Rule,
+    condition_margin,
+)
+from datatypes import ClassifiedMessage, Conversation
+
+
+logger = logging.getLogger(__name__)
+
+
+class CascadeStats(BaseModel):
+    rule_matches: int = 0
+    rule_rejections: int = 0
+    escalations: int = 0
+
+    @property
+    def decisions(self) -> int:
+        return self.rule_matches + self.rule_rejections + self.escalations
+
+    @property
+    def rule_rate(self) -> float:
+        return (self.rule_matches + self.rule_rejections) / self.decisions if self.decisions else 0.0
+
+    @property
+    def llm_rate(self) -> float:
+        return self.escalations / self.decisions if self.decisions else 0.0
+
+
+def match_confidence(
+    scores: Mapping[str, float] | LazyScores,
+    decision: list[list[Condition]] = DECISION,
+) -> float:
+    """
+    How clearly the rule scores satisfy the decision, between 0 and 1. Each
+    condition is measured by its margin from its threshold, a clause is as clear
+    as its weakest condition and the decision as its clearest clause. Above 0.5
+    the decision holds and below it does not, exactly as `is_same_conversation`
+    says, close to 0.5 some score sits right on its threshold.
+
+    With `LazyScores` the clauses are read cheapest first, a clause is left as
+    soon as it cannot beat the clearest one so far and reading stops once a
+    clause holds beyond doubt, so the expensive rules only run when they can
+    change the result.
+    """
+    lazy = isinstance(scores, LazyScores)
+    margin = -1.0
+    clauses = [clause for clause in decision if clause]
+    while clauses and margin < 1.0:
+        clause = scores.cheapest(clauses) if lazy else clauses[0]
+        clauses.remove(clause)
+        conditions = sorted(clause, key=lambda condition: scores.cost(condition[0])) if lazy else clause
+        strength = 1.0
+        for condition in conditions:
+            strength = min(strength, condition_margin(condition, scores[condition[0]]))
+            if strength <= margin:
+                break
+        margin = max(margin, strength)
+    return (margin + 1.0) / 2
+
+
+class CascadeClassifier:
+    """
+    Rules first, llm for the ambiguous cases. The rule decision stands on its own
+    when its `match_confidence` is at or above `high` (a match) or at or below
+    `low` (no match), only the comparisons with a score close to its threshold are
+    escalated to the llm. Outside the band the verdict is always the one of
+    `rule_based_classifier`.
+    """
+
+    def __init__(
+        self,
+        llm_classifier: Callable[[Conversation, ClassifiedMessage], bool] | None = None,
+        async_llm_classifier: Callable[[Conversation, ClassifiedMessage], Awaitable[bool]] | None = None,
+        low: float = 0.2,
+        high: float = 0.8,
+        rules: list[Rule] = RULE_BOOK,
+        decision: list[list[Condition]] = DECISION,
+    ):
+        if not 0.0 <= low <= high <= 1.0:
+            raise ValueError(f"Expected 0 <= low <= high <= 1, got low={low} and high={high}")
+        if llm_classifier is None or async_llm_classifier is None:
+            from conversations.disentanglement.llm_based_classifier import (
+                async_llm_based_classifier,
+                llm_based_classifier,
+            )
+            llm_classifier = llm_classifier or llm_based_classifier
+            async_llm_classifier = async_llm_classifier or async_llm_based_classifier
+        self.llm_classifier = llm_classifier
+        self.async_llm_classifier = async_llm_classifier
+        self.low = low
+        self.high = high
+        self.rules = rules
+        self.decision = decision
+        self.stats = CascadeStats()
+
+    def rule_verdict(self, conversation: Conversation, message: ClassifiedMessage) -> bool | None:
+        """The decision of the rules, None when the scores fall inside the band."""
+        scores = LazyScores(conversation, message, self.rules)
+        confidence = match_confidence(scores, self.decision)
+        scores.record_stats()
+        # the side of 0.5 is the rule decision, the band only says whether it is clear enough
+        matched = confidence > 0.5
+        if matched and confidence >= self.high:
+            self.stats.rule_matches += 1
+            return True
+        if not matched and confidence <= self.low:
+            self.stats.rule_rejections += 1
+            return False
+        logger.debug(f"Rule confidence {confidence:.2f} for message {message.seqid} is ambiguous, asking the llm")
+        self.stats.escalations += 1
+        return None
+
+    def __call__(self, conversation: Conversation, message: ClassifiedMessage) -> bool:
+        verdict = self.rule_verdict(conversation, message)
+        return self.llm_classifier(conversation, message) if verdict is None else verdict
+
+    async def classify_async(self, conversation: Conversation, message: ClassifiedMessage) -> bool:
+        verdict = self.rule_verdict(conversation, message)
+        return await self.async_llm_classifier(conversation, message) if verdict is None else verdict
@@ -3,14 +3,18 @@ from ollama import chat, AsyncClient
 from pydantic import BaseModel, Field
 
 from datatypes import ClassifiedMessage
+from llm_utils import acached_chat, reasoning_enabled, response_model
+from prompt_builder import chat_options
 
 CLIENT = AsyncClient(host="http://127.0.0.1:11434")
 
 class Response(BaseModel):
     '''output describing whether the new message is continuation of any of the previous message'''
-    new_message: str = Field(description="the new incoming message")
     option: int = Field(description="Which of the option is this message a continuation, -1 if niether of them")
-    reason: str = Field(description="reason for your choice")
+
+
+class ReasonedResponse(Response):
+    reason: str = Field(description="short reason for your choice")
 
 
 async def __format_options(previous_messages):
@@ -42,22 +46,23 @@ async def classify_message(previous_messages: list[ClassifiedMessage], msg: Clas
         the new message:
         {msg.message}
 
-        Provide your classification response with reasoning below,
+        Provide your classification response{" with reasoning" if reasoning_enabled() else ""} below,
         Response:
     """
-    response = await CLIENT.chat(
+    output_model = response_model(Response, ReasonedResponse)
+    response = await acached_chat(
+        "disentangle_last_six",
+        CLIENT.chat,
         messages = [
             {'role': 'user', 'content': prompt},
         ],
         model=model,
-        format=Response.model_json_schema(),
-        options={
-            'temperature': 0,
-            'num_ctx': 8192
-        },
+        format=output_model.model_json_schema(),
+        output_model=output_model,
+        options=chat_options(prompt, model),
         keep_alive=True
     )
-    return Response.model_validate_json(response.message.content or "")
+    return output_model.model_validate_json(response.message.content or "")
 
 
 async def llm_based_classifier(last_6_messages: list[ClassifiedMessage], message: ClassifiedMessage) -> int:
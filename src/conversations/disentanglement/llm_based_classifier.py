@@ -1,18 +1,29 @@
 import logging
+from typing import Literal
 from ollama import chat
 from pydantic import BaseModel, Field
 
 from datatypes import ClassifiedMessage, Conversation, Message
+from llm_utils import (
+    acached_chat,
+    cached_chat,
+    get_async_client,
+    prompt_examples,
+    reasoning_enabled,
+    response_model,
+)
+from prompt_builder import chat_options, count_tokens, prompt_token_budget, select_within_budget
 
 logger = logging.getLogger(__name__)
 
 
 class Response(BaseModel):
     '''output describing whether the new message is part of the previous conversation or not'''
-    previous_conversation: list[Message] = Field(description="list of messages from the conversation")
-    new_message: Message = Field(description="the new incoming message")
     matches: bool = Field(description="True if the conversation matches and False if it does not matches")
-    reason: str = Field(description="reason for the value in matches")
+
+
+class ReasonedResponse(Response):
+    reason: str = Field(description="short reason for the value in matches")
 
 
 def __format_msg(msg: ClassifiedMessage):
@@ -23,8 +34,9 @@ def __format_msg(msg: ClassifiedMessage):
     }
 
 
-def classify_message(previous_messages: list[Message], msg: ClassifiedMessage, model: str) -> Response:
-    examples = """
+MODEL = 'qwq:32b'
+
+PAIRWISE_EXAMPLES = """
     Example where matches is True
 
     #1
@@ -76,37 +88,212 @@ def classify_message(previous_messages: list[Message], msg: ClassifiedMessage, m
     reason: the message from user bar is not related to message from user blah
     """
 
-    prompt = f"""
+
+def _pairwise_prompt(lines: list[dict], new_message: dict) -> str:
+    # instructions and examples come first and never change, ollama reuses their kv cache between calls
+    # the prompt only asks for a reason when the response schema has one
+    reasoning = reasoning_enabled()
+    return f"""
         You are provided with a conversation with user and the message they wrote in an IRC or slack channel and a new message, you need to classify whether the
         new message is part of the conversation or not, reply True if the new message is part of the conversation or reply False if the new message is not part of the
-        conversation, provide reason for your choice.
+        conversation{", provide reason for your choice" if reasoning else ""}.
 
         example:
-        {examples}
+        {prompt_examples(PAIRWISE_EXAMPLES)}
 
         Here is the Conversation so far:
-        {[__format_msg(msg) for msg in previous_messages]}
+        {lines}
 
         the new message:
-        {__format_msg(msg)}
+        {new_message}
 
-        Provide your classification response with reasoning below,
+        Provide your classification response{" with reasoning" if reasoning else ""} below,
         Response:
     """
-    response = chat(
+
+
+def build_prompt(previous_messages: list[Message], msg: ClassifiedMessage, budget: int | None = None) -> str:
+    """
+    Prompt comparing the message with the conversation. Lines are dropped once the
+    prompt would exceed `budget` tokens, keeping the lines of the message's user or
+    of the users it mentions first and then the most recent ones.
+    """
+    new_message = __format_msg(msg)
+    budget = prompt_token_budget() if budget is None else budget
+    available = budget - count_tokens(_pairwise_prompt([], new_message))
+    related_users = {msg.user} | msg.features.mentions
+    lines = select_within_budget(
+        previous_messages,
+        available,
+        render=lambda line: f"{__format_msg(line)}, ",
+        relevant=lambda line: line.user in related_users,
+    )
+    return _pairwise_prompt([__format_msg(line) for line in lines], new_message)
+
+
+def classify_message(previous_messages: list[Message], msg: ClassifiedMessage, model: str) -> Response:
+    output_model = response_model(Response, ReasonedResponse)
+    prompt = build_prompt(previous_messages, msg)
+    response = cached_chat(
+        "disentangle_pairwise",
+        chat,
         messages = [
             {'role': 'user', 'content': prompt},
         ],
         model=model,
-        format=Response.model_json_schema(),
-        options={
-            'temperature': 0,
-            'num_ctx': 8192
-        }
+        format=output_model.model_json_schema(),
+        output_model=output_model,
+        options=chat_options(prompt, model)
     )
-    return Response.model_validate_json(response.message.content or "")
+    return output_model.model_validate_json(response.message.content or "")
 
 
 def llm_based_classifier(conversation: Conversation, message: ClassifiedMessage) -> bool:
-    classification = classify_message(conversation.lines, message, 'qwq:32b')
+    classification = classify_message(conversation.lines, message, MODEL)
     return classification.matches
+
+
+async def async_classify_message(previous_messages: list[Message], msg: ClassifiedMessage, model: str) -> Response:
+    output_model = response_model(Response, ReasonedResponse)
+    prompt = build_prompt(previous_messages, msg)
+    response = await acached_chat(
+        "disentangle_pairwise",
+        get_async_client().chat,
+        messages = [
+            {'role': 'user', 'content': prompt},
+        ],
+        model=model,
+        format=output_model.model_json_schema(),
+        output_model=output_model,
+        options=chat_options(prompt, model)
+    )
+    return output_model.model_validate_json(response.message.content or "")
+
+
+async def async_llm_based_classifier(conversation: Conversation, message: ClassifiedMessage) -> bool:
+    classification = await async_classify_message(conversation.lines, message, MODEL)
+    return classification.matches
+
+
+class MultiChoiceResponse(BaseModel):
+    '''output naming the conversation the new message belongs to'''
+    conversation: int | Literal["new"] = Field(
+        description="number of the conversation the new message belongs to, or \"new\" if it belongs to none of them"
+    )
+
+
+class ReasonedMultiChoiceResponse(MultiChoiceResponse):
+    reason: str = Field(description="short reason for the choice")
+
+
+def build_multi_choice_prompt(
+    conversations: list[Conversation], msg: ClassifiedMessage, recent_lines: int = 6
+) -> str:
+    examples = """
+    #1
+    Conversation 1:
+    user: blah, message: Hi, I need help with my ollama setup
+    user: blah, message: I am not able to figure out how to set up the context window
+    Conversation 2:
+    user: foo, message: anyone up for a game tonight?
+
+    New Message:
+    user: bar, message: just set the num_ctx parameter to what you need it to be
+
+    Response:
+    conversation: 1
+    reason: It answers the question about the context window asked by the user blah
+
+    #2
+    Conversation 1:
+    user: blah, message: Hi, I need help with my ollama setup
+
+    New Message:
+    user: foo, message: did you check out the latest qwen reasoning model?
+
+    Response:
+    conversation: new
+    reason: It has nothing to do with the ollama setup debugging
+    """
+
+    options = "\n".join(
+        f"Conversation {idx}:\n" + "\n".join(
+            f"{__format_msg(line)}" for line in conversation.lines[-recent_lines:]
+        )
+        for idx, conversation in enumerate(conversations, start=1)
+    )
+
+    reasoning = reasoning_enabled()
+    prompt = f"""
+        You are provided with numbered conversations with users and the messages they wrote in an IRC or slack channel and a new message,
+        you need to pick the conversation the new message is part of, reply with the number of that conversation or reply new if the
+        new message is not part of any of them{", provide reason for your choice" if reasoning else ""}.
+
+        example:
+        {prompt_examples(examples)}
+
+        Here are the recent messages of each conversation:
+        {options}
+
+        the new message:
+        {__format_msg(msg)}
+
+        Provide your response{" with reasoning" if reasoning else ""} below,
+        Response:
+    """
+    return prompt
+
+
+def _chosen_index(response: MultiChoiceResponse, candidates: int) -> int | None:
+    if response.conversation == "new":
+        return None
+    if not 1 <= response.conversation <= candidates:
+        logger.warning(f"LLM picked conversation {response.conversation} out of {candidates}, treating it as new")
+        return None
+    return response.conversation - 1
+
+
+def choose_conversation(
+    conversations: list[Conversation], msg: ClassifiedMessage, model: str = MODEL, recent_lines: int = 6
+) -> int | None:
+    """
+    Index of the conversation the message belongs to, None if it starts a new one,
+    with a single llm call whatever the number of conversations.
+    """
+    if not conversations:
+        return None
+    output_model = response_model(MultiChoiceResponse, ReasonedMultiChoiceResponse)
+    prompt = build_multi_choice_prompt(conversations, msg, recent_lines)
+    response = cached_chat(
+        "disentangle_multi_choice",
+        chat,
+        messages = [
+            {'role': 'user', 'content': prompt},
+        ],
+        model=model,
+        format=output_model.model_json_schema(),
+        output_model=output_model,
+        options=chat_options(prompt, model)
+    )
+    return _chosen_index(output_model.model_validate_json(response.message.content or ""), len(conversations))
+
+
+async def async_choose_conversation(
+    conversations: list[Conversation], msg: ClassifiedMessage, model: str = MODEL, recent_lines: int = 6
+) -> int | None:
+    if not conversations:
+        return None
+    output_model = response_model(MultiChoiceResponse, ReasonedMultiChoiceResponse)
+    prompt = build_multi_choice_prompt(conversations, msg, recent_lines)
+    response = await acached_chat(
+        "disentangle_multi_choice",
+        get_async_client().chat,
+        messages = [
+            {'role': 'user', 'content': prompt},
+        ],
+        model=model,
+        format=output_model.model_json_schema(),
+        output_model=output_model,
+        options=chat_options(prompt, model)
+    )
+    return _chosen_index(output_model.model_validate_json(response.message.content or ""), len(conversations))
@@ -1,15 +1,24 @@
-import re
+from collections import Counter
+import operator
+import threading
 from typing import Callable
 
 from pydantic import BaseModel
-from datatypes import Conversation, ClassifiedMessage
-from sentence_transformers import SentenceTransformer, util
+from datatypes import Conversation, ClassifiedMessage, Message
+from model_registry import registry
 import numpy as np
 
 
-# convert to a class to load the model only when needed
+SENTENCE_TRANSFORMER = "sentence_transformer"
 model_name = "sentence-transformers/all-mpnet-base-v2"
-model = SentenceTransformer(model_name)
+
+
+def _load_sentence_transformer():
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(model_name)
+
+
+registry.register(SENTENCE_TRANSFORMER, _load_sentence_transformer)
 
 
 # Time-based Clustering
@@ -29,16 +38,15 @@ def is_within_time_window(
 def has_matching_keywords(
     conversation: Conversation, message: ClassifiedMessage
 ) -> float:
-    # Extract keywords from the conversation
-    all_text = " ".join([msg.message for msg in conversation.lines])
-    keywords = set(re.findall(r"\b\w+\b", all_text.lower()))
-
-    # Count occurrences of these keywords in the new message
-    message_words = set(re.findall(r"\b\w+\b", message.message.lower()))
-    common_keywords = keywords.intersection(message_words)
+    # the keyword index is kept up to date as lines are appended,
+    # this only catches up on conversations built outside of ops
+    keyword_state = conversation.keyword_state
+    keyword_state.sync(conversation.lines)
 
+    message_words = message.features.tokens
     if len(message_words) > 0:
-        return len(common_keywords) / len(message_words)
+        common_keywords = sum(1 for word in message_words if word in keyword_state.counts)
+        return common_keywords / len(message_words)
     return 0.0
 
 
@@ -47,9 +55,7 @@ def is_reply_to_conversation(
     conversation: Conversation, message: ClassifiedMessage
 ) -> float:
     # Check if the message mentions any user from the conversation
-    pattern = re.compile(r"@(\w+)", re.IGNORECASE)
-    mentioned_users = pattern.findall(message.message)
-    return 1.0 if bool(set(mentioned_users) & conversation.users) else 0.0
+    return 1.0 if message.features.mentions & conversation.users else 0.0
 
 
 def user_is_part_of_conversation(
@@ -59,25 +65,62 @@ def user_is_part_of_conversation(
 
 
 # Semantic Similarity
+def _encode(texts: list[str]) -> np.ndarray:
+    model = registry.get(SENTENCE_TRANSFORMER)
+    return model.encode(texts, show_progress_bar=False, normalize_embeddings=True)
+
+
+def message_embeddings(messages: list[Message]) -> np.ndarray:
+    """
+    Embeddings of the messages, kept on their features so that a message is
+    encoded once whether it is compared or appended to a conversation.
+    """
+    missing = [message for message in messages if message.features.embedding is None]
+    if missing:
+        for message, embedding in zip(missing, _encode([message.message for message in missing])):
+            message.features.embedding = embedding
+    return np.array([message.features.embedding for message in messages])
+
+
+def unencoded_messages(conversations: list[Conversation], message: Message) -> list[Message]:
+    """The message and the conversation lines the semantic rule still has to encode."""
+    pending = [
+        line
+        for conversation in conversations
+        for line in conversation.embedding_state.pending(conversation.lines)
+    ]
+    return [line for line in (*pending, message) if line.features.embedding is None]
+
+
+def conversation_embedding(conversation: Conversation) -> np.ndarray | None:
+    """
+    Normalised centroid of the conversation's line embeddings, only the lines
+    appended since the last call are encoded.
+    """
+    state = conversation.embedding_state
+    pending = state.pending(conversation.lines)
+    if pending:
+        state.fold(message_embeddings(pending))
+    return state.centroid
+
+
 def semantic_similarity_score(
     conversation: Conversation, message: ClassifiedMessage, similarity_threshold=0.5
 ) -> float:
-    def _generate_embedding(text: list[str]) -> np.ndarray:
-        return model.encode(text, show_progress_bar=False, normalize_embeddings=True)
-
-    # Generate embeddings for the conversation and the new message
-    conversation_embeddings = _generate_embedding(
-        "\n".join([msg.message for msg in conversation.lines])
-    )
-    message_embedding = _generate_embedding(message.message)
-
-    return util.dot_score(conversation_embeddings, message_embedding)[0][0]
+    centroid = conversation_embedding(conversation)
+    if centroid is None:
+        return 0.0
+    message_embedding = message_embeddings([message])[0]
+    # embeddings are normalised so the dot product is the cosine similarity
+    return float(np.dot(centroid, message_embedding))
 
 
 class Rule(BaseModel):
     function: Callable[[Conversation, ClassifiedMessage], float]
     weight: float
     name: str
+    # relative cost of evaluating the rule, cheaper rules are evaluated first
+    cost: float = 1.0
 
 
 def execute_rules(
@@ -103,27 +146,170 @@ def execute_rules(
     return scores
 
 
+RULE_BOOK: list[Rule] = [
+    Rule(name="is_within_time_window", function=is_within_time_window, weight=1.0, cost=1.0),
+    Rule(name="reply_detection", function=is_reply_to_conversation, weight=1.0, cost=2.0),
+    Rule(
+        name="user_in_conversation",
+        function=user_is_part_of_conversation,
+        weight=1.0,
+        cost=0.5,
+    ),
+    Rule(
+        name="semantic_similarity", function=semantic_similarity_score, weight=0.7, cost=100.0
+    )
+]
+
+class Threshold:
+    """
+    Comparison of a weighted score with a threshold, works on single scores as
+    well as on numpy arrays. `margin` says how clearly a score passes (positive)
+    or fails (negative) the comparison: the distance to the threshold in units of
+    `scale`, clipped to [-1, 1]. Without a scale the score is read as a yes or no.
+    """
+
+    _OPERATORS = {"==": operator.eq, "!=": operator.ne, ">": operator.gt, "<": operator.lt}
+
+    def __init__(self, op: str, value: float, scale: float | None = None):
+        if op not in self._OPERATORS:
+            raise ValueError(f"Unknown operator {op!r}, expected one of {list(self._OPERATORS)}")
+        if scale is not None and (op not in (">", "<") or scale <= 0):
+            raise ValueError(f"A scale needs a positive value and one of > or <, got {op!r} and {scale}")
+        self.op = op
+        self.value = value
+        self.scale = scale
+
+    def __call__(self, score):
+        return self._OPERATORS[self.op](score, self.value)
+
+    def margin(self, score: float) -> float:
+        if self.scale is None:
+            return 1.0 if self(score) else -1.0
+        distance = score - self.value if self.op == ">" else self.value - score
+        return min(max(distance / self.scale, -1.0), 1.0)
+
+    def __repr__(self) -> str:
+        return f"Threshold({self.op!r}, {self.value}, scale={self.scale})"
+
+
+# (rule name, test on its weighted score)
+Condition = tuple[str, Callable[[float], bool]]
+
+
+def condition_margin(condition: Condition, score: float) -> float:
+    """`Threshold.margin` of the condition, a plain test only tells whether it holds."""
+    _, test = condition
+    if isinstance(test, Threshold):
+        return test.margin(score)
+    return 1.0 if test(score) else -1.0
+
+
+# the message belongs to the conversation when all the conditions of any clause hold,
+# the scales are the range of the scores around their threshold
+DECISION: list[list[Condition]] = [
+    [("reply_detection", Threshold("==", 1.0))],
+    [
+        ("semantic_similarity", Threshold(">", 0.6, scale=0.1)),
+        ("is_within_time_window", Threshold("<", 30, scale=1.0)),
+    ],
+    [
+        ("user_in_conversation", Threshold("!=", 0)),
+        ("is_within_time_window", Threshold("<", 5, scale=1.0)),
+    ],
+]
+
+
+def is_same_conversation(scores):
+    """
+    `DECISION` over precomputed weighted scores, works on single scores as well
+    as on numpy arrays holding the scores of many conversations.
+    """
+    result = False
+    for clause in DECISION:
+        matched = True
+        for name, test in clause:
+            matched = matched & test(scores[name])
+        result = result | matched
+    return result
+
+
+class RuleStats(BaseModel):
+    evaluated: Counter[str] = Counter()
+    skipped: Counter[str] = Counter()
+
+    def skip_rate(self, name: str) -> float:
+        total = self.evaluated[name] + self.skipped[name]
+        return self.skipped[name] / total if total else 0.0
+
+
+rule_stats = RuleStats()
+_rule_stats_lock = threading.Lock()
+
+
+class LazyScores:
+    """Weighted rule scores of a message against a conversation, each computed on first read."""
+
+    def __init__(self, conversation: Conversation, message: ClassifiedMessage, rules: list[Rule] = RULE_BOOK):
+        self.conversation = conversation
+        self.message = message
+        self.rules = {rule.name: rule for rule in rules}
+        self._scores: dict[str, float] = {}
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._scores
+
+    def __getitem__(self, name: str) -> float:
+        if name not in self._scores:
+            rule = self.rules[name]
+            self._scores[name] = rule.function(self.conversation, self.message) * rule.weight
+        return self._scores[name]
+
+    def cost(self, name: str) -> float:
+        """Cost of reading the score, nothing once it is computed."""
+        return 0.0 if name in self._scores else self.rules[name].cost
+
+    def cheapest(self, clauses: list[list[Condition]]) -> list[Condition]:
+        """The clause with the cheapest rules left to compute."""
+        return min(clauses, key=lambda clause: sum(self.cost(name) for name in {name for name, _ in clause}))
+
+    def record_stats(self):
+        with _rule_stats_lock:
+            for name in self.rules:
+                if name in self._scores:
+                    rule_stats.evaluated[name] += 1
+                else:
+                    rule_stats.skipped[name] += 1
+
+
+def evaluate_decision(
+    conversation: Conversation,
+    message: ClassifiedMessage,
+    rules: list[Rule] = RULE_BOOK,
+    decision: list[list[Condition]] = DECISION,
+) -> bool:
+    """
+    Evaluate the decision lazily: the clause with the cheapest rules left to
+    compute is tried first, its conditions cheapest first, and evaluation stops as
+    soon as a clause holds or every clause has failed.
+    """
+    scores = LazyScores(conversation, message, rules)
+
+    def holds(condition: Condition) -> bool:
+        name, test = condition
+        return test(scores[name])
+
+    result = False
+    clauses = list(decision)
+    while clauses and not result:
+        clause = scores.cheapest(clauses)
+        clauses.remove(clause)
+        result = all(holds(condition) for condition in sorted(clause, key=lambda condition: scores.cost(condition[0])))
+
+    scores.record_stats()
+    return result
+
+
 def rule_based_classifier(
     conversation: Conversation, message: ClassifiedMessage
 ) -> bool:
-    rule_book: list[Rule] = [
-        Rule(name="is_within_time_window", function=is_within_time_window, weight=1.0),
-        Rule(name="reply_detection", function=is_reply_to_conversation, weight=1.0),
-        Rule(
-            name="user_in_conversation",
-            function=user_is_part_of_conversation,
-            weight=1.0,
-        ),
-        Rule(
-            name="semantic_similarity", function=semantic_similarity_score, weight=0.7
-        )
-    ]
-
-    scores = execute_rules(conversation, message, rule_book)
-    return any(
-        [
-            scores["reply_detection"] == 1.0,
-            (scores["semantic_similarity"] > 0.6) and (scores["is_within_time_window"] < 30),
-            scores["user_in_conversation"]  and (scores["is_within_time_window"] < 5)
-        ]
-    )
+    return evaluate_decision(conversation, message)
@@ -0,0 +1,243 @@
+import logging
+
+import numpy as np
+
+from conversations.disentanglement.rule_based_classifier import (
+    RULE_BOOK,
+    Rule,
+    has_matching_keywords,
+    is_reply_to_conversation,
+    is_same_conversation,
+    is_within_time_window,
+    message_embeddings,
+    semantic_similarity_score,
+    user_is_part_of_conversation,
+)
+from datatypes import ClassifiedMessage, Conversation
+
+
+logger = logging.getLogger(__name__)
+
+MAX_ELAPSED_SECONDS = 30.0
+
+
+def _grow(array: np.ndarray, columns: int) -> np.ndarray:
+    """Zero padded copy of the matrix with room for at least `columns` columns."""
+    if columns <= array.shape[1]:
+        return array
+    # double the width so that a growing vocabulary is not copied on every new word
+    grown = np.zeros((array.shape[0], max(columns, 2 * array.shape[1])), dtype=array.dtype)
+    grown[:, :array.shape[1]] = array
+    return grown
+
+
+def _append_rows(array: np.ndarray, rows: int) -> np.ndarray:
+    """The matrix with zeroed rows appended up to `rows`, a view of a buffer that doubles its height."""
+    buffer = array.base if array.base is not None else array
+    if rows > buffer.shape[0] or buffer.shape[1:] != array.shape[1:]:
+        # double the height so that a new conversation does not copy every array
+        buffer = np.zeros((max(rows, 2 * array.shape[0]), *array.shape[1:]), dtype=array.dtype)
+        buffer[:array.shape[0]] = array
+    appended = buffer[:rows]
+    appended[array.shape[0]:] = 0
+    return appended
+
+
+class ConversationArrays:
+    """
+    The rule inputs of the open conversations as numpy arrays, one row per
+    conversation in the order of the list last passed to `sync`: timestamp of the
+    last line, user and keyword membership over a growing vocabulary, and the
+    embedding centroid. Rows are only updated with the lines appended since the
+    previous sync. The keyword matrix is only kept when `keywords` is set, i.e.
+    when a rule scores keyword overlap.
+    """
+
+    def __init__(self, keywords: bool = True):
+        self.track_keywords = keywords
+        self.conversations: list[Conversation] = []
+        self.lines = np.zeros(0, dtype=np.int64)
+        self.user_counts = np.zeros(0, dtype=np.int64)
+        self.embedded = np.zeros(0, dtype=np.int64)
+        self.last_ts = np.zeros(0, dtype=np.float64)
+        self.users = np.zeros((0, 0), dtype=bool)
+        self.keywords = np.zeros((0, 0), dtype=bool)
+        self.centroids: np.ndarray | None = None
+        self.has_centroid = np.zeros(0, dtype=bool)
+        self.user_ids: dict[str, int] = {}
+        self.keyword_ids: dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.conversations)
+
+    def _column(self, vocabulary: dict[str, int], key: str) -> int:
+        if key not in vocabulary:
+            vocabulary[key] = len(vocabulary)
+        return vocabulary[key]
+
+    def _reorder(self, conversations: list[Conversation]):
+        """Move the rows to follow the new list, rows of new conversations start empty."""
+        previous = {id(conversation): row for row, conversation in enumerate(self.conversations)}
+        source = np.array([previous.get(id(conversation), -1) for conversation in conversations], dtype=np.int64)
+        known = source >= 0
+
+        def take(array: np.ndarray) -> np.ndarray:
+            taken = np.zeros((len(conversations), *array.shape[1:]), dtype=array.dtype)
+            taken[known] = array[source[known]]
+            return taken
+
+        self.lines, self.user_counts, self.embedded = take(self.lines), take(self.user_counts), take(self.embedded)
+        self.last_ts, self.users, self.keywords = take(self.last_ts), take(self.users), take(self.keywords)
+        self.has_centroid = take(self.has_centroid)
+        if self.centroids is not None:
+            self.centroids = take(self.centroids)
+        self.conversations = list(conversations)
+
+    def _extend(self, conversations: list[Conversation]):
+        """Append empty rows for the conversations added at the end of the list."""
+        rows = len(conversations)
+
+        def extend(array: np.ndarray) -> np.ndarray:
+            return _append_rows(array, rows)
+
+        self.lines, self.user_counts, self.embedded = extend(self.lines), extend(self.user_counts), extend(self.embedded)
+        self.last_ts, self.users, self.keywords = extend(self.last_ts), extend(self.users), extend(self.keywords)
+        self.has_centroid = extend(self.has_centroid)
+        if self.centroids is not None:
+            self.centroids = extend(self.centroids)
+        self.conversations = list(conversations)
+
+    def sync(self, conversations: list[Conversation]):
+        known = len(self.conversations)
+        unchanged = len(conversations) >= known and all(
+            new is old for new, old in zip(conversations, self.conversations)
+        )
+        if not unchanged:
+            self._reorder(conversations)
+        elif len(conversations) > known:
+            # new conversations are appended, the existing rows stay where they are
+            self._extend(conversations)
+
+        for row, conversation in enumerate(conversations):
+            if len(conversation.users) != self.user_counts[row]:
+                columns = [self._column(self.user_ids, user) for user in conversation.users]
+                self.users = _grow(self.users, len(self.user_ids))
+                self.users[row, columns] = True
+                self.user_counts[row] = len(conversation.users)
+
+            pending = conversation.lines[self.lines[row]:]
+            if not pending:
+                continue
+            if self.track_keywords:
+                columns = [
+                    self._column(self.keyword_ids, token)
+                    for line in pending
+                    for token in line.features.tokens
+                ]
+                self.keywords = _grow(self.keywords, len(self.keyword_ids))
+                self.keywords[row, columns] = True
+            self.last_ts[row] = conversation.lines[-1].features.ts
+            self.lines[row] = len(conversation.lines)
+
+    def sync_centroids(self):
+        """Encode the pending lines of every conversation in a single batch."""
+        pending = [
+            (row, conversation.embedding_state.pending(conversation.lines))
+            for row, conversation in enumerate(self.conversations)
+        ]
+        lines = [line for _, pending_lines in pending for line in pending_lines]
+        if lines:
+            embeddings = message_embeddings(lines)
+            start = 0
+            for row, lines in pending:
+                self.conversations[row].embedding_state.fold(embeddings[start:start + len(lines)])
+                start += len(lines)
+
+        for row, conversation in enumerate(self.conversations):
+            state = conversation.embedding_state
+            if state.lines == self.embedded[row]:
+                continue
+            centroid = state.centroid
+            if self.centroids is None:
+                self.centroids = np.zeros((len(self.conversations), len(centroid)), dtype=np.float32)
+            self.centroids[row] = centroid
+            self.has_centroid[row] = True
+            self.embedded[row] = state.lines
+
+
+def time_window_scores(arrays: ConversationArrays, message: ClassifiedMessage) -> np.ndarray:
+    elapsed = message.features.ts - arrays.last_ts
+    scores = (MAX_ELAPSED_SECONDS - elapsed) / MAX_ELAPSED_SECONDS
+    return np.where((elapsed >= MAX_ELAPSED_SECONDS) | (arrays.lines == 0), 0.0, scores)
+
+
+def keyword_scores(arrays: ConversationArrays, message: ClassifiedMessage) -> np.ndarray:
+    tokens = message.features.tokens
+    if not tokens:
+        return np.zeros(len(arrays))
+    columns = [arrays.keyword_ids[token] for token in tokens if token in arrays.keyword_ids]
+    return arrays.keywords[:, columns].sum(axis=1) / len(tokens)
+
+
+def reply_scores(arrays: ConversationArrays, message: ClassifiedMessage) -> np.ndarray:
+    columns = [arrays.user_ids[user] for user in message.features.mentions if user in arrays.user_ids]
+    return arrays.users[:, columns].any(axis=1).astype(np.float64)
+
+
+def user_scores(arrays: ConversationArrays, message: ClassifiedMessage) -> np.ndarray:
+    if message.user not in arrays.user_ids:
+        return np.zeros(len(arrays))
+    return arrays.users[:, arrays.user_ids[message.user]].astype(np.float64)
+
+
+def semantic_scores(arrays: ConversationArrays, message: ClassifiedMessage) -> np.ndarray:
+    arrays.sync_centroids()
+    if not arrays.has_centroid.any():
+        return np.zeros(len(arrays))
+    message_embedding = message_embeddings([message])[0]
+    # embeddings are normalised so the dot product is the cosine similarity
+    return np.where(arrays.has_centroid, arrays.centroids @ message_embedding, 0.0)
+
+
+# vectorized counterparts of the rule functions
+VECTORIZED_RULES = {
+    is_within_time_window: time_window_scores,
+    has_matching_keywords: keyword_scores,
+    is_reply_to_conversation: reply_scores,
+    user_is_part_of_conversation: user_scores,
+    semantic_similarity_score: semantic_scores,
+}
+
+
+class VectorizedRuleClassifier:
+    """
+    Scores a message against all the open conversations with a few array
+    operations per rule instead of running every rule per conversation, makes the
+    same decisions as `rule_based_classifier`.
+    """
+
+    def __init__(self, rules: list[Rule] = RULE_BOOK):
+        self.rules = rules
+        self.arrays = ConversationArrays(
+            keywords=any(VECTORIZED_RULES.get(rule.function) is keyword_scores for rule in rules)
+        )
+
+    def score_matrix(self, conversations: list[Conversation], message: ClassifiedMessage) -> np.ndarray:
+        """Weighted scores with one row per conversation and one column per rule."""
+        self.arrays.sync(conversations)
+        scores = np.zeros((len(conversations), len(self.rules)))
+        if not conversations:
+            return scores
+        for column, rule in enumerate(self.rules):
+            vectorized = VECTORIZED_RULES.get(rule.function)
+            if vectorized is not None:
+                raw_scores = vectorized(self.arrays, message)
+            else:
+                raw_scores = [rule.function(conversation, message) for conversation in conversations]
+            scores[:, column] = np.asarray(raw_scores, dtype=np.float64) * rule.weight
+        return scores
+
+    def __call__(self, conversations: list[Conversation], message: ClassifiedMessage) -> list[bool]:
+        scores = self.score_matrix(conversations, message)
+        named = {rule.name: scores[:, column] for column, rule in enumerate(self.rules)}
+        return is_same_conversation(named).tolist()
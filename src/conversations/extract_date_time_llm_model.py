@@ -3,14 +3,20 @@ from ollama import chat
 from pydantic import BaseModel, Field
 
 from datatypes import ClassifiedMessage, Conversation, Message
+from llm_gateway import Priority
+from llm_utils import acached_chat, cached_chat, get_async_client, response_model
+from prompt_builder import chat_options, count_tokens, prompt_token_budget, select_within_budget
+from text_utils import has_temporal_cue
 
 
 class Response(BaseModel):
-    '''output describing whether the new message is part of the previous conversation or not'''
-    conversation: list[Message] = Field(description="list of messages from the conversation")
-    event_datetime: datetime = Field(description="Date time to be extracted from conversation")
+    '''output describing the datetime of the event discussed in the conversation'''
     datetime_exists: bool = Field(description="set to False if the datetime does not exist and to True if datetime exist")
-    reason: str = Field(description="reason for why the event is that datetime")
+    event_datetime: datetime | None = Field(default=None, description="Date time to be extracted from conversation")
+
+
+class ReasonedResponse(Response):
+    reason: str = Field(description="short reason for why the event is that datetime")
 
 
 def __format_msg(msg: ClassifiedMessage):
@@ -21,29 +27,51 @@ def __format_msg(msg: ClassifiedMessage):
     }
 
 
-def extract_event(conversation: list[Message], model: str) -> Response:
-    prompt = f"""
+def _extraction_prompt(lines: list[dict]) -> str:
+    return f"""
         Assume you are data annotator, and you are tasked with extracting date time for events in conversations, below you will be provided with conversation
 
         Here is the Conversation so far:
-        {[__format_msg(msg) for msg in conversation]}
+        {lines}
 
 
         Provide the event datetime below,
         Response:
     """
-    response = chat(
+
+
+def build_prompt(conversation: list[Message], budget: int | None = None) -> str:
+    """
+    Extraction prompt over the conversation. Lines are dropped once the prompt would
+    exceed `budget` tokens, keeping the lines with a temporal cue first and then the
+    most recent ones.
+    """
+    budget = prompt_token_budget() if budget is None else budget
+    lines = select_within_budget(
+        conversation,
+        budget - count_tokens(_extraction_prompt([])),
+        render=lambda line: f"{__format_msg(line)}, ",
+        relevant=lambda line: has_temporal_cue(line.message),
+    )
+    return _extraction_prompt([__format_msg(line) for line in lines])
+
+
+def extract_event(conversation: list[Message], model: str) -> Response:
+    prompt = build_prompt(conversation)
+    output_model = response_model(Response, ReasonedResponse)
+    response = cached_chat(
+        "extract_datetime",
+        chat,
+        priority=Priority.BACKGROUND,
         messages = [
             {'role': 'user', 'content': prompt},
         ],
         model=model,
-        format=Response.model_json_schema(),
-        options={
-            'temperature': 0,
-            'num_ctx': 8192
-        }
+        format=output_model.model_json_schema(),
+        output_model=output_model,
+        options=chat_options(prompt, model)
     )
-    return Response.model_validate_json(response.message.content or "")
+    return output_model.model_validate_json(response.message.content or "")
 
 
 def model(conversation: Conversation) -> datetime | None:
@@ -52,3 +80,26 @@ def model(conversation: Conversation) -> datetime | None:
         return result.event_datetime
     else:
         return None
+
+
+async def async_extract_event(conversation: list[Message], model: str) -> Response:
+    prompt = build_prompt(conversation)
+    output_model = response_model(Response, ReasonedResponse)
+    response = await acached_chat(
+        "extract_datetime",
+        get_async_client().chat,
+        priority=Priority.BACKGROUND,
+        messages = [
+            {'role': 'user', 'content': prompt},
+        ],
+        model=model,
+        format=output_model.model_json_schema(),
+        output_model=output_model,
+        options=chat_options(prompt, model)
+    )
+    return output_model.model_validate_json(response.message.content or "")
+
+
+async def async_model(conversation: Conversation) -> datetime | None:
+    result = await async_extract_event(conversation.lines, 'qwq:32b')
+    return result.event_datetime if result.datetime_exists else None
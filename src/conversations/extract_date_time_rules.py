@@ -0,0 +1,254 @@
+from datetime import date, datetime, time, timedelta, timezone, tzinfo
+import os
+import re
+
+from pydantic import BaseModel
+
+from datatypes import Message
+
+
+_WEEKDAYS = {
+    "monday": 0, "tuesday": 1, "wednesday": 2, "thursday": 3, "friday": 4, "saturday": 5, "sunday": 6,
+    "mon": 0, "tue": 1, "tues": 1, "wed": 2, "thu": 3, "thur": 3, "thurs": 3, "fri": 4, "sat": 5, "sun": 6,
+}
+_FULL_WEEKDAYS = "|".join(name for name in _WEEKDAYS if len(name) > 5)
+_SHORT_WEEKDAYS = "|".join(name for name in _WEEKDAYS if len(name) <= 5)
+
+_MONTHS = {
+    "january": 1, "february": 2, "march": 3, "april": 4, "may": 5, "june": 6, "july": 7,
+    "august": 8, "september": 9, "october": 10, "november": 11, "december": 12,
+    "jan": 1, "feb": 2, "mar": 3, "apr": 4, "jun": 6, "jul": 7, "aug": 8,
+    "sep": 9, "sept": 9, "oct": 10, "nov": 11, "dec": 12,
+}
+_MONTH_NAMES = "|".join(_MONTHS)
+
+# hours from utc, daylight saving is spelled out by the abbreviation
+_TIMEZONES = {
+    "utc": 0, "gmt": 0, "bst": 1, "cet": 1, "cest": 2, "ist": 5.5,
+    "est": -5, "edt": -4, "cst": -6, "cdt": -5, "mst": -7, "mdt": -6, "pst": -8, "pdt": -7,
+}
+_NUMBERS = {
+    "a": 1, "an": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5,
+    "ten": 10, "fifteen": 15, "twenty": 20, "thirty": 30, "half an": 0.5, "half a": 0.5,
+}
+_UNITS = {"min": "minutes", "hour": "hours", "hr": "hours", "day": "days"}
+
+_RELATIVE_DAY_PATTERN = re.compile(r"\b(day after tomorrow|today|tonight|tomorrow|tmrw|tmr)\b")
+_WEEKDAY_PATTERN = re.compile(
+    rf"\b(?:(?P<qualifier>next|this|on)\s+)?(?P<weekday>{_FULL_WEEKDAYS})\b"
+    rf"|\b(?P<short_qualifier>next|this|on)\s+(?P<short_weekday>{_SHORT_WEEKDAYS})\b"
+)
+_DATE_PATTERN = re.compile(
+    r"\b(?P<iso_year>\d{4})-(?P<iso_month>\d{1,2})-(?P<iso_day>\d{1,2})\b"
+    rf"|\b(?P<month>{_MONTH_NAMES})\.?\s+(?P<day>\d{{1,2}})(?:st|nd|rd|th)?\b"
+    rf"|\b(?P<day_first>\d{{1,2}})(?:st|nd|rd|th)?\s+(?:of\s+)?(?P<month_second>{_MONTH_NAMES})\b"
+)
+_TIME_PATTERN = re.compile(
+    r"\b(?P<h12>\d{1,2})(?::(?P<m12>\d{2}))?\s*(?P<meridiem>[ap])\.?m\b\.?"
+    r"|\b(?P<h24>[01]?\d|2[0-3]):(?P<m24>[0-5]\d)\b"
+    r"|\b(?P<named>noon|midday|midnight)\b"
+    r"|\b(?:at|around|by)\s+(?P<bare>\d{1,2})(?:\s*o'?clock)?\b"
+    r"(?!\s*(?:[ap]\.?m\b|[:/.]\d|%|min|hour|hr|day|people|ppl))"
+    r"|\b(?P<oclock>\d{1,2})\s*o'?clock\b"
+)
+_TIMEZONE_PATTERN = re.compile(
+    r"\b(?:utc|gmt)\s*(?P<sign>[+-])\s*(?P<hours>\d{1,2})(?::?(?P<minutes>\d{2}))?\b"
+    rf"|\b(?P<name>{'|'.join(_TIMEZONES)})\b"
+)
+_DELTA_PATTERN = re.compile(
+    rf"\bin\s+(?P<count>\d+|{'|'.join(sorted(_NUMBERS, key=len, reverse=True))})\s*"
+    r"(?P<unit>min|hour|hr|day)(?:ute)?s?\b"
+)
+_EVENING_PATTERN = re.compile(r"\b(tonight|evening|afternoon)\b")
+_MORNING_PATTERN = re.compile(r"\b(morning|breakfast)\b")
+
+# confidence of each kind of expression on its own
+DAY_CONFIDENCE = 0.9
+UNQUALIFIED_WEEKDAY_CONFIDENCE = 0.85
+TIME_CONFIDENCE = 0.9
+HINTED_BARE_HOUR_CONFIDENCE = 0.75
+BARE_HOUR_CONFIDENCE = 0.5
+# penalties when the day or the time of the event has to be guessed
+MISSING_DAY_PENALTY = 0.1
+MISSING_TIME_CONFIDENCE = 0.4
+CONFLICT_CONFIDENCE = 0.5
+
+
+class RuleExtraction(BaseModel):
+    '''event datetime found by the temporal expression rules'''
+    event_datetime: datetime | None = None
+    # 0 when nothing was found, the llm has to decide
+    confidence: float = 0.0
+
+
+class _Found(BaseModel):
+    """Day and time mentioned by one line, resolved against its timestamp."""
+    days: list[tuple[date, float]] = []
+    times: list[tuple[time, float]] = []
+
+
+def min_rule_confidence() -> float:
+    return float(os.getenv("DATETIME_RULES_MIN_CONFIDENCE", "0.8"))
+
+
+def _relative_day(word: str, today: date) -> date:
+    offsets = {"today": 0, "tonight": 0, "tomorrow": 1, "tmrw": 1, "tmr": 1, "day after tomorrow": 2}
+    return today + timedelta(days=offsets[word])
+
+
+def _weekday(weekday: int, qualifier: str | None, today: date) -> date:
+    ahead = (weekday - today.weekday()) % 7
+    # `this friday` on a friday is today, a bare or `next` weekday is the coming one
+    if ahead == 0 and qualifier != "this":
+        ahead = 7
+    return today + timedelta(days=ahead)
+
+
+def _calendar_date(year: int | None, month: int, day: int, today: date) -> date | None:
+    try:
+        found = date(year or today.year, month, day)
+    except ValueError:
+        return None
+    if year is None and found < today:
+        found = found.replace(year=today.year + 1)
+    return found
+
+
+def _days(text: str, today: date) -> list[tuple[date, float]]:
+    days = [(_relative_day(match.group(1), today), DAY_CONFIDENCE) for match in _RELATIVE_DAY_PATTERN.finditer(text)]
+    for match in _WEEKDAY_PATTERN.finditer(text):
+        qualifier = match.group("qualifier") or match.group("short_qualifier")
+        weekday = _WEEKDAYS[match.group("weekday") or match.group("short_weekday")]
+        confidence = DAY_CONFIDENCE if qualifier else UNQUALIFIED_WEEKDAY_CONFIDENCE
+        days.append((_weekday(weekday, qualifier, today), confidence))
+    for match in _DATE_PATTERN.finditer(text):
+        if match.group("iso_year"):
+            found = _calendar_date(int(match.group("iso_year")), int(match.group("iso_month")), int(match.group("iso_day")), today)
+        elif match.group("month"):
+            found = _calendar_date(None, _MONTHS[match.group("month")], int(match.group("day")), today)
+        else:
+            found = _calendar_date(None, _MONTHS[match.group("month_second")], int(match.group("day_first")), today)
+        if found is not None:
+            days.append((found, DAY_CONFIDENCE))
+    return days
+
+
+def _times(text: str) -> list[tuple[time, float]]:
+    evening = _EVENING_PATTERN.search(text) is not None
+    morning = _MORNING_PATTERN.search(text) is not None
+    times = []
+    for match in _TIME_PATTERN.finditer(text):
+        if match.group("h12"):
+            hour, minute = int(match.group("h12")), int(match.group("m12") or 0)
+            if not 1 <= hour <= 12 or minute > 59:
+                continue
+            hour = hour % 12 + (12 if match.group("meridiem") == "p" else 0)
+            times.append((time(hour, minute), TIME_CONFIDENCE))
+        elif match.group("h24"):
+            hour = int(match.group("h24"))
+            # `1:30` in a chat is early afternoon unless the line talks about the morning
+            if len(match.group("h24")) == 1 and hour < 8 and not morning:
+                hour += 12
+            times.append((time(hour, int(match.group("m24"))), TIME_CONFIDENCE))
+        elif match.group("named"):
+            times.append((time(0) if match.group("named") == "midnight" else time(12), TIME_CONFIDENCE))
+        else:
+            hour = int(match.group("bare") or match.group("oclock"))
+            if not 1 <= hour <= 12:
+                continue
+            # a bare hour is read as am or pm from the part of the day the line mentions
+            if evening != morning:
+                times.append((time(hour % 12 + (12 if evening else 0)), HINTED_BARE_HOUR_CONFIDENCE))
+            else:
+                # without a hint, office hours are the likely reading
+                times.append((time(hour if hour >= 8 else hour + 12), BARE_HOUR_CONFIDENCE))
+    return times
+
+
+def _timezone(text: str) -> float | None:
+    match = _TIMEZONE_PATTERN.search(text)
+    if match is None:
+        return None
+    if match.group("name"):
+        return _TIMEZONES[match.group("name")]
+    offset = int(match.group("hours")) + int(match.group("minutes") or 0) / 60
+    return offset if match.group("sign") == "+" else -offset
+
+
+def _parse_line(text: str, reference: datetime) -> _Found:
+    """Days and times mentioned by a line, relative days resolved against `reference`."""
+    text = text.lower()
+    found = _Found(days=_days(text, reference.date()), times=_times(text))
+    for match in _DELTA_PATTERN.finditer(text):
+        count = match.group("count")
+        amount = float(count) if count.isdigit() else _NUMBERS[count]
+        moment = reference + timedelta(**{_UNITS[match.group("unit")]: amount})
+        found.days.append((moment.date(), DAY_CONFIDENCE))
+        found.times.append((moment.time().replace(second=0, microsecond=0), TIME_CONFIDENCE))
+    return found
+
+
+def _tz(offset_hours: float | None, reference: datetime) -> tzinfo | None:
+    if offset_hours is None:
+        return reference.tzinfo
+    return timezone(timedelta(hours=offset_hours))
+
+
+def extract_event(conversation: list[Message]) -> RuleExtraction:
+    """
+    Event datetime from the temporal expressions of the conversation: relative
+    days, weekdays, calendar dates, clock times, `in <n> minutes|hours|days` and
+    time zones. The latest time zone mentioned applies to the whole conversation,
+    each line is resolved against its timestamp in that zone, so `tomorrow` is the
+    day after the one the sender is living. The latest day and time mentioned are
+    combined, lines can mention one and the other. The confidence drops when the
+    day or the time has to be guessed, and when lines mention different days or
+    times (a proposal and its reschedule look alike).
+    """
+    if not conversation:
+        return RuleExtraction()
+    offset_hours: float | None = None
+    for line in conversation:
+        found_timezone = _timezone(line.message.lower())
+        if found_timezone is not None:
+            offset_hours = found_timezone
+    reference = conversation[-1].ts
+    tz = _tz(offset_hours, reference)
+
+    day: tuple[date, float] | None = None
+    clock: tuple[time, float] | None = None
+    clock_reference: datetime | None = None
+    distinct_days: set[date] = set()
+    distinct_times: set[time] = set()
+    for line in conversation:
+        # naive timestamps are already read in the zone of the conversation
+        local_ts = line.ts.astimezone(tz) if tz is not None and line.ts.tzinfo is not None else line.ts
+        found = _parse_line(line.message, local_ts)
+        distinct_days.update(found_day for found_day, _ in found.days)
+        distinct_times.update(found_time for found_time, _ in found.times)
+        if found.days:
+            day = found.days[-1]
+        if found.times:
+            clock, clock_reference = found.times[-1], local_ts
+
+    if day is None and clock is None:
+        return RuleExtraction()
+
+    if day is not None and clock is not None:
+        event_day, confidence = day[0], min(day[1], clock[1])
+        event_time = clock[0]
+    elif clock is not None:
+        # a time without a day is the next time the clock shows it after the line
+        event_day, event_time = clock_reference.date(), clock[0]
+        confidence = clock[1] - MISSING_DAY_PENALTY
+        if datetime.combine(event_day, event_time) < clock_reference.replace(tzinfo=None):
+            event_day += timedelta(days=1)
+    else:
+        event_day, event_time, confidence = day[0], time(0), MISSING_TIME_CONFIDENCE
+
+    event_datetime = datetime.combine(event_day, event_time, tzinfo=tz)
+    if reference.tzinfo is not None and tz is not None:
+        event_datetime = event_datetime.astimezone(reference.tzinfo)
+    if len(distinct_days) > 1 or len(distinct_times) > 1:
+        confidence = min(confidence, CONFLICT_CONFIDENCE)
+    return RuleExtraction(event_datetime=event_datetime, confidence=confidence)
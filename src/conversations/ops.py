@@ -1,14 +1,21 @@
+import asyncio
 import logging
 logger = logging.getLogger(__name__)
 
+from conversations.candidate_index import CandidateIndex
 from datatypes import Conversation, ClassifiedMessage
-from typing import Callable
+from typing import Awaitable, Callable
 from datetime import datetime, timedelta, timezone
 
 
 def add_message_to_conversation(conversation: Conversation, message: ClassifiedMessage):
     conversation.lines.append(message)
     conversation.users.add(message.user)
+    conversation.keyword_state.sync(conversation.lines)
+    # the message was usually encoded while it was compared, fold it into the centroid right away
+    embedding_state = conversation.embedding_state
+    if message.features.embedding is not None and embedding_state.lines == len(conversation.lines) - 1:
+        embedding_state.fold(message.features.embedding[None])
     conversation.last_updated = datetime.now(timezone.utc)
     return conversation
 
@@ -25,15 +32,14 @@ def update_suspended_conversation(
     return updated_conversations
 
 
-def disentangle_message(
-    conversations: list[Conversation],
-    message: ClassifiedMessage,
-    classifier: Callable[[Conversation, ClassifiedMessage], bool],
+def _add_to_matches(
+    conversations: list[Conversation], message: ClassifiedMessage, matches: list[bool]
 ) -> list[Conversation]:
+    """Add the message to the matched conversations, or to a new one if none matched."""
     updates = []
     matched = False
-    for conversation in conversations:
-        if classifier(conversation, message):
+    for conversation, is_match in zip(conversations, matches):
+        if is_match:
             logger.debug(f"Matched to existing conversation. Current lines: {', '.join([msg.message for msg in conversation.lines[:-2]])}")
             updates.append(add_message_to_conversation(conversation, message))
             matched = True
@@ -48,6 +54,134 @@ def disentangle_message(
     return updates
 
 
+def _candidates(
+    conversations: list[Conversation], message: ClassifiedMessage, candidate_index: CandidateIndex | None
+) -> list[Conversation]:
+    if candidate_index is None:
+        return conversations
+    return candidate_index.candidates(conversations, message)
+
+
+def disentangle_message(
+    conversations: list[Conversation],
+    message: ClassifiedMessage,
+    classifier: Callable[[Conversation, ClassifiedMessage], bool],
+    candidate_index: CandidateIndex | None = None,
+) -> list[Conversation]:
+    """
+    Add the message to every conversation the classifier matches, or start a new
+    conversation. With a `candidate_index` the classifier only runs against the
+    conversations it retrieves, the others are passed through unchanged.
+    """
+    candidate_ids = {id(conversation) for conversation in _candidates(conversations, message, candidate_index)}
+    matches = [
+        id(conversation) in candidate_ids and classifier(conversation, message)
+        for conversation in conversations
+    ]
+    updates = _add_to_matches(conversations, message, matches)
+    if candidate_index is not None:
+        candidate_index.sync(updates)
+    return updates
+
+
+async def disentangle_message_async(
+    conversations: list[Conversation],
+    message: ClassifiedMessage,
+    classifier: Callable[[Conversation, ClassifiedMessage], Awaitable[bool]],
+    candidate_index: CandidateIndex | None = None,
+    max_concurrency: int = 4,
+    deadline_seconds: float | None = None,
+) -> list[Conversation]:
+    """
+    Same as `disentangle_message` for async classifiers, the candidates are
+    classified concurrently with at most `max_concurrency` calls in flight.
+    Raises TimeoutError, without changing any conversation, when the calls do not
+    finish within `deadline_seconds`.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def classify(conversation: Conversation) -> bool:
+        async with semaphore:
+            return await classifier(conversation, message)
+
+    candidates = _candidates(conversations, message, candidate_index)
+    tasks = [asyncio.ensure_future(classify(conversation)) for conversation in candidates]
+    try:
+        async with asyncio.timeout(deadline_seconds):
+            results = await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        # let the cancelled comparisons hand their llm gateway slots back before moving on
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    matched_ids = {id(conversation) for conversation, is_match in zip(candidates, results) if is_match}
+    updates = _add_to_matches(
+        conversations, message, [id(conversation) in matched_ids for conversation in conversations]
+    )
+    if candidate_index is not None:
+        candidate_index.sync(updates)
+    return updates
+
+
+def _add_to_choice(
+    conversations: list[Conversation],
+    message: ClassifiedMessage,
+    candidates: list[Conversation],
+    choice: int | None,
+    candidate_index: CandidateIndex | None,
+) -> list[Conversation]:
+    chosen = None if choice is None else id(candidates[choice])
+    updates = _add_to_matches(
+        conversations, message, [id(conversation) == chosen for conversation in conversations]
+    )
+    if candidate_index is not None:
+        candidate_index.sync(updates)
+    return updates
+
+
+def disentangle_message_choice(
+    conversations: list[Conversation],
+    message: ClassifiedMessage,
+    chooser: Callable[[list[Conversation], ClassifiedMessage], int | None],
+    candidate_index: CandidateIndex | None = None,
+) -> list[Conversation]:
+    """
+    Add the message to the one candidate conversation picked by the chooser, or
+    start a new conversation when it picks none.
+    """
+    candidates = _candidates(conversations, message, candidate_index)
+    choice = chooser(candidates, message) if candidates else None
+    return _add_to_choice(conversations, message, candidates, choice, candidate_index)
+
+
+async def disentangle_message_choice_async(
+    conversations: list[Conversation],
+    message: ClassifiedMessage,
+    chooser: Callable[[list[Conversation], ClassifiedMessage], Awaitable[int | None]],
+    candidate_index: CandidateIndex | None = None,
+    deadline_seconds: float | None = None,
+) -> list[Conversation]:
+    candidates = _candidates(conversations, message, candidate_index)
+    choice = None
+    if candidates:
+        async with asyncio.timeout(deadline_seconds):
+            choice = await chooser(candidates, message)
+    return _add_to_choice(conversations, message, candidates, choice, candidate_index)
+
+
+def disentangle_message_batched(
+    conversations: list[Conversation],
+    message: ClassifiedMessage,
+    batch_classifier: Callable[[list[Conversation], ClassifiedMessage], list[bool]],
+) -> list[Conversation]:
+    """
+    Same as `disentangle_message` for classifiers that score the message against
+    all the conversations in one call.
+    """
+    return _add_to_matches(conversations, message, batch_classifier(conversations, message))
+
+
 def update_completed_conversation(
     conversations: list[Conversation], current_time: datetime
 ) -> list[Conversation]:
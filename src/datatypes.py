@@ -1,6 +1,10 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
 from typing import Literal
+from collections import Counter
 from datetime import datetime
+from functools import cached_property
+import numpy as np
+from text_utils import has_temporal_cue, mentions, message_tokens, tokenize
 
 
 class CalendarClassification(BaseModel):
@@ -9,17 +13,126 @@ class CalendarClassification(BaseModel):
     score: float
 
 
+class DerivedState:
+    """
+    Base of the caches kept as private attributes of the models. They are derived
+    from the model fields, so a cache, computed or not yet (None), never makes two
+    otherwise equal models unequal.
+    """
+
+    def __eq__(self, other):
+        return other is None or isinstance(other, DerivedState)
+
+    __hash__ = None
+
+
+class MessageFeatures(DerivedState):
+    """
+    Message side inputs of the disentanglement rules, each derived on first use
+    and then shared by every rule and every conversation the message is compared
+    against. The embedding is filled in by whoever encodes the message first.
+    """
+
+    def __init__(self, text: str, ts: datetime):
+        self.text = text
+        self.timestamp = ts
+        self.embedding: np.ndarray | None = None
+
+    @cached_property
+    def tokens(self) -> frozenset[str]:
+        return message_tokens(self.text)
+
+    @cached_property
+    def mentions(self) -> frozenset[str]:
+        return mentions(self.text)
+
+    @cached_property
+    def ts(self) -> float:
+        """Epoch seconds."""
+        return self.timestamp.timestamp()
+
+
 class Message(BaseModel):
     seqid: int
     ts: datetime
     user: str
     message: str
+    # derived from message and ts, not serialised
+    _features: MessageFeatures | None = PrivateAttr(default=None)
+
+    @property
+    def features(self) -> MessageFeatures:
+        features = self._features
+        # copies share private attributes, recompute when the copy changed the inputs
+        if features is None or features.text != self.message or features.timestamp != self.ts:
+            features = self._features = MessageFeatures(self.message, self.ts)
+        return features
 
 
 class ClassifiedMessage(Message):
     classification: CalendarClassification
 
 
+class EmbeddingState(DerivedState):
+    """Running sum of the normalised embeddings of the lines of a conversation."""
+
+    def __init__(self):
+        self.total: np.ndarray | None = None
+        self.lines = 0
+
+    def pending(self, lines: list[Message]) -> list[Message]:
+        """Lines appended since the last fold."""
+        return lines[self.lines:]
+
+    def fold(self, embeddings: np.ndarray):
+        if len(embeddings) == 0:
+            return
+        summed = np.asarray(embeddings, dtype=np.float32).sum(axis=0)
+        self.total = summed if self.total is None else self.total + summed
+        self.lines += len(embeddings)
+
+    @property
+    def centroid(self) -> np.ndarray | None:
+        if self.total is None:
+            return None
+        norm = np.linalg.norm(self.total)
+        return self.total / norm if norm else self.total
+
+
+class KeywordState(DerivedState):
+    """Token counts over the lines of a conversation."""
+
+    def __init__(self):
+        self.counts: Counter[str] = Counter()
+        self.lines = 0
+
+    def sync(self, lines: list[Message]):
+        """Tokenise the lines appended since the last sync."""
+        for line in lines[self.lines:]:
+            self.counts.update(tokenize(line.message))
+        self.lines = len(lines)
+
+
+class ExtractionState(DerivedState):
+    """Number of lines the event datetime of a conversation was last extracted from."""
+
+    def __init__(self):
+        self.lines = 0
+        self.extracted = False
+
+    def changed(self, lines: list[Message]) -> bool:
+        """Whether lines were appended since the last extraction, always True before the first one."""
+        return not self.extracted or len(lines) > self.lines
+
+    def new_temporal_cue(self, lines: list[Message]) -> bool:
+        """Whether one of the lines not seen by the last extraction mentions a time or date."""
+        return any(has_temporal_cue(line.message) for line in lines[self.lines:])
+
+    def mark(self, lines: list[Message]):
+        self.lines = len(lines)
+        self.extracted = True
+
+
 class Conversation(BaseModel):
     lines: list[Message] = []
     users: set[str] = set()
@@ -27,6 +140,22 @@ class Conversation(BaseModel):
     suspended: bool = False
     completed: bool = False
     event_datetime: datetime | None = None
+    # derived from lines, not serialised
+    _embedding_state: EmbeddingState = PrivateAttr(default_factory=EmbeddingState)
+    _keyword_state: KeywordState = PrivateAttr(default_factory=KeywordState)
+    _extraction_state: ExtractionState = PrivateAttr(default_factory=ExtractionState)
+
+    @property
+    def embedding_state(self) -> EmbeddingState:
+        return self._embedding_state
+
+    @property
+    def keyword_state(self) -> KeywordState:
+        return self._keyword_state
+
+    @property
+    def extraction_state(self) -> ExtractionState:
+        return self._extraction_state
 
 
 class CreateConversationEvent(BaseModel):
@@ -0,0 +1,150 @@
+import asyncio
+import logging
+import time
+from typing import Callable
+
+import numpy as np
+from pydantic import BaseModel
+
+from datatypes import Message
+from inference_service import InferenceService, get_inference_service
+
+
+logger = logging.getLogger(__name__)
+
+EncodeRequest = tuple[list[str], asyncio.Future]
+
+
+class EmbeddingStats(BaseModel):
+    requests: int = 0
+    texts: int = 0
+    batches: int = 0
+    encode_seconds: float = 0.0
+
+    @property
+    def mean_batch_size(self) -> float:
+        return self.texts / self.batches if self.batches else 0.0
+
+    @property
+    def mean_latency_ms(self) -> float:
+        return self.encode_seconds * 1000 / self.batches if self.batches else 0.0
+
+
+class EmbeddingService:
+    """
+    Coalesces concurrent encode requests into batches for the sentence transformer.
+    A batch is encoded once it holds `max_batch_size` texts or `max_wait_seconds`
+    have passed since its first request, and each waiter gets back its own rows.
+    """
+
+    def __init__(
+        self,
+        encode: Callable[[list[str]], np.ndarray] | None = None,
+        max_batch_size: int = 64,
+        max_wait_seconds: float = 0.01,
+        inference_service: InferenceService | None = None,
+    ):
+        if encode is None:
+            from conversations.disentanglement.rule_based_classifier import _encode
+            encode = _encode
+        self._encode = encode
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_seconds
+        self.inference_service = inference_service
+        self.stats = EmbeddingStats()
+        self._queue: asyncio.Queue[EncodeRequest | None] = asyncio.Queue()
+        # request taken off the queue that did not fit in the previous batch
+        self._carry: EncodeRequest | None = None
+        self._worker: asyncio.Task | None = None
+
+    async def encode(self, texts: list[str]) -> np.ndarray:
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._serve())
+        future = asyncio.get_running_loop().create_future()
+        self.stats.requests += 1
+        await self._queue.put((list(texts), future))
+        return await future
+
+    async def embed_messages(self, messages: list[Message]):
+        """Fill in the embedding of the messages that were not encoded yet."""
+        missing = list({
+            id(message): message for message in messages if message.features.embedding is None
+        }.values())
+        if not missing:
+            return
+        embeddings = await self.encode([message.message for message in missing])
+        for message, embedding in zip(missing, embeddings):
+            message.features.embedding = embedding
+
+    async def _gather(self) -> tuple[list[EncodeRequest], bool]:
+        """
+        Wait for a request, then keep collecting until the batch is full or the
+        deadline has passed. Returns the batch and whether the service was closed.
+        """
+        request = self._carry or await self._queue.get()
+        self._carry = None
+        if request is None:
+            return [], True
+
+        batch, size = [request], len(request[0])
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait_seconds
+        while size < self.max_batch_size:
+            if self._queue.empty():
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    request = await asyncio.wait_for(self._queue.get(), remaining)
+                except TimeoutError:
+                    break
+            else:
+                request = self._queue.get_nowait()
+            if request is None:
+                return batch, True
+            if size + len(request[0]) > self.max_batch_size:
+                self._carry = request
+                break
+            batch.append(request)
+            size += len(request[0])
+        return batch, False
+
+    async def _serve(self):
+        inference_service = self.inference_service or get_inference_service()
+        while True:
+            batch, closed = await self._gather()
+            if batch:
+                await self._encode_batch(batch, inference_service)
+            if closed:
+                break
+
+    async def _encode_batch(self, batch: list[EncodeRequest], inference_service: InferenceService):
+        texts = [text for request_texts, _ in batch for text in request_texts]
+        started = time.perf_counter()
+        try:
+            embeddings = await inference_service.run(self._encode, texts)
+        except Exception as e:
+            logger.error(f"Failed to encode batch of {len(texts)} texts: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        elapsed = time.perf_counter() - started
+
+        self.stats.texts += len(texts)
+        self.stats.batches += 1
+        self.stats.encode_seconds += elapsed
+        logger.debug(
+            f"Encoded {len(texts)} texts from {len(batch)} requests in {elapsed * 1000:.1f}ms"
+        )
+
+        start = 0
+        for request_texts, future in batch:
+            if not future.done():
+                future.set_result(embeddings[start:start + len(request_texts)])
+            start += len(request_texts)
+
+    async def aclose(self):
+        if self._worker is not None and not self._worker.done():
+            await self._queue.put(None)
+            await self._worker
@@ -0,0 +1,57 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import logging
+import os
+from typing import Any, Callable
+
+import torch
+
+
+logger = logging.getLogger(__name__)
+
+
+class InferenceService:
+    """
+    Runs blocking model calls on a dedicated thread pool, so coroutines await the
+    result instead of stalling the event loop while torch computes.
+
+    Torch releases the GIL inside its kernels, so a thread pool is enough to keep
+    the loop responsive without pickling the model into worker processes. The
+    intra-op thread count is split between the workers so that concurrent forward
+    passes do not oversubscribe the available cores.
+    """
+
+    def __init__(self, max_workers: int = 1, intra_op_threads: int | None = None):
+        self.max_workers = max_workers
+        self.intra_op_threads = intra_op_threads or max(1, (os.cpu_count() or 1) // max_workers)
+        torch.set_num_threads(self.intra_op_threads)
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="inference"
+        )
+        logger.info(
+            f"Inference service started with {max_workers} worker(s)"
+            f" and {self.intra_op_threads} torch thread(s)"
+        )
+
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(fn, *args, **kwargs))
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+
+
+_inference_service: InferenceService | None = None
+
+
+def get_inference_service() -> InferenceService:
+    """Process wide service, sized with INFERENCE_WORKERS and INFERENCE_INTRA_OP_THREADS."""
+    global _inference_service
+    if _inference_service is None:
+        intra_op_threads = os.getenv("INFERENCE_INTRA_OP_THREADS")
+        _inference_service = InferenceService(
+            max_workers=int(os.getenv("INFERENCE_WORKERS", "1")),
+            intra_op_threads=int(intra_op_threads) if intra_op_threads else None,
+        )
+    return _inference_service
@@ -0,0 +1,134 @@
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+import sqlite3
+import threading
+import time
+from typing import Any
+
+from pydantic import BaseModel
+
+
+logger = logging.getLogger(__name__)
+
+
+class LLMCacheStats(BaseModel):
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class LLMResponseCache:
+    """
+    Content addressed store of llm responses in SQLite. Every call runs with
+    `temperature: 0`, so a request with the same model, prompt, format and options
+    gets the same answer and replaying a captured stream costs no llm time. The
+    least recently used responses are evicted once the stored content exceeds
+    `max_bytes`. Lookups never write, the time a hit was used is kept in memory
+    and written with the next `put`, or once `touch_batch` hits are pending.
+    """
+
+    def __init__(self, path: str | Path, max_bytes: int = 256 * 2**20, touch_batch: int = 256):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.touch_batch = touch_batch
+        self.stats = LLMCacheStats()
+        self._lock = threading.Lock()
+        # key -> last time a hit used it, not yet written
+        self._touched: dict[str, float] = {}
+        # the sync client and the inference pool threads share the connection, guarded by the lock
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses"
+            " (key TEXT PRIMARY KEY, content TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._connection.commit()
+        (self._size,) = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()
+
+    @staticmethod
+    def key(model: str, messages: list[dict], format: Any = None, options: dict | None = None) -> str:
+        request = {"model": model, "messages": messages, "format": format, "options": options}
+        return hashlib.sha256(json.dumps(request, sort_keys=True, default=str).encode()).hexdigest()
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            row = self._connection.execute("SELECT content FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.stats.misses += 1
+                return None
+            self._touched[key] = time.time()
+            if len(self._touched) >= self.touch_batch:
+                self._write_touched()
+                self._connection.commit()
+            self.stats.hits += 1
+            return row[0]
+
+    def _write_touched(self):
+        self._connection.executemany(
+            "UPDATE responses SET last_used = ? WHERE key = ?",
+            [(last_used, key) for key, last_used in self._touched.items()],
+        )
+        self._touched.clear()
+
+    def put(self, key: str, content: str):
+        size = len(content.encode())
+        with self._lock:
+            # eviction orders by last_used, bring it up to date first
+            self._write_touched()
+            previous = self._connection.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses (key, content, size, last_used) VALUES (?, ?, ?, ?)",
+                (key, content, size, time.time()),
+            )
+            self._size += size - (previous[0] if previous else 0)
+            self._evict()
+            self._connection.commit()
+
+    def _evict(self):
+        if self._size <= self.max_bytes:
+            return
+        evicted = []
+        for key, size in self._connection.execute("SELECT key, size FROM responses ORDER BY last_used"):
+            if self._size <= self.max_bytes:
+                break
+            evicted.append((key,))
+            self._size -= size
+        self._connection.executemany("DELETE FROM responses WHERE key = ?", evicted)
+        self.stats.evictions += len(evicted)
+        logger.debug(f"Evicted {len(evicted)} cached llm responses")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    @property
+    def size_bytes(self) -> int:
+        return self._size
+
+    def close(self):
+        with self._lock:
+            self._write_touched()
+            self._connection.commit()
+            self._connection.close()
+
+
+_llm_cache: LLMResponseCache | None = None
+
+
+def get_llm_cache() -> LLMResponseCache | None:
+    """Process wide cache at LLM_CACHE_PATH bounded by LLM_CACHE_MAX_MB, None when no path is set."""
+    global _llm_cache
+    path = os.getenv("LLM_CACHE_PATH")
+    if not path:
+        return None
+    if _llm_cache is None:
+        _llm_cache = LLMResponseCache(path, max_bytes=int(float(os.getenv("LLM_CACHE_MAX_MB", "256")) * 2**20))
+    return _llm_cache
@@ -0,0 +1,261 @@
+import asyncio
+from collections import Counter, deque
+from contextlib import asynccontextmanager, contextmanager
+from enum import IntEnum
+import logging
+import os
+import threading
+import time
+from typing import AsyncIterator, Callable, Iterator
+
+from pydantic import BaseModel
+
+
+logger = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    # per message disentanglement, someone is waiting on it
+    INTERACTIVE = 0
+    # datetime extraction of suspended conversations
+    BACKGROUND = 1
+
+
+# slots granted to each class in turn while both have requests waiting
+DEFAULT_WEIGHTS = {Priority.INTERACTIVE: 4, Priority.BACKGROUND: 1}
+
+
+class GatewayClassStats(BaseModel):
+    requests: int = 0
+    expired: int = 0
+    wait_seconds: float = 0.0
+    service_seconds: float = 0.0
+
+    @property
+    def mean_wait_ms(self) -> float:
+        return self.wait_seconds * 1000 / self.requests if self.requests else 0.0
+
+    @property
+    def mean_service_ms(self) -> float:
+        return self.service_seconds * 1000 / self.requests if self.requests else 0.0
+
+
+class _Waiter:
+    def __init__(self, priority: Priority, model: str, grant: Callable[[], None]):
+        self.priority = priority
+        self.model = model
+        self.grant = grant
+        self.granted = False
+        self.enqueued = time.perf_counter()
+
+
+def _on_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+class LLMGateway:
+    """
+    Single entry point of the llm calls of every module. At most `max_concurrency`
+    calls run at once, and at most `model_limits[model]` for a model. Waiting
+    requests are queued per priority class and served by weighted round robin:
+    each class gets up to `weights[class]` slots in turn while the others wait, so
+    interactive calls come first without starving the background ones. A request
+    still waiting after its deadline, its own or its class', gives up with a
+    TimeoutError instead of reaching the llm late.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 4,
+        model_limits: dict[str, int] | None = None,
+        weights: dict[Priority, int] | None = None,
+        deadlines: dict[Priority, float | None] | None = None,
+    ):
+        self.max_concurrency = max_concurrency
+        self.model_limits = model_limits or {}
+        self.weights = weights or DEFAULT_WEIGHTS
+        self.deadlines = deadlines or {}
+        self.stats = {priority: GatewayClassStats() for priority in Priority}
+        self._queues: dict[Priority, deque[_Waiter]] = {priority: deque() for priority in Priority}
+        self._credits = dict(self.weights)
+        self._in_flight = 0
+        self._in_flight_by_model: Counter[str] = Counter()
+        self._lock = threading.Lock()
+
+    def queue_depth(self, priority: Priority) -> int:
+        with self._lock:
+            return len(self._queues[priority])
+
+    def _has_room(self, model: str) -> bool:
+        limit = self.model_limits.get(model)
+        return limit is None or self._in_flight_by_model[model] < limit
+
+    def _eligible(self, priority: Priority) -> _Waiter | None:
+        """First waiter of the class whose model has room, FIFO within the class."""
+        for waiter in self._queues[priority]:
+            if self._has_room(waiter.model):
+                return waiter
+        return None
+
+    def _next_waiter(self) -> _Waiter | None:
+        eligible = {priority: self._eligible(priority) for priority in Priority}
+        waiting = [priority for priority in Priority if eligible[priority] is not None]
+        if not waiting:
+            return None
+        if len(waiting) == 1:
+            # turns are only taken while classes compete for the slot
+            return eligible[waiting[0]]
+        with_credit = [priority for priority in waiting if self._credits[priority] > 0]
+        if not with_credit:
+            self._credits = dict(self.weights)
+            with_credit = waiting
+        priority = min(with_credit)
+        self._credits[priority] -= 1
+        return eligible[priority]
+
+    def _dispatch(self):
+        while self._in_flight < self.max_concurrency:
+            waiter = self._next_waiter()
+            if waiter is None:
+                return
+            self._queues[waiter.priority].remove(waiter)
+            self._start(waiter)
+            waiter.grant()
+
+    def _start(self, waiter: _Waiter):
+        waiter.granted = True
+        self._in_flight += 1
+        self._in_flight_by_model[waiter.model] += 1
+        stats = self.stats[waiter.priority]
+        stats.requests += 1
+        stats.wait_seconds += time.perf_counter() - waiter.enqueued
+
+    def _enqueue(self, waiter: _Waiter):
+        with self._lock:
+            self._queues[waiter.priority].append(waiter)
+            self._dispatch()
+
+    def _release(self, waiter: _Waiter, started: float):
+        with self._lock:
+            self._in_flight -= 1
+            self._in_flight_by_model[waiter.model] -= 1
+            self.stats[waiter.priority].service_seconds += time.perf_counter() - started
+            self._dispatch()
+
+    def _abandon(self, waiter: _Waiter) -> bool:
+        """Take a waiter that stopped waiting out of its queue, False if it was granted meanwhile."""
+        with self._lock:
+            if waiter.granted:
+                return False
+            self._queues[waiter.priority].remove(waiter)
+            self.stats[waiter.priority].expired += 1
+            return True
+
+    def _expired(self, waiter: _Waiter, deadline_seconds: float | None) -> TimeoutError:
+        logger.warning(
+            f"LLM request for {waiter.model} waited longer than {deadline_seconds}s"
+            f" in the {waiter.priority.name.lower()} queue"
+        )
+        return TimeoutError(f"LLM gateway deadline of {deadline_seconds}s passed before the request ran")
+
+    @contextmanager
+    def slot(self, priority: Priority, model: str, deadline_seconds: float | None = None) -> Iterator[None]:
+        """
+        Hold a slot for a blocking llm call, waiting at most `deadline_seconds` or
+        the class deadline. On the thread of a running event loop a slot that is
+        not free right away raises RuntimeError instead: the loop's `aslot` holders
+        could never release while it waits, use `aslot` there.
+        """
+        granted = threading.Event()
+        waiter = _Waiter(priority, model, granted.set)
+        deadline_seconds = deadline_seconds if deadline_seconds is not None else self.deadlines.get(priority)
+        self._enqueue(waiter)
+        if not granted.is_set() and _on_event_loop() and self._abandon(waiter):
+            raise RuntimeError(f"LLM request for {model} would block the running event loop, use aslot")
+        if not granted.wait(deadline_seconds) and self._abandon(waiter):
+            raise self._expired(waiter, deadline_seconds)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._release(waiter, started)
+
+    @asynccontextmanager
+    async def aslot(self, priority: Priority, model: str, deadline_seconds: float | None = None) -> AsyncIterator[None]:
+        """Hold a slot for an llm call awaited on the running loop."""
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def grant():
+            # slots are also released from the worker threads of sync callers
+            loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(None))
+
+        waiter = _Waiter(priority, model, grant)
+        deadline_seconds = deadline_seconds if deadline_seconds is not None else self.deadlines.get(priority)
+        self._enqueue(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(granted), deadline_seconds)
+        except BaseException as e:
+            if self._abandon(waiter):
+                if isinstance(e, TimeoutError):
+                    raise self._expired(waiter, deadline_seconds) from e
+                raise
+            # granted while the wait was cancelled, hand the slot back
+            self._release(waiter, time.perf_counter())
+            raise
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._release(waiter, started)
+
+
+def log_llm_gateway_stats(gateway: LLMGateway | None = None):
+    gateway = gateway or get_llm_gateway()
+    for priority, stats in gateway.stats.items():
+        logger.info(
+            f"LLM gateway {priority.name.lower()}: {stats.requests} requests, mean wait {stats.mean_wait_ms:.1f}ms,"
+            f" mean service {stats.mean_service_ms:.1f}ms, {stats.expired} expired before running"
+        )
+
+
+def _model_limits(setting: str) -> dict[str, int]:
+    """`model=limit` pairs separated by commas, e.g. `qwq:32b=1,deepseek-r1:8b=2`."""
+    limits = {}
+    for pair in filter(None, (pair.strip() for pair in setting.split(","))):
+        model, _, limit = pair.rpartition("=")
+        limits[model] = int(limit)
+    return limits
+
+
+def _deadline(name: str) -> float | None:
+    value = os.getenv(name)
+    return float(value) if value else None
+
+
+_llm_gateway: LLMGateway | None = None
+_llm_gateway_lock = threading.Lock()
+
+
+def get_llm_gateway() -> LLMGateway:
+    """Process wide gateway configured from the LLM_GATEWAY_* settings."""
+    global _llm_gateway
+    with _llm_gateway_lock:
+        if _llm_gateway is None:
+            _llm_gateway = LLMGateway(
+                max_concurrency=int(os.getenv("LLM_GATEWAY_MAX_CONCURRENCY", "4")),
+                model_limits=_model_limits(os.getenv("LLM_GATEWAY_MODEL_LIMITS", "")),
+                weights={
+                    Priority.INTERACTIVE: int(os.getenv("LLM_GATEWAY_INTERACTIVE_WEIGHT", "4")),
+                    Priority.BACKGROUND: 1,
+                },
+                deadlines={
+                    Priority.INTERACTIVE: _deadline("LLM_GATEWAY_INTERACTIVE_DEADLINE_SECONDS"),
+                    Priority.BACKGROUND: _deadline("LLM_GATEWAY_BACKGROUND_DEADLINE_SECONDS"),
+                },
+            )
+        return _llm_gateway
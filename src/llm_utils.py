@@ -0,0 +1,149 @@
+import asyncio
+import logging
+import os
+import re
+import threading
+from typing import Any, Awaitable, Callable
+
+from ollama import AsyncClient
+from pydantic import BaseModel, ValidationError
+
+from llm_cache import LLMResponseCache, get_llm_cache
+from llm_gateway import Priority, get_llm_gateway
+
+
+logger = logging.getLogger(__name__)
+
+
+_async_client: AsyncClient | None = None
+
+
+def get_async_client() -> AsyncClient:
+    """Shared async ollama client, created on first use inside the running loop."""
+    global _async_client
+    if _async_client is None:
+        _async_client = AsyncClient()
+    return _async_client
+
+
+def reasoning_enabled() -> bool:
+    """
+    Whether the llm is asked for a reason next to its decision. Off by default,
+    output tokens dominate the latency of a local model and the reason is only
+    useful while debugging prompts.
+    """
+    return os.getenv("LLM_REASONING", "false").lower() in ("1", "true", "yes")
+
+
+def response_model(lean: type[BaseModel], reasoned: type[BaseModel]) -> type[BaseModel]:
+    return reasoned if reasoning_enabled() else lean
+
+
+_REASON_LINE = re.compile(r"^[ \t]*reason:.*\n", re.MULTILINE)
+
+
+def prompt_examples(examples: str) -> str:
+    """Few-shot examples of a prompt, without their `reason:` lines when the response has no reason."""
+    return examples if reasoning_enabled() else _REASON_LINE.sub("", examples)
+
+
+class LLMUsageStats(BaseModel):
+    calls: int = 0
+    prompt_tokens: int = 0
+    response_tokens: int = 0
+
+    @property
+    def mean_response_tokens(self) -> float:
+        return self.response_tokens / self.calls if self.calls else 0.0
+
+
+llm_usage: dict[str, LLMUsageStats] = {}
+_llm_usage_lock = threading.Lock()
+
+
+def record_usage(name: str, response: Any):
+    """Accumulate the prompt and response token counts ollama reports for a call."""
+    prompt_tokens = getattr(response, "prompt_eval_count", None) or 0
+    response_tokens = getattr(response, "eval_count", None) or 0
+    with _llm_usage_lock:
+        stats = llm_usage.setdefault(name, LLMUsageStats())
+        stats.calls += 1
+        stats.prompt_tokens += prompt_tokens
+        stats.response_tokens += response_tokens
+    logger.debug(f"{name}: {prompt_tokens} prompt tokens, {response_tokens} response tokens")
+
+
+class CachedMessage(BaseModel):
+    content: str
+
+
+class CachedResponse(BaseModel):
+    """Stands in for the ollama response when the content comes from the cache."""
+    message: CachedMessage
+
+
+def _cache_key(request: dict) -> str:
+    return LLMResponseCache.key(
+        request["model"], request["messages"], request.get("format"), request.get("options")
+    )
+
+
+def _cacheable(content: str | None, output_model: type[BaseModel] | None) -> bool:
+    """Whether a response may be replayed: not empty, and valid for `output_model` when given."""
+    if not content:
+        return False
+    if output_model is None:
+        return True
+    try:
+        output_model.model_validate_json(content)
+    except ValidationError:
+        return False
+    return True
+
+
+def cached_chat(
+    name: str,
+    chat_fn: Callable[..., Any],
+    priority: Priority = Priority.INTERACTIVE,
+    output_model: type[BaseModel] | None = None,
+    **request,
+) -> Any:
+    """
+    Run `chat_fn(**request)` through the llm gateway at `priority`, unless the llm
+    cache already holds its response. Only responses that `output_model` accepts
+    are cached, a truncated or malformed answer is asked for again next time.
+    """
+    cache = get_llm_cache()
+    key = _cache_key(request) if cache is not None else None
+    if cache is not None:
+        content = cache.get(key)
+        if _cacheable(content, output_model):
+            return CachedResponse(message=CachedMessage(content=content))
+    with get_llm_gateway().slot(priority, request["model"]):
+        response = chat_fn(**request)
+    record_usage(name, response)
+    if cache is not None and _cacheable(response.message.content, output_model):
+        cache.put(key, response.message.content)
+    return response
+
+
+async def acached_chat(
+    name: str,
+    chat_fn: Callable[..., Awaitable[Any]],
+    priority: Priority = Priority.INTERACTIVE,
+    output_model: type[BaseModel] | None = None,
+    **request,
+) -> Any:
+    """Async version of `cached_chat`, the sqlite cache is read and written off the event loop."""
+    cache = get_llm_cache()
+    key = _cache_key(request) if cache is not None else None
+    if cache is not None:
+        content = await asyncio.to_thread(cache.get, key)
+        if _cacheable(content, output_model):
+            return CachedResponse(message=CachedMessage(content=content))
+    async with get_llm_gateway().aslot(priority, request["model"]):
+        response = await chat_fn(**request)
+    record_usage(name, response)
+    if cache is not None and _cacheable(response.message.content, output_model):
+        await asyncio.to_thread(cache.put, key, response.message.content)
+    return response
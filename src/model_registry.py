@@ -0,0 +1,54 @@
+import logging
+import threading
+import time
+from typing import Any, Callable
+
+
+logger = logging.getLogger(__name__)
+
+
+class ModelRegistry:
+    """
+    Holds the loaders of the models used in the pipeline and loads each model
+    the first time it is requested, or when `warmup` is called.
+    """
+
+    def __init__(self):
+        self._loaders: dict[str, Callable[[], Any]] = {}
+        self._models: dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, loader: Callable[[], Any]):
+        self._loaders[name] = loader
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._models
+
+    def get(self, name: str) -> Any:
+        if name in self._models:
+            return self._models[name]
+        if name not in self._loaders:
+            raise KeyError(f"No model registered with name: {name}")
+
+        # the inference pool can request the same model from several threads
+        with self._lock:
+            if name not in self._models:
+                started = time.perf_counter()
+                self._models[name] = self._loaders[name]()
+                logger.info(f"Loaded model '{name}' in {time.perf_counter() - started:.2f}s")
+        return self._models[name]
+
+    def warmup(self, *names: str):
+        """Load the given models up front, all registered models if none are given."""
+        for name in names or list(self._loaders):
+            self.get(name)
+
+    def unload(self, name: str):
+        self._models.pop(name, None)
+
+
+registry = ModelRegistry()
+
+
+def warmup(*names: str):
+    registry.warmup(*names)
@@ -0,0 +1,229 @@
+"""
+ONNX Runtime backend for the calendar classifier.
+
+Requires the optional `onnx` dependencies, `uv sync --extra onnx`.
+
+    uv run calendar_classifier_onnx export model/bert_classifier_v1 --quantize
+    uv run calendar_classifier_onnx parity model/bert_classifier_v1 data/test.csv --quantized
+"""
+import argparse
+import logging
+from pathlib import Path
+import time
+from typing import Callable
+
+import numpy as np
+import onnxruntime as ort
+from pydantic import BaseModel
+import torch
+from transformers import AutoConfig, AutoModelForSequenceClassification, BertTokenizer
+
+
+logger = logging.getLogger(__name__)
+
+Predictions = list[dict]
+TextClassifier = Callable[..., Predictions]
+
+
+def onnx_model_path(model_path: str, quantized: bool = False) -> Path:
+    return Path(model_path) / "onnx" / ("model_int8.onnx" if quantized else "model.onnx")
+
+
+def export_onnx(model_path: str, tokenizer: BertTokenizer) -> Path:
+    """Export the fine tuned model to ONNX with dynamic batch and sequence axes."""
+    output_path = onnx_model_path(model_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+
+    model = AutoModelForSequenceClassification.from_pretrained(model_path)
+    model.eval()
+    sample = tokenizer(["export sample"], return_tensors="pt")
+    input_names = ["input_ids", "attention_mask", "token_type_ids"]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["logits"] = {0: "batch"}
+
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (sample["input_ids"], sample["attention_mask"], sample["token_type_ids"]),
+            str(output_path),
+            input_names=input_names,
+            output_names=["logits"],
+            dynamic_axes=dynamic_axes,
+            opset_version=17,
+            dynamo=False,
+        )
+    logger.info(f"Exported ONNX model to {output_path}")
+    return output_path
+
+
+def quantize_onnx(model_path: str) -> Path:
+    """Dynamic int8 quantization of the exported model's weights."""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    output_path = onnx_model_path(model_path, quantized=True)
+    quantize_dynamic(
+        str(onnx_model_path(model_path)), str(output_path), weight_type=QuantType.QInt8
+    )
+    logger.info(f"Quantized ONNX model written to {output_path}")
+    return output_path
+
+
+def _softmax(logits: np.ndarray) -> np.ndarray:
+    exp = np.exp(logits - logits.max(axis=-1, keepdims=True))
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+
+def _to_predictions(logits: np.ndarray, id2label: dict[int, str]) -> Predictions:
+    probabilities = _softmax(logits)
+    return [
+        {"label": id2label[int(row.argmax())], "score": float(row.max())}
+        for row in probabilities
+    ]
+
+
+class OnnxTextClassifier:
+    """
+    Drop in replacement for the transformers `text-classification` pipeline,
+    returning the same `[{"label": ..., "score": ...}]` predictions.
+
+    `intra_op_threads` caps the threads of one `session.run`, left unset ORT
+    uses every core for each of the inference workers running concurrently.
+    """
+
+    def __init__(
+        self,
+        onnx_path: Path,
+        model_path: str,
+        tokenizer: BertTokenizer,
+        intra_op_threads: int | None = None,
+    ):
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        self.session = ort.InferenceSession(
+            str(onnx_path), options, providers=["CPUExecutionProvider"]
+        )
+        self.tokenizer = tokenizer
+        self.id2label = {
+            int(idx): label for idx, label in AutoConfig.from_pretrained(model_path).id2label.items()
+        }
+        self.input_names = {graph_input.name for graph_input in self.session.get_inputs()}
+
+    def __call__(self, texts: str | list[str], batch_size: int = 1) -> Predictions:
+        if isinstance(texts, str):
+            texts = [texts]
+        predictions = []
+        for start in range(0, len(texts), batch_size):
+            inputs = self.tokenizer(
+                texts[start:start + batch_size],
+                padding=True,
+                truncation=True,
+                return_tensors="np",
+            )
+            feed = {
+                name: value.astype(np.int64)
+                for name, value in inputs.items()
+                if name in self.input_names
+            }
+            (logits,) = self.session.run(["logits"], feed)
+            predictions.extend(_to_predictions(logits, self.id2label))
+        return predictions
+
+
+class ParityReport(BaseModel):
+    messages: int
+    label_agreement: float
+    reference_accuracy: float
+    candidate_accuracy: float
+    mean_score_drift: float
+    max_score_drift: float
+    reference_msgs_per_sec: float
+    candidate_msgs_per_sec: float
+
+
+def _positive_probability(prediction: dict) -> float:
+    return prediction["score"] if prediction["label"] == "LABEL_1" else 1 - prediction["score"]
+
+
+def _timed(classifier: TextClassifier, texts: list[str], batch_size: int) -> tuple[Predictions, float]:
+    started = time.perf_counter()
+    predictions = classifier(texts, batch_size=batch_size)
+    return predictions, len(texts) / (time.perf_counter() - started)
+
+
+def parity_report(
+    texts: list[str],
+    labels: list[bool],
+    reference: TextClassifier,
+    candidate: TextClassifier,
+    batch_size: int = 32,
+) -> ParityReport:
+    """
+    Compare a candidate backend against the reference PyTorch pipeline on a labeled set,
+    score drift is measured on the probability of `LABEL_1`.
+    """
+    reference_predictions, reference_throughput = _timed(reference, texts, batch_size)
+    candidate_predictions, candidate_throughput = _timed(candidate, texts, batch_size)
+
+    expected = ["LABEL_1" if label else "LABEL_0" for label in labels]
+    reference_labels = [prediction["label"] for prediction in reference_predictions]
+    candidate_labels = [prediction["label"] for prediction in candidate_predictions]
+    drift = np.abs(
+        np.array([_positive_probability(p) for p in reference_predictions])
+        - np.array([_positive_probability(p) for p in candidate_predictions])
+    )
+    return ParityReport(
+        messages=len(texts),
+        label_agreement=float(np.mean(np.array(reference_labels) == np.array(candidate_labels))),
+        reference_accuracy=float(np.mean(np.array(reference_labels) == np.array(expected))),
+        candidate_accuracy=float(np.mean(np.array(candidate_labels) == np.array(expected))),
+        mean_score_drift=float(drift.mean()),
+        max_score_drift=float(drift.max()),
+        reference_msgs_per_sec=reference_throughput,
+        candidate_msgs_per_sec=candidate_throughput,
+    )
+
+
+def main():
+    import pandas as pd
+    from transformers import pipeline
+    from text_utils import clean_text
+
+    parser = argparse.ArgumentParser(description="Export and validate the ONNX calendar classifier.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="export the model to ONNX")
+    export_parser.add_argument("model_path", type=str)
+    export_parser.add_argument("--quantize", action="store_true", help="also write a dynamic int8 model")
+
+    parity_parser = subparsers.add_parser("parity", help="compare the ONNX model against PyTorch")
+    parity_parser.add_argument("model_path", type=str)
+    parity_parser.add_argument("data", type=str, help="csv with `message` and `calendar_event` columns")
+    parity_parser.add_argument("--quantized", action="store_true")
+    parity_parser.add_argument("--batch-size", type=int, default=32)
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    tokenizer = BertTokenizer.from_pretrained("bert-base-uncased")
+
+    if args.command == "export":
+        export_onnx(args.model_path, tokenizer)
+        if args.quantize:
+            quantize_onnx(args.model_path)
+    else:
+        data = pd.read_csv(args.data)
+        report = parity_report(
+            texts=[clean_text(message) for message in data["message"]],
+            labels=data["calendar_event"].astype(bool).tolist(),
+            reference=pipeline("text-classification", model=args.model_path, tokenizer=tokenizer),
+            candidate=OnnxTextClassifier(
+                onnx_model_path(args.model_path, args.quantized), args.model_path, tokenizer
+            ),
+            batch_size=args.batch_size,
+        )
+        print(report.model_dump_json(indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,14 +2,26 @@ import asyncio
 from datetime import datetime, timezone
 from enum import Enum
 import os
+import time
 from uuid import uuid4
 from numpy import inf
 from pydantic import ValidationError
 import websockets
 from functools import partial
 from websockets.exceptions import ConnectionClosedOK
-from calendar_event_classifier import is_calendar_event
+from calendar_event_classifier import (
+    CALENDAR_CLASSIFIER,
+    CALENDAR_PREFILTER,
+    classification_cache,
+    classify_messages,
+    is_calendar_event,
+)
 from conversations.disentanglement.last_six_approach import llm_based_classifier
+from conversations.extract_date_time_llm_model import async_model as async_event_datetime_extractor
+from conversations.extract_date_time_rules import extract_event as extract_event_with_rules, min_rule_confidence
+from inference_service import InferenceService, get_inference_service
+from llm_gateway import log_llm_gateway_stats
+from model_registry import warmup
 from conversations.ops import (
     add_message_to_conversation,
     update_suspended_conversation,
@@ -33,7 +45,9 @@ class Meter(Enum):
     incoming_messages = tqdm(desc="Incoming Message Count", unit='msg', total=inf)
     disentangled_messages = tqdm(desc="messages disentangled", unit='msg', total=inf)
     messages_classified = tqdm(desc="messages classified", unit='msg', total=inf)
+    batches_classified = tqdm(desc="batches classified", unit='batch', total=inf)
     conversations_completed = tqdm(desc="Conversations Completed", unit='conv', total=inf)
+    conversations_extracted = tqdm(desc="Conversation datetimes extracted", unit='conv', total=inf)
     conversations_stored = tqdm(desc="Conversations Stored", unit='conv', total=inf)
     conversations_created = tqdm(desc="Conversations created", unit='conv', total=inf)
 
@@ -54,19 +68,150 @@ async def store_probable_calendar_conversations(
             await out.flush()
 
 
+async def _extract_datetime(conversation: Conversation, timeout_seconds: float | None) -> tuple[datetime | None, bool]:
+    """The event datetime and whether it was extracted, False for a fallback guess when the llm failed."""
+    rules = extract_event_with_rules(conversation.lines)
+    if rules.confidence >= min_rule_confidence():
+        return rules.event_datetime, True
+    try:
+        async with asyncio.timeout(timeout_seconds):
+            return await async_event_datetime_extractor(conversation), True
+    except Exception as e:
+        # a slow or failing llm must not stop the pipeline, the rules' best guess is archived instead
+        logger.warning(f"LLM datetime extraction failed for conversation {conversation.lines[0].seqid}: {e!r}")
+        return rules.event_datetime or conversation.event_datetime, False
+
+
+async def extract_conversation_datetimes(
+    conversation_extraction_queue: asyncio.Queue,
+    conversation_archival_queue: asyncio.Queue,
+    max_workers: int = 4,
+    timeout_seconds: float | None = 60.0,
+):
+    """
+    Fill in the event datetime of suspended conversations with `max_workers`
+    concurrent extractions, each llm call bounded by `timeout_seconds`, and pass
+    them on to archival. A conversation is only extracted again once it gained
+    lines, or when its last llm extraction failed. The meter shows the extraction
+    queue depth and the latency.
+    """
+    # conversations a worker is extracting, another worker passes them on as they are
+    in_flight: set[int] = set()
+
+    async def worker():
+        while True:
+            conv = await conversation_extraction_queue.get()
+            if conv is None:
+                # every worker has to see the kill signal
+                conversation_extraction_queue.put_nowait(None)
+                break
+            extraction = conv.extraction_state
+            if extraction.changed(conv.lines) and id(conv) not in in_flight:
+                in_flight.add(id(conv))
+                # lines can be appended while the llm works, only the ones it saw are marked
+                lines = list(conv.lines)
+                started = time.perf_counter()
+                try:
+                    conv.event_datetime, extracted = await _extract_datetime(conv, timeout_seconds)
+                finally:
+                    in_flight.discard(id(conv))
+                if extracted:
+                    extraction.mark(lines)
+                latency_ms = (time.perf_counter() - started) * 1000
+                Meter.conversations_extracted.value.update(1)
+                Meter.conversations_extracted.value.set_postfix(
+                    queue=conversation_extraction_queue.qsize(),
+                    latency_ms=f"{latency_ms:.1f}",
+                )
+            await conversation_archival_queue.put(conv)
+
+    await asyncio.gather(*(worker() for _ in range(max_workers)))
+
+
 async def classify_message(
     valid_message_queue: asyncio.Queue,
     classified_message_queue: asyncio.Queue,
+    inference_service: InferenceService | None = None,
 ):
+    inference_service = inference_service or get_inference_service()
     while True:
         message = await valid_message_queue.get()
         if message is None:
             break
-        classified_message = is_calendar_event(message)
+        classified_message = await inference_service.run(is_calendar_event, message)
         Meter.messages_classified.value.update(1)
         asyncio.create_task(classified_message_queue.put(classified_message))
 
 
+async def _gather_batch(
+    valid_message_queue: asyncio.Queue, max_batch_size: int, max_wait_seconds: float
+) -> tuple[list[Message], bool]:
+    """
+    Wait for a message, then keep collecting until the batch is full or the
+    deadline since the first message has passed.
+
+    Returns the batch and whether the kill signal was received while gathering.
+    """
+    message = await valid_message_queue.get()
+    if message is None:
+        return [], True
+
+    batch = [message]
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + max_wait_seconds
+    while len(batch) < max_batch_size:
+        if valid_message_queue.empty():
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                message = await asyncio.wait_for(valid_message_queue.get(), remaining)
+            except TimeoutError:
+                break
+        else:
+            message = valid_message_queue.get_nowait()
+        if message is None:
+            return batch, True
+        batch.append(message)
+    return batch, False
+
+
+async def classify_message_batches(
+    valid_message_queue: asyncio.Queue,
+    classified_message_queue: asyncio.Queue,
+    max_batch_size: int = 32,
+    max_wait_seconds: float = 0.05,
+    inference_service: InferenceService | None = None,
+):
+    """
+    Micro-batching variant of `classify_message`, a batch is classified once it holds
+    `max_batch_size` messages or `max_wait_seconds` have passed since its first message.
+    """
+    inference_service = inference_service or get_inference_service()
+    while True:
+        batch, stop = await _gather_batch(valid_message_queue, max_batch_size, max_wait_seconds)
+        if batch:
+            started = time.perf_counter()
+            classified_messages = await inference_service.run(
+                classify_messages, batch, batch_size=max_batch_size
+            )
+            latency_ms = (time.perf_counter() - started) * 1000
+
+            Meter.messages_classified.value.update(len(batch))
+            Meter.batches_classified.value.update(1)
+            Meter.batches_classified.value.set_postfix(
+                size=len(batch),
+                latency_ms=f"{latency_ms:.1f}",
+                cache_hit_rate=f"{classification_cache.stats.hit_rate:.2f}",
+            )
+            logger.debug(f"Classified batch of {len(batch)} messages in {latency_ms:.1f}ms")
+
+            for classified_message in classified_messages:
+                asyncio.create_task(classified_message_queue.put(classified_message))
+        if stop:
+            break
+
+
 async def _is_continuation(
     prev_messages: list[ClassifiedMessage], message: ClassifiedMessage
 ) -> int:
@@ -108,7 +253,7 @@ async def conversation_manager(
     state_update_queue: asyncio.Queue,
     conversations: dict[str, Conversation],
     conv_seq_id_map: dict,
-    conversation_archival_queue: asyncio.Queue,
+    suspended_conversation_queue: asyncio.Queue,
 ):
     counter = 0
     while True:
@@ -139,13 +284,13 @@ async def conversation_manager(
             counter = 0
             asyncio.create_task(
                 archive_completed_conversations(
-                    list(conversations.values()), conversation_archival_queue
+                    list(conversations.values()), suspended_conversation_queue
                 )
             )
 
 
 async def archive_completed_conversations(
-    conversations: list[Conversation], conversation_archival_queue: asyncio.Queue
+    conversations: list[Conversation], suspended_conversation_queue: asyncio.Queue
 ):
     updated_convs = update_suspended_conversation(
         conversations,
@@ -155,7 +300,7 @@ async def archive_completed_conversations(
 
     for conv in updated_convs:
         if conv.suspended:
-            await conversation_archival_queue.put(conv)
+            await suspended_conversation_queue.put(conv)
 
 
 async def start_ingestion(message_data, valid_message_queue: asyncio.Queue):
@@ -188,6 +333,8 @@ async def main():
         format="%(asctime)s [%(levelname)s] %(message)s",
         datefmt="%Y-%m-%d %H:%M:%S",
     )
+    warmup(CALENDAR_CLASSIFIER, CALENDAR_PREFILTER)
+
     # state
     conversations = {}
     conv_seq_id_map = {}
@@ -195,9 +342,12 @@ async def main():
     # declare queues
     valid_message_queue = asyncio.Queue()
     classified_message_queue = asyncio.Queue()
+    conversation_extraction_queue = asyncio.Queue()
     conversation_archival_queue = asyncio.Queue()
     state_update_queue = asyncio.Queue()  # Added
 
+    inference_service = get_inference_service()
+
     ingest = partial(
         start_ingestion,
         valid_message_queue=valid_message_queue,
@@ -206,13 +356,26 @@ async def main():
     try:
         async with asyncio.taskgroups.TaskGroup() as group:
             group.create_task(listen(os.getenv("WS_SOCK"), ingest))
-            group.create_task(classify_message(valid_message_queue, classified_message_queue))
+            group.create_task(classify_message_batches(
+                valid_message_queue,
+                classified_message_queue,
+                max_batch_size=int(os.getenv("CLASSIFIER_MAX_BATCH_SIZE", "32")),
+                max_wait_seconds=float(os.getenv("CLASSIFIER_MAX_WAIT_MS", "50")) / 1000,
+                inference_service=inference_service,
+            ))
             group.create_task(classified_message_to_conversation(classified_message_queue, state_update_queue))
             group.create_task(conversation_manager(
                 state_update_queue,
                 conversations,
                 conv_seq_id_map,
-                conversation_archival_queue
+                conversation_extraction_queue,
+            ))
+            deadline_seconds = os.getenv("LLM_EXTRACTION_DEADLINE_SECONDS")
+            group.create_task(extract_conversation_datetimes(
+                conversation_extraction_queue,
+                conversation_archival_queue,
+                max_workers=int(os.getenv("EXTRACTION_WORKERS", "4")),
+                timeout_seconds=float(deadline_seconds) if deadline_seconds else 60.0,
             ))
             group.create_task(store_probable_calendar_conversations(conversation_archival_queue))
 
@@ -227,6 +390,7 @@ async def main():
         for queue in [
             valid_message_queue,
             classified_message_queue,
+            conversation_extraction_queue,
             conversation_archival_queue,
             state_update_queue
         ]:
@@ -237,15 +401,19 @@ async def main():
         for tqdm_meter in [
             Meter.conversations_completed,
             Meter.conversations_created,
+            Meter.conversations_extracted,
             Meter.conversations_stored,
             Meter.disentangled_messages,
             Meter.incoming_messages,
-            Meter.messages_classified
+            Meter.messages_classified,
+            Meter.batches_classified
             ]:
             tqdm_meter.value.close()
 
         # Wait for tasks to complete/cancel
         await asyncio.gather(*current_tasks, return_exceptions=True)
+        inference_service.shutdown(wait=False)
+        log_llm_gateway_stats()
         logging.info("All tasks completed/cancelled")
         logging.info("Graceful shutdown completed.")
 
@@ -0,0 +1,152 @@
+"""
+Cheap first tier in front of the BERT calendar classifier.
+
+A hashing vectorizer + logistic regression trained on the same csv files as
+`bert_classifier_v1`, combined with temporal / meeting keyword heuristics.
+Messages with no keyword cue and a low model score are labelled `LABEL_0`
+without running BERT.
+
+    uv run train_prefilter data/train.csv data/eval.csv --recall-target 0.99
+"""
+import argparse
+import logging
+import threading
+
+import joblib
+import numpy as np
+from pydantic import BaseModel
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.linear_model import LogisticRegression
+
+from text_utils import has_temporal_cue
+
+
+logger = logging.getLogger(__name__)
+
+class PrefilterStats(BaseModel):
+    checked: int = 0
+    skipped: int = 0
+
+    @property
+    def skip_rate(self) -> float:
+        return self.skipped / self.checked if self.checked else 0.0
+
+
+class Prefilter:
+    """
+    Gate that only lets messages through to BERT when they carry a temporal cue
+    or score above a threshold tuned for a recall target on held out data.
+    """
+
+    def __init__(self, n_features: int = 2**18):
+        self.vectorizer = HashingVectorizer(
+            n_features=n_features, ngram_range=(1, 2), alternate_sign=False
+        )
+        self.model = LogisticRegression(max_iter=1000, class_weight="balanced")
+        self.threshold = 0.0
+        self.recall_target = 1.0
+        # scores of the held out positives that have no keyword cue, used to tune the threshold
+        self._calibration_scores = np.array([])
+        self._calibration_positives = 0
+        self.stats = PrefilterStats()
+        self._stats_lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_stats_lock"]
+        state["stats"] = PrefilterStats()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._stats_lock = threading.Lock()
+
+    def fit(self, cleaned_texts: list[str], labels: list[bool]) -> "Prefilter":
+        self.model.fit(self.vectorizer.transform(cleaned_texts), labels)
+        return self
+
+    def scores(self, cleaned_texts: list[str]) -> np.ndarray:
+        return self.model.predict_proba(self.vectorizer.transform(cleaned_texts))[:, 1]
+
+    def calibrate(
+        self, texts: list[str], cleaned_texts: list[str], labels: list[bool], recall_target: float
+    ) -> "Prefilter":
+        positives = [idx for idx, label in enumerate(labels) if label]
+        uncued = [idx for idx in positives if not has_temporal_cue(texts[idx])]
+        self._calibration_positives = len(positives)
+        self._calibration_scores = np.sort(self.scores([cleaned_texts[idx] for idx in uncued]))
+        return self.tune(recall_target)
+
+    def tune(self, recall_target: float) -> "Prefilter":
+        """Pick the highest threshold that still keeps `recall_target` of the calibration positives."""
+        allowed_misses = int((1 - recall_target) * self._calibration_positives)
+        if allowed_misses < len(self._calibration_scores):
+            self.threshold = float(self._calibration_scores[allowed_misses])
+        else:
+            self.threshold = 1.0
+        self.recall_target = recall_target
+        logger.info(f"Prefilter threshold set to {self.threshold:.4f} for recall {recall_target}")
+        return self
+
+    def classify(self, texts: list[str], cleaned_texts: list[str]) -> list[dict | None]:
+        """
+        `LABEL_0` predictions for the obvious negatives, None for messages that
+        need the expensive classifier.
+        """
+        results: list[dict | None] = [None] * len(texts)
+        uncued = [idx for idx, text in enumerate(texts) if not has_temporal_cue(text)]
+        if uncued:
+            scores = self.scores([cleaned_texts[idx] for idx in uncued])
+            for idx, score in zip(uncued, scores):
+                if score < self.threshold:
+                    results[idx] = {"label": "LABEL_0", "score": float(1 - score)}
+
+        skipped = sum(result is not None for result in results)
+        with self._stats_lock:
+            self.stats.checked += len(texts)
+            self.stats.skipped += skipped
+        return results
+
+
+def load_prefilter(path: str) -> Prefilter:
+    return joblib.load(path)
+
+
+def main():
+    import pandas as pd
+    from text_utils import clean_text
+
+    parser = argparse.ArgumentParser(description="Train the calendar prefilter.")
+    parser.add_argument("train", type=str, help="csv with `message` and `calendar_event` columns")
+    parser.add_argument("eval", type=str, help="held out csv used to tune the threshold")
+    parser.add_argument("--output", type=str, default="model/prefilter_v1.joblib")
+    parser.add_argument("--recall-target", type=float, default=0.99)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    train = pd.read_csv(args.train)
+    evaluation = pd.read_csv(args.eval)
+    eval_texts = evaluation["message"].astype(str).tolist()
+    eval_cleaned = [clean_text(text) for text in eval_texts]
+    eval_labels = evaluation["calendar_event"].astype(bool).tolist()
+
+    prefilter = Prefilter().fit(
+        [clean_text(text) for text in train["message"].astype(str)],
+        train["calendar_event"].astype(bool).tolist(),
+    )
+    prefilter.calibrate(eval_texts, eval_cleaned, eval_labels, args.recall_target)
+
+    predictions = prefilter.classify(eval_texts, eval_cleaned)
+    kept_positives = sum(
+        prediction is None for prediction, label in zip(predictions, eval_labels) if label
+    )
+    logger.info(
+        f"eval recall {kept_positives / max(1, sum(eval_labels)):.4f},"
+        f" skip rate {prefilter.stats.skip_rate:.4f}"
+    )
+    joblib.dump(prefilter, args.output)
+    logger.info(f"Saved prefilter to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import logging
+import math
+import os
+import re
+import threading
+from typing import Callable, TypeVar
+
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# words and punctuation, sub-word splits of rare words are covered by a margin
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+_TOKENS_PER_MATCH = 1.3
+
+
+def count_tokens(text: str) -> int:
+    """Estimate of the number of llm tokens in the text, without loading a tokenizer."""
+    return math.ceil(len(_TOKEN_PATTERN.findall(text)) * _TOKENS_PER_MATCH)
+
+
+def prompt_token_budget() -> int:
+    return int(os.getenv("LLM_PROMPT_TOKEN_BUDGET", "6144"))
+
+
+def select_within_budget(
+    items: list[T],
+    budget: int,
+    render: Callable[[T], str],
+    relevant: Callable[[T], bool] | None = None,
+) -> list[T]:
+    """
+    The most recent items whose rendering fits in `budget` tokens, in their
+    original order. Items for which `relevant` holds are picked before the
+    others, and the last item is always kept.
+    """
+    if not items:
+        return []
+    last = len(items) - 1
+    order = list(range(last - 1, -1, -1))
+    if relevant is not None:
+        order.sort(key=lambda idx: not relevant(items[idx]))
+
+    chosen = {last}
+    used = count_tokens(render(items[last]))
+    for idx in order:
+        cost = count_tokens(render(items[idx]))
+        if used + cost <= budget:
+            chosen.add(idx)
+            used += cost
+    if len(chosen) < len(items):
+        logger.debug(f"Kept {len(chosen)} of {len(items)} lines within {budget} prompt tokens")
+    return [items[idx] for idx in sorted(chosen)]
+
+
+# largest num_ctx sent to each model so far
+_num_ctx_high_water: dict[str, int] = {}
+_num_ctx_lock = threading.Lock()
+
+
+def num_ctx_for(prompt: str, response_tokens: int = 256, minimum: int = 2048, model: str | None = None) -> int:
+    """
+    Context size for the prompt and the expected response, rounded up to a power
+    of two. Ollama reloads the model when `num_ctx` changes, so only a few sizes
+    are ever used, and with `model` the size never shrinks below the largest one
+    already sent to it: short disentanglement prompts interleaved with long
+    extraction prompts would otherwise reload a 32B model back and forth. Small
+    prompts then pay the prompt-eval and memory cost of the larger context, far
+    less than a reload.
+    """
+    maximum = int(os.getenv("LLM_MAX_NUM_CTX", "8192"))
+    needed = count_tokens(prompt) + response_tokens
+    num_ctx = minimum
+    while num_ctx < needed and num_ctx < maximum:
+        num_ctx *= 2
+    # the maximum need not be a power of two, compare with the size actually sent
+    num_ctx = min(num_ctx, maximum)
+    if needed > num_ctx:
+        logger.warning(f"Prompt of about {needed} tokens does not fit in num_ctx {num_ctx}, it will be truncated")
+    if model is not None:
+        with _num_ctx_lock:
+            num_ctx = max(num_ctx, _num_ctx_high_water.get(model, 0))
+            _num_ctx_high_water[model] = num_ctx
+    return num_ctx
+
+
+def chat_options(prompt: str, model: str | None = None) -> dict:
+    return {"temperature": 0, "num_ctx": num_ctx_for(prompt, model=model)}
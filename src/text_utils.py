@@ -1,34 +1,86 @@
+from functools import lru_cache
 import re
 
 
-def _remove_urls(text: str) -> str:
-    """Remove URLs from a text string."""
-    url_pattern = r"http\S+|www\.\S+"
-    return re.sub(url_pattern, "link", text)
+_URL_PATTERN = r"http\S+|www\.\S+"
+# the passes used to run one after another: urls, then channels, then users.
+# A replacement is made of word characters, so a channel swallows a url that
+# directly follows its name and a user swallows a following channel or url.
+_CHANNEL_PATTERN = rf"#(?:{_URL_PATTERN}|\w)+"
+_USER_PATTERN = rf"@(?:{_URL_PATTERN}|{_CHANNEL_PATTERN}|\w)+"
 
+# runs of special characters except basic punctuation, a `#` or `@` is only
+# removed once it failed to start a mention
+_SPECIAL_CHARS_PATTERN = re.compile(r"[^\w\s.,!?]+")
+_CLEANING_PATTERN = re.compile(
+    rf"(?P<url>{_URL_PATTERN})"
+    rf"|(?P<channel>{_CHANNEL_PATTERN})"
+    rf"|(?P<user>{_USER_PATTERN})"
+    r"|[^\w\s.,!?#@]+|[#@]"
+)
+_REPLACEMENTS = {"url": "link", "channel": "group", "user": "user", None: ""}
 
-def _remove_user_mentions(text: str) -> str:
-    """Remove user mentions (e.g., @username)."""
-    user_mention_pattern = r"[@]\w+"
-    return re.sub(user_mention_pattern, "user", text)
 
+def _replace(match: re.Match) -> str:
+    return _REPLACEMENTS[match.lastgroup]
 
-def _remove_channel_mentions(text: str) -> str:
-    """Remove channel mentions (e.g., #channel')."""
-    channel_pattern = r"[#]\w+"
-    return re.sub(channel_pattern, "group", text)
 
+def clean_text(text: str) -> str:
+    """
+    Replace urls with `link`, channel mentions (e.g. #channel) with `group`,
+    user mentions (e.g. @username) with `user` and remove special characters
+    except basic punctuation, in a single pass over the lowercased text.
+    """
+    text = text.lower().strip()
+    if "#" in text or "@" in text or "http" in text or "www." in text:
+        return _CLEANING_PATTERN.sub(_replace, text)
+    # most chat lines have nothing to replace, only characters to drop
+    return _SPECIAL_CHARS_PATTERN.sub("", text)
 
 
-def _remove_special_chars(text: str) -> str:
-    """Remove special characters except basic punctuation."""
-    return re.sub(r"[^\w\s.,!?]", "", text)
+def clean_texts(texts: list[str]) -> list[str]:
+    """Batch version of `clean_text`."""
+    return [clean_text(text) for text in texts]
 
 
-def clean_text(text: str) -> str:
-    """Apply cleaning functions in sequence."""
-    text = _remove_urls(text.lower().strip())
-    text = _remove_channel_mentions(text)
-    text = _remove_user_mentions(text)
-    text = _remove_special_chars(text)
-    return text
+_TOKEN_PATTERN = re.compile(r"\b\w+\b")
+
+
+def tokenize(text: str) -> list[str]:
+    """Lowercased word tokens, shared by keyword matching on both sides of a comparison."""
+    return _TOKEN_PATTERN.findall(text.lower())
+
+
+@lru_cache(maxsize=1024)
+def message_tokens(text: str) -> frozenset[str]:
+    """
+    Distinct tokens of an incoming message, memoised since the same message
+    is compared against every open conversation.
+    """
+    return frozenset(tokenize(text))
+
+
+_MENTION_PATTERN = re.compile(r"@(\w+)")
+
+
+def mentions(text: str) -> frozenset[str]:
+    """Users mentioned as `@user` in the text."""
+    return frozenset(_MENTION_PATTERN.findall(text))
+
+
+TEMPORAL_CUE_PATTERN = re.compile(
+    r"\b(?:"
+    r"today|tonight|tomorrow|tmrw|yesterday|weekend|week|month|morning|afternoon|evening|noon|midnight"
+    r"|mon|tue|tues|wed|thu|thur|thurs|fri|sat|sun"
+    r"|monday|tuesday|wednesday|thursday|friday|saturday|sunday"
+    r"|meet|meeting|meetup|call|sync|standup|schedule|reschedule|calendar|invite|agenda"
+    r"|zoom|hangout|discord|skype|teams|demo|session|appointment|available|availability|free"
+    r"|utc|gmt|[ecmp][sd]t|o'?clock|hours?|mins?|minutes?"
+    r"|\d{1,2}(?::?\d{2})?\s?(?:am|pm)|\d{1,2}:\d{2}"
+    r")\b",
+    re.IGNORECASE,
+)
+
+
+def has_temporal_cue(text: str) -> bool:
+    return TEMPORAL_CUE_PATTERN.search(text) is not None
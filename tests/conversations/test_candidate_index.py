@@ -0,0 +1,105 @@
+from datetime import datetime, timedelta, timezone
+
+from conversations.candidate_index import CandidateIndex, addressed_users
+from conversations.ops import disentangle_message
+from datatypes import CalendarClassification, ClassifiedMessage, Conversation
+
+
+START = datetime(2024, 1, 2, 9, 0, tzinfo=timezone.utc)
+
+
+def make_message(user: str, message: str, seconds: int = 0, seqid: int = 1) -> ClassifiedMessage:
+    return ClassifiedMessage(
+        seqid=seqid,
+        ts=START + timedelta(seconds=seconds),
+        user=user,
+        message=message,
+        classification=CalendarClassification(label="LABEL_1", score=.9),
+    )
+
+
+def make_conversation(*messages: ClassifiedMessage) -> Conversation:
+    conversation = Conversation()
+    for message in messages:
+        conversation.lines.append(message)
+        conversation.users.add(message.user)
+    return conversation
+
+
+def test_addressed_users():
+    assert addressed_users("@alice @bob_2 see you at 5") == {"alice", "bob_2"}
+    assert addressed_users("carol: standup moved to 10") == {"carol"}
+    assert addressed_users("meeting at 10:30 tomorrow") == set()
+
+
+def test_candidates_keeps_participants_addressed_and_recent_conversations():
+    participant = make_conversation(make_message("alice", "meet tomorrow?", seconds=-3600))
+    addressed = make_conversation(make_message("bob", "@alice call at 5", seconds=-3600))
+    recent = make_conversation(make_message("erin", "lunch?", seconds=-30))
+    stale = make_conversation(make_message("frank", "old topic", seconds=-3600))
+    conversations = [participant, addressed, recent, stale]
+
+    index = CandidateIndex(top_k=10)
+    candidates = index.candidates(conversations, make_message("alice", "sounds good"))
+
+    assert candidates == [participant, addressed, recent]
+
+
+def test_candidates_ranks_and_bounds_to_top_k():
+    conversations = [
+        make_conversation(make_message(f"user{idx}", "hi", seconds=-idx)) for idx in range(5)
+    ]
+    conversations.append(make_conversation(make_message("alice", "hi", seconds=-600)))
+
+    index = CandidateIndex(top_k=2)
+    candidates = index.candidates(conversations, make_message("alice", "hello"))
+
+    # participant match first, then the most recently active of the rest
+    assert candidates == [conversations[0], conversations[5]]
+    assert index.stats.compared == 2
+    assert index.stats.pruned == 4
+    assert index.stats.pruned_rate == 4 / 6
+
+
+def test_sync_drops_conversations_that_left_the_list():
+    kept = make_conversation(make_message("alice", "hi"))
+    dropped = make_conversation(make_message("bob", "hi"))
+    index = CandidateIndex()
+    index.sync([kept, dropped])
+
+    index.sync([kept])
+
+    assert index.candidates([kept], make_message("bob", "hello", seconds=3600)) == []
+
+
+def test_disentangle_message_only_classifies_candidates():
+    conversations = [
+        make_conversation(make_message(f"user{idx}", "hi", seconds=-3600)) for idx in range(20)
+    ]
+    conversations.append(make_conversation(make_message("alice", "meet at 5?", seconds=-3600)))
+    calls = []
+
+    def classifier(conversation, message):
+        calls.append(conversation)
+        return message.user in conversation.users
+
+    index = CandidateIndex(top_k=3)
+    message = make_message("alice", "works for me", seqid=2)
+    updated = disentangle_message(conversations, message, classifier, index)
+
+    assert calls == [conversations[-1]]
+    assert updated == conversations
+    assert updated[-1].lines[-1] is message
+
+    # the reply is indexed, so a follow up addressing alice finds the conversation
+    follow_up = make_message("bob", "alice: and tomorrow?", seconds=10, seqid=3)
+    assert index.candidates(updated, follow_up) == [updated[-1]]
+
+
+def test_disentangle_message_indexes_new_conversations():
+    index = CandidateIndex()
+    message = make_message("alice", "meet at 5?")
+
+    updated = disentangle_message([], message, lambda conversation, message: False, index)
+
+    assert index.candidates(updated, make_message("alice", "or 6", seconds=7200)) == updated
@@ -0,0 +1,189 @@
+from datetime import datetime, timedelta
+import random
+from unittest.mock import AsyncMock, Mock, patch
+
+import numpy as np
+import pytest
+
+from conversations.disentanglement.cascade_classifier import CascadeClassifier, match_confidence
+from conversations.disentanglement.rule_based_classifier import (
+    DECISION,
+    RULE_BOOK,
+    SENTENCE_TRANSFORMER,
+    LazyScores,
+    Rule,
+    execute_rules,
+    is_same_conversation,
+    rule_based_classifier,
+)
+from datatypes import CalendarClassification, ClassifiedMessage, Conversation
+from model_registry import registry
+
+
+START = datetime(2024, 1, 2, 9, 0)
+
+# the semantic rule needs the sentence transformer, these tests only use the cheap rules
+RULES = [rule for rule in RULE_BOOK if rule.name != "semantic_similarity"]
+CHEAP_DECISION = [clause for clause in DECISION if all(name != "semantic_similarity" for name, _ in clause)]
+
+
+def _message(seqid: int, user: str, text: str, seconds: float = 0) -> ClassifiedMessage:
+    return ClassifiedMessage(
+        seqid=seqid,
+        ts=START + timedelta(seconds=seconds),
+        user=user,
+        message=text,
+        classification=CalendarClassification(label="LABEL_1", score=.9),
+    )
+
+
+def _conversation() -> Conversation:
+    return Conversation(lines=[_message(1, "alice", "meet at 5?")], users={"alice"})
+
+
+def _similarity(value: float) -> Rule:
+    """A stand in for the semantic rule that always finds the same cosine similarity."""
+    return Rule(name="semantic_similarity", function=lambda conversation, message: value, weight=0.7, cost=100.0)
+
+
+def _cascade(llm_answer: bool = True, similarity: float | None = None) -> CascadeClassifier:
+    return CascadeClassifier(
+        llm_classifier=Mock(return_value=llm_answer),
+        async_llm_classifier=AsyncMock(return_value=llm_answer),
+        rules=RULES if similarity is None else [*RULES, _similarity(similarity)],
+        decision=CHEAP_DECISION if similarity is None else DECISION,
+    )
+
+
+class FakeEncoder:
+    """Encodes a text as the normalised counts of its letters."""
+
+    def encode(self, texts, show_progress_bar=False, normalize_embeddings=True):
+        embeddings = np.zeros((len(texts), 26), dtype=np.float32)
+        for idx, text in enumerate(texts):
+            for letter in text:
+                if "a" <= letter <= "z":
+                    embeddings[idx, ord(letter) - ord("a")] += 1.0
+        return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+
+def test_match_confidence_measures_the_margin_from_each_threshold():
+    scores = {"is_within_time_window": 0.5, "reply_detection": 0.0, "user_in_conversation": 0.0}
+
+    assert match_confidence({**scores, "semantic_similarity": 0.65}) == pytest.approx(0.75)
+    assert match_confidence({**scores, "semantic_similarity": 0.55}) == pytest.approx(0.25)
+    # right on the threshold the decision does not hold, and is as unclear as it gets
+    assert match_confidence({**scores, "semantic_similarity": 0.6}) == 0.5
+    assert match_confidence({**scores, "semantic_similarity": 0.0, "reply_detection": 1.0}) == 1.0
+    assert match_confidence({**scores, "semantic_similarity": 0.0}) == 0.0
+
+
+@pytest.mark.parametrize(
+    "scores",
+    [
+        # same user, unrelated text, 25 seconds later
+        {"is_within_time_window": 5 / 30, "reply_detection": 0.0, "user_in_conversation": 1.0, "semantic_similarity": 0.1},
+        # another user repeating the conversation 29 seconds and 5 minutes later
+        {"is_within_time_window": 1 / 30, "reply_detection": 0.0, "user_in_conversation": 0.0, "semantic_similarity": 0.7},
+        {"is_within_time_window": 0.0, "reply_detection": 0.0, "user_in_conversation": 0.0, "semantic_similarity": 0.7},
+    ],
+)
+def test_match_confidence_agrees_with_the_rule_decision(scores):
+    assert is_same_conversation(scores)
+    assert match_confidence(scores) > 0.8
+
+
+def test_explicit_reply_is_decided_without_the_embedding_model():
+    cascade = CascadeClassifier(llm_classifier=Mock(), async_llm_classifier=AsyncMock())
+
+    with patch.dict(registry._models, {SENTENCE_TRANSFORMER: pytest.fail}):
+        assert cascade(_conversation(), _message(2, "bob", "@alice sure", seconds=40)) is True
+
+    cascade.llm_classifier.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    "user, text, seconds",
+    [("bob", "@alice sure", 40), ("alice", "or maybe 6", 20), ("carol", "game?", 3), ("carol", "meet at 5?", 50)],
+)
+def test_lazy_match_confidence_matches_full_evaluation(user, text, seconds):
+    # a stand in for the semantic rule that scores the share of the words in common
+    def overlap(conversation, message):
+        words = {word for line in conversation.lines for word in line.message.split()}
+        return len(words & set(message.message.split())) / len(message.message.split())
+
+    rules = [*RULES, Rule(name="semantic_similarity", function=overlap, weight=0.7, cost=100.0)]
+    conversation, message = _conversation(), _message(2, user, text, seconds)
+
+    expected = match_confidence(execute_rules(conversation, message, rules))
+    assert match_confidence(LazyScores(conversation, message, rules)) == expected
+
+
+def test_cascade_decides_clear_cases_without_the_llm():
+    cascade = _cascade()
+
+    assert cascade(_conversation(), _message(2, "bob", "@alice sure", seconds=40)) is True
+    assert cascade(_conversation(), _message(3, "carol", "anyone watching the game?", seconds=40)) is False
+
+    cascade.llm_classifier.assert_not_called()
+    assert cascade.stats.rule_matches == 1
+    assert cascade.stats.rule_rejections == 1
+    assert cascade.stats.rule_rate == 1.0
+
+
+def test_cascade_escalates_inside_the_band():
+    # weighted, a similarity of 0.85 sits just below the 0.6 threshold of the semantic rule
+    cascade = _cascade(llm_answer=False, similarity=0.85)
+    conversation = _conversation()
+    message = _message(2, "carol", "meet at 6?", seconds=20)
+
+    assert cascade(conversation, message) is False
+
+    cascade.llm_classifier.assert_called_once_with(conversation, message)
+    assert cascade.stats.escalations == 1
+    assert cascade.stats.llm_rate == 1.0
+
+
+@pytest.mark.asyncio
+async def test_async_cascade_only_awaits_the_llm_inside_the_band():
+    cascade = _cascade(similarity=0.85)
+
+    assert await cascade.classify_async(_conversation(), _message(2, "bob", "@alice sure")) is True
+    assert await cascade.classify_async(_conversation(), _message(3, "carol", "meet at 6?", seconds=20)) is True
+
+    assert cascade.async_llm_classifier.await_count == 1
+    assert cascade.stats.decisions == 2
+
+
+def test_cascade_rejects_an_invalid_band():
+    with pytest.raises(ValueError):
+        CascadeClassifier(llm_classifier=Mock(), async_llm_classifier=AsyncMock(), low=0.9, high=0.1)
+
+
+def test_cascade_agrees_with_the_rule_based_classifier_outside_the_band():
+    rng = random.Random(7)
+    users = ["alice", "bob", "carol", "dave"]
+    words = ["meet", "at", "noon", "lunch", "tomorrow", "deploy", "the", "bug", "game"]
+    cascade = CascadeClassifier(llm_classifier=Mock(), async_llm_classifier=AsyncMock())
+
+    decided = 0
+    with patch.dict(registry._models, {SENTENCE_TRANSFORMER: FakeEncoder()}):
+        for seqid in range(300):
+            lines = [
+                _message(seqid * 10 + idx, rng.choice(users), " ".join(rng.sample(words, 3)), seconds=idx * 5)
+                for idx in range(rng.randint(1, 3))
+            ]
+            conversation = Conversation(lines=lines, users={line.user for line in lines})
+            text = " ".join(rng.sample(words, rng.randint(1, 4)))
+            if rng.random() < 0.2:
+                text = f"@{rng.choice(users)} {text}"
+            message = _message(seqid * 10 + 9, rng.choice(users), text, seconds=rng.uniform(10, 400))
+
+            verdict = cascade.rule_verdict(conversation, message)
+            if verdict is not None:
+                decided += 1
+                assert verdict == rule_based_classifier(conversation, message)
+
+    assert cascade.stats.rule_matches > 0
+    assert cascade.stats.rule_rejections > 0
+    assert decided > cascade.stats.escalations > 0
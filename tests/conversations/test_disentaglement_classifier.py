@@ -1,10 +1,23 @@
 from datetime import UTC, datetime, timedelta, timezone
+from unittest.mock import patch
 from conversations.disentanglement.rule_based_classifier import (
+    RULE_BOOK,
+    SENTENCE_TRANSFORMER,
+    RuleStats,
+    conversation_embedding,
+    evaluate_decision,
+    execute_rules,
     has_matching_keywords,
     is_reply_to_conversation,
+    is_same_conversation,
     is_within_time_window,
+    semantic_similarity_score,
+    unencoded_messages,
 )
+from conversations.ops import add_message_to_conversation
 from datatypes import CalendarClassification, ClassifiedMessage, Conversation, Message
+from model_registry import registry
+import numpy as np
 import pytest
 
 
@@ -56,6 +69,28 @@ def test_has_matching_keywords(conversation_texts, new_message_text, expected_sc
     ), f"Expected score {expected_score}, but got {score}"
 
 
+def test_keyword_index_is_updated_when_lines_are_appended():
+    conversation = Conversation()
+    add_message_to_conversation(conversation, message_from_text("did you hear about the new model?"))
+
+    assert conversation.keyword_state.lines == 1
+    assert has_matching_keywords(conversation, message_from_text("what model?")) == 0.5
+
+    add_message_to_conversation(conversation, message_from_text("what model?"))
+
+    assert conversation.keyword_state.lines == 2
+    assert conversation.keyword_state.counts["model"] == 2
+    assert has_matching_keywords(conversation, message_from_text("what model?")) == 1.0
+
+
+def test_keyword_matching_does_not_retokenise_conversation(monkeypatch):
+    conversation = Conversation()
+    add_message_to_conversation(conversation, message_from_text("hello world"))
+    monkeypatch.setattr("datatypes.tokenize", lambda _text: pytest.fail("conversation was retokenised"))
+
+    assert has_matching_keywords(conversation, message_from_text("hello")) == 1.0
+
+
 # Parameterized tests
 @pytest.mark.parametrize(
     "conversation_users, message, expected_score",
@@ -144,3 +179,144 @@ def test_failing_is_time_within_scenario():
         ),
     )
     assert is_within_time_window(conversation, message) == pytest.approx(0.67, 0.68)                                                                
+
+
+class FakeEncoder:
+    """Encodes a text as a one hot vector of its first letter and records what was encoded."""
+
+    def __init__(self):
+        self.encoded = []
+
+    def encode(self, texts, show_progress_bar=False, normalize_embeddings=True):
+        self.encoded.append(list(texts))
+        embeddings = np.zeros((len(texts), 26), dtype=np.float32)
+        for idx, text in enumerate(texts):
+            embeddings[idx, ord(text[0]) - ord("a")] = 1.0
+        return embeddings
+
+
+def test_conversation_embedding_only_encodes_new_lines():
+    encoder = FakeEncoder()
+    conversation = Conversation(lines=[message_from_text("alpha"), message_from_text("beta")])
+
+    with patch.dict(registry._models, {SENTENCE_TRANSFORMER: encoder}):
+        conversation_embedding(conversation)
+        add_message_to_conversation(conversation, message_from_text("alpha again"))
+        centroid = conversation_embedding(conversation)
+        conversation_embedding(conversation)
+
+    assert encoder.encoded == [["alpha", "beta"], ["alpha again"]]
+    expected = np.zeros(26)
+    expected[0], expected[1] = 2, 1
+    np.testing.assert_allclose(centroid, expected / np.linalg.norm(expected), rtol=1e-6)
+
+
+def test_semantic_similarity_score_is_dot_product_with_centroid():
+    encoder = FakeEncoder()
+    conversation = Conversation(lines=[message_from_text("alpha"), message_from_text("beta")])
+
+    with patch.dict(registry._models, {SENTENCE_TRANSFORMER: encoder}):
+        score = semantic_similarity_score(conversation, message_from_text("apple"))
+
+    assert score == pytest.approx(1 / np.sqrt(2))
+
+
+def test_semantic_similarity_score_of_empty_conversation_is_zero():
+    with patch.dict(registry._models, {SENTENCE_TRANSFORMER: FakeEncoder()}):
+        assert semantic_similarity_score(Conversation(), message_from_text("apple")) == 0.0
+
+
+@pytest.fixture
+def fresh_rule_stats(monkeypatch):
+    stats = RuleStats()
+    monkeypatch.setattr("conversations.disentanglement.rule_based_classifier.rule_stats", stats)
+    return stats
+
+
+def test_reply_decides_without_running_the_embedding_model(fresh_rule_stats):
+    conversation = Conversation(lines=[message_from_text("lunch?")], users={"alice"})
+
+    with patch.dict(registry._models, {SENTENCE_TRANSFORMER: pytest.fail}):
+        assert evaluate_decision(conversation, message_from_text("@alice sure"))
+
+    assert fresh_rule_stats.evaluated["reply_detection"] == 1
+    assert fresh_rule_stats.skipped["semantic_similarity"] == 1
+    assert fresh_rule_stats.skip_rate("semantic_similarity") == 1.0
+
+
+def test_embedding_model_runs_only_when_cheap_rules_do_not_decide(fresh_rule_stats):
+    encoder = FakeEncoder()
+    conversation = Conversation(lines=[message_from_text("alpha")], users={"alice"})
+
+    with patch.dict(registry._models, {SENTENCE_TRANSFORMER: encoder}):
+        assert evaluate_decision(conversation, message_from_text("another"))
+
+    assert fresh_rule_stats.evaluated["semantic_similarity"] == 1
+    assert encoder.encoded == [["alpha"], ["another"]]
+
+
+@pytest.mark.parametrize(
+    "users, text",
+    [
+        ({"alice"}, "sure @alice"),
+        ({"test"}, "beta"),
+        ({"bob"}, "alpha beta"),
+        ({"bob"}, "beta"),
+    ],
+)
+def test_lazy_decision_matches_full_evaluation(users, text, fresh_rule_stats):
+    conversation = Conversation(lines=[message_from_text("alpha")], users=users)
+    message = message_from_text(text)
+
+    with patch.dict(registry._models, {SENTENCE_TRANSFORMER: FakeEncoder()}):
+        expected = bool(is_same_conversation(execute_rules(conversation, message, RULE_BOOK)))
+        assert evaluate_decision(conversation, message) == expected
+
+
+def test_message_is_encoded_once_across_conversations():
+    encoder = FakeEncoder()
+    conversations = [Conversation(lines=[message_from_text(text)]) for text in ["alpha", "beta", "gamma"]]
+    message = message_from_text("another")
+
+    with patch.dict(registry._models, {SENTENCE_TRANSFORMER: encoder}):
+        for conversation in conversations:
+            semantic_similarity_score(conversation, message)
+        add_message_to_conversation(conversations[0], message)
+        conversation_embedding(conversations[0])
+
+    assert encoder.encoded == [["alpha"], ["another"], ["beta"], ["gamma"]]
+    assert conversations[0].embedding_state.lines == 2
+
+
+def test_message_features():
+    message = message_from_text("@alice @bob see you at the Meeting")
+
+    assert message.features is message.features
+    assert message.features.mentions == {"alice", "bob"}
+    assert message.features.tokens == {"alice", "bob", "see", "you", "at", "the", "meeting"}
+    assert message.features.ts == message.ts.timestamp()
+
+    # a copy with another text does not reuse the features of the original
+    copy = message.model_copy(update={"message": "@carol"})
+    assert copy.features.mentions == {"carol"}
+
+
+def test_unencoded_messages_lists_pending_lines_and_message():
+    encoded, pending = message_from_text("alpha"), message_from_text("beta")
+    encoded.features.embedding = np.ones(26, dtype=np.float32)
+    conversation = Conversation(lines=[encoded, pending])
+    message = message_from_text("gamma")
+
+    assert unencoded_messages([conversation], message) == [pending, message]
+
+
+def test_derived_state_does_not_affect_equality():
+    message = message_from_text("alpha")
+    copy = message.model_copy()
+    message.features.tokens
+    conversation = Conversation(lines=[message])
+    conversation.keyword_state.sync(conversation.lines)
+
+    assert message == copy
+    assert conversation == Conversation(lines=[copy])
+    assert message != message.model_copy(update={"message": "beta"})
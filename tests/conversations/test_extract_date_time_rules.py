@@ -0,0 +1,78 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from conversations.extract_date_time_rules import extract_event
+from datatypes import Message
+
+
+# a tuesday
+REFERENCE = datetime(2024, 1, 2, 9, 0, tzinfo=timezone.utc)
+
+
+def _conversation(*texts: str) -> list[Message]:
+    return [
+        Message(seqid=idx, ts=REFERENCE + timedelta(seconds=idx), user=f"user{idx}", message=text)
+        for idx, text in enumerate(texts)
+    ]
+
+
+@pytest.mark.parametrize("texts, expected", [
+    (["tomorrow at 3pm?"], datetime(2024, 1, 3, 15, 0, tzinfo=timezone.utc)),
+    (["next Tuesday 10:30"], datetime(2024, 1, 9, 10, 30, tzinfo=timezone.utc)),
+    (["how about 8pm UTC"], datetime(2024, 1, 2, 20, 0, tzinfo=timezone.utc)),
+    (["can we sync friday", "sure, 2pm works"], datetime(2024, 1, 5, 14, 0, tzinfo=timezone.utc)),
+    (["jan 5th at noon est"], datetime(2024, 1, 5, 17, 0, tzinfo=timezone.utc)),
+    (["call on 2024-01-10 at 1:30"], datetime(2024, 1, 10, 13, 30, tzinfo=timezone.utc)),
+    (["hop on a call in 15 minutes?"], datetime(2024, 1, 2, 9, 15, tzinfo=timezone.utc)),
+])
+def test_confident_expressions_resolve_against_the_line_timestamp(texts, expected):
+    extraction = extract_event(_conversation(*texts))
+
+    assert extraction.event_datetime == expected
+    assert extraction.confidence >= 0.8
+
+
+def test_time_zones_are_converted_to_the_timezone_of_the_messages():
+    extraction = extract_event(_conversation("tomorrow 9am pst"))
+
+    assert extraction.event_datetime == datetime(2024, 1, 3, 17, 0, tzinfo=timezone.utc)
+
+
+@pytest.mark.parametrize("text, sent, expected", [
+    # jan 1 21:00 in new york, tomorrow is jan 2 there
+    ("tomorrow at 8pm EST", datetime(2024, 1, 2, 2, 0), datetime(2024, 1, 3, 1, 0)),
+    # 19:00 in san francisco, 9pm is still to come that day
+    ("9pm pst", datetime(2024, 1, 3, 3, 0), datetime(2024, 1, 3, 5, 0)),
+])
+def test_days_are_resolved_in_the_mentioned_time_zone(text, sent, expected):
+    line = Message(seqid=0, ts=sent.replace(tzinfo=timezone.utc), user="user0", message=text)
+
+    extraction = extract_event([line])
+
+    assert extraction.event_datetime == expected.replace(tzinfo=timezone.utc)
+
+
+def test_a_time_that_already_passed_today_is_tomorrow():
+    extraction = extract_event(_conversation("8:15am works"))
+
+    assert extraction.event_datetime == datetime(2024, 1, 3, 8, 15, tzinfo=timezone.utc)
+
+
+@pytest.mark.parametrize("texts", [
+    ["meet at 3pm", "actually 4pm is better"],
+    ["I am free at 3"],
+    ["let's meet friday"],
+])
+def test_conflicting_or_partial_expressions_have_low_confidence(texts):
+    extraction = extract_event(_conversation(*texts))
+
+    assert extraction.event_datetime is not None
+    assert extraction.confidence < 0.8
+
+
+def test_nothing_found_leaves_the_decision_to_the_llm():
+    extraction = extract_event(_conversation("anyone seen the new release?", "yes, looks great"))
+
+    assert extraction.event_datetime is None
+    assert extraction.confidence == 0.0
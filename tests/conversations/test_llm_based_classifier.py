@@ -0,0 +1,123 @@
+from datetime import datetime
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+from conversations.disentanglement.llm_based_classifier import (
+    ReasonedResponse,
+    Response,
+    async_choose_conversation,
+    async_llm_based_classifier,
+    build_multi_choice_prompt,
+    build_prompt,
+    choose_conversation,
+    llm_based_classifier,
+)
+from datatypes import CalendarClassification, ClassifiedMessage, Conversation
+from prompt_builder import count_tokens
+
+
+def _message(seqid: int, user: str, text: str) -> ClassifiedMessage:
+    return ClassifiedMessage(
+        seqid=seqid,
+        ts=datetime(2024, 1, 2, 9, 0),
+        user=user,
+        message=text,
+        classification=CalendarClassification(label="LABEL_1", score=.9),
+    )
+
+
+def _chat_response(matches: bool) -> SimpleNamespace:
+    content = f'{{"matches": {str(matches).lower()}}}'
+    return SimpleNamespace(message=SimpleNamespace(content=content), prompt_eval_count=100, eval_count=5)
+
+
+@pytest.mark.asyncio
+async def test_async_classifier_sends_the_same_request_as_the_sync_one():
+    conversation = Conversation(lines=[_message(1, "alice", "meet at 5?")])
+    message = _message(2, "bob", "@alice sure")
+    async_client = SimpleNamespace(chat=AsyncMock(return_value=_chat_response(True)))
+
+    with patch("conversations.disentanglement.llm_based_classifier.chat", return_value=_chat_response(True)) as chat, \
+            patch("conversations.disentanglement.llm_based_classifier.get_async_client", return_value=async_client):
+        assert llm_based_classifier(conversation, message) is True
+        assert await async_llm_based_classifier(conversation, message) is True
+
+    assert async_client.chat.call_args == chat.call_args
+
+
+def _choice_response(conversation) -> SimpleNamespace:
+    content = f'{{"conversation": {conversation}}}'
+    return SimpleNamespace(message=SimpleNamespace(content=content))
+
+
+@pytest.mark.parametrize("answer, expected", [(2, 1), ('"new"', None), (7, None)])
+def test_choose_conversation_returns_zero_based_index(answer, expected):
+    conversations = [Conversation(lines=[_message(idx, f"user{idx}", "hi")]) for idx in range(3)]
+
+    with patch("conversations.disentanglement.llm_based_classifier.chat", return_value=_choice_response(answer)) as chat:
+        assert choose_conversation(conversations, _message(5, "bob", "hello")) == expected
+
+    assert chat.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_async_choose_conversation_without_candidates_skips_the_llm():
+    with patch("conversations.disentanglement.llm_based_classifier.get_async_client", side_effect=AssertionError):
+        assert await async_choose_conversation([], _message(1, "bob", "hello")) is None
+
+
+def test_multi_choice_prompt_keeps_recent_lines_of_each_conversation():
+    conversations = [
+        Conversation(lines=[_message(idx, "alice", f"line {idx}") for idx in range(10)]),
+        Conversation(lines=[_message(20, "bob", "other topic")]),
+    ]
+
+    prompt = build_multi_choice_prompt(conversations, _message(30, "carol", "new one"), recent_lines=3)
+
+    assert "line 6" not in prompt
+    assert all(f"line {idx}" in prompt for idx in (7, 8, 9))
+    assert "Conversation 2:" in prompt and "other topic" in prompt
+
+
+@pytest.mark.parametrize("reasoning, expected_model", [("false", Response), ("true", ReasonedResponse)])
+def test_response_schema_is_decision_first_and_reason_is_optional(monkeypatch, reasoning, expected_model):
+    monkeypatch.setenv("LLM_REASONING", reasoning)
+    conversation = Conversation(lines=[_message(1, "alice", "meet at 5?")])
+    reasoned = SimpleNamespace(message=SimpleNamespace(content='{"matches": true, "reason": "r"}'))
+
+    with patch("conversations.disentanglement.llm_based_classifier.chat", return_value=reasoned) as chat:
+        assert llm_based_classifier(conversation, _message(2, "bob", "sure")) is True
+
+    schema = chat.call_args.kwargs["format"]
+    assert schema == expected_model.model_json_schema()
+    assert list(schema["properties"])[0] == "matches"
+    assert "previous_conversation" not in schema["properties"]
+
+
+@pytest.mark.parametrize("reasoning", [False, True])
+def test_prompts_only_ask_for_a_reason_when_the_schema_has_one(monkeypatch, reasoning):
+    monkeypatch.setenv("LLM_REASONING", str(reasoning).lower())
+    conversation = Conversation(lines=[_message(1, "alice", "meet at 5?")])
+    message = _message(2, "bob", "sure")
+
+    for prompt in (build_prompt(conversation.lines, message), build_multi_choice_prompt([conversation], message)):
+        assert ("reason:" in prompt) is reasoning
+        assert ("provide reason for your choice" in prompt) is reasoning
+        assert ("with reasoning below" in prompt) is reasoning
+
+
+def test_build_prompt_drops_old_lines_over_budget_but_keeps_related_users():
+    lines = [_message(1, "alice", "anyone free to pair on the parser?")]
+    lines += [_message(idx, "carol", f"unrelated chatter number {idx}") for idx in range(2, 30)]
+    message = _message(30, "bob", "@alice sure, after lunch")
+
+    full = build_prompt(lines, message, budget=100_000)
+    trimmed = build_prompt(lines, message, budget=count_tokens(build_prompt([lines[0], lines[-1]], message)) + 10)
+
+    assert all(line.message in full for line in lines)
+    assert "anyone free to pair" in trimmed
+    assert lines[-1].message in trimmed
+    assert "unrelated chatter number 2'" not in trimmed
+    assert count_tokens(trimmed) < count_tokens(full)
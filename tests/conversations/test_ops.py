@@ -1,7 +1,18 @@
+import asyncio
 from datetime import datetime, timedelta, timezone
 
+import pytest
+
 from pytz import UTC
-from conversations.ops import add_message_to_conversation, update_completed_conversation, update_suspended_conversation
+from conversations.ops import (
+    add_message_to_conversation,
+    disentangle_message,
+    disentangle_message_async,
+    disentangle_message_choice,
+    disentangle_message_choice_async,
+    update_completed_conversation,
+    update_suspended_conversation,
+)
 from datatypes import Conversation, ClassifiedMessage, CalendarClassification
 
 
@@ -79,3 +90,124 @@ def test_update_completed_conversation():
     assert updated_conversations[0].completed == True, "Conversation 1 should be marked as completed"
     assert updated_conversations[1].completed == False, "Conversation 2 should not be marked as completed"
     assert updated_conversations[1].completed == False, "Conversation 2 should remain unchanged"
+
+
+def _message(seqid: int, user: str) -> ClassifiedMessage:
+    return ClassifiedMessage(
+        seqid=seqid,
+        ts=datetime(2024, 1, 2, 9, 0, tzinfo=timezone.utc),
+        user=user,
+        message="hello",
+        classification=CalendarClassification(label="LABEL_1", score=.9),
+    )
+
+
+def _conversations() -> list[Conversation]:
+    return [
+        add_message_to_conversation(Conversation(), _message(idx, user))
+        for idx, user in enumerate(["alice", "bob", "alice", "carol"])
+    ]
+
+
+def _same_user(conversation: Conversation, message: ClassifiedMessage) -> bool:
+    return message.user in conversation.users
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("user", ["alice", "dave"])
+async def test_disentangle_message_async_matches_sequential_path(user):
+    in_flight, peak = 0, 0
+
+    async def classifier(conversation, message):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        # finish out of order
+        await asyncio.sleep(0.01 * (len(conversation.lines[0].user) % 3))
+        in_flight -= 1
+        return _same_user(conversation, message)
+
+    expected = disentangle_message(_conversations(), _message(10, user), _same_user)
+    updated = await disentangle_message_async(
+        _conversations(), _message(10, user), classifier, max_concurrency=2
+    )
+
+    assert [conv.lines for conv in updated] == [conv.lines for conv in expected]
+    assert peak == 2
+
+
+@pytest.mark.asyncio
+async def test_disentangle_message_async_deadline_leaves_conversations_unchanged():
+    async def slow_classifier(conversation, message):
+        await asyncio.sleep(1)
+        return True
+
+    conversations = _conversations()
+    with pytest.raises(TimeoutError):
+        await disentangle_message_async(
+            conversations, _message(10, "alice"), slow_classifier, deadline_seconds=0.05
+        )
+
+    assert all(len(conv.lines) == 1 for conv in conversations)
+
+
+@pytest.mark.asyncio
+async def test_disentangle_message_async_propagates_connection_errors():
+    async def unreachable(conversation, message):
+        raise ConnectionError("ollama is down")
+
+    with pytest.raises(ConnectionError):
+        await disentangle_message_async(_conversations(), _message(10, "alice"), unreachable)
+
+
+@pytest.mark.asyncio
+async def test_disentangle_message_async_waits_for_cancelled_comparisons_on_errors():
+    finished = []
+
+    async def classifier(conversation, message):
+        if conversation.lines[0].user == "alice":
+            raise ConnectionError("ollama is down")
+        try:
+            await asyncio.sleep(1)
+        finally:
+            finished.append(conversation)
+
+    conversations = _conversations()
+    with pytest.raises(ConnectionError):
+        await disentangle_message_async(conversations, _message(10, "alice"), classifier)
+
+    # every other comparison was cancelled and done before the error came out
+    assert finished == [conversation for conversation in conversations if conversation.lines[0].user != "alice"]
+
+
+def test_disentangle_message_choice_adds_to_the_chosen_conversation_only():
+    conversations = _conversations()
+    seen = []
+
+    def chooser(candidates, message):
+        seen.append(candidates)
+        return 2
+
+    message = _message(10, "alice")
+    updated = disentangle_message_choice(conversations, message, chooser)
+
+    assert seen == [conversations]
+    assert [len(conv.lines) for conv in updated] == [1, 1, 2, 1]
+    assert updated[2].lines[-1] is message
+
+
+@pytest.mark.asyncio
+async def test_disentangle_message_choice_async_starts_new_conversation():
+    async def chooser(candidates, message):
+        return None
+
+    updated = await disentangle_message_choice_async(_conversations(), _message(10, "dave"), chooser)
+
+    assert len(updated) == 5
+    assert updated[-1].users == {"dave"}
+
+
+def test_disentangle_message_choice_skips_the_llm_without_candidates():
+    updated = disentangle_message_choice([], _message(10, "dave"), lambda candidates, message: pytest.fail())
+
+    assert len(updated) == 1
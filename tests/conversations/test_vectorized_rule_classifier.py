@@ -0,0 +1,169 @@
+from datetime import datetime, timedelta, timezone
+import random
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+
+from conversations.disentanglement.rule_based_classifier import (
+    SENTENCE_TRANSFORMER,
+    Rule,
+    execute_rules,
+    has_matching_keywords,
+    rule_based_classifier,
+)
+from conversations.disentanglement.vectorized_rule_classifier import VectorizedRuleClassifier
+from conversations.ops import add_message_to_conversation, disentangle_message_batched
+from datatypes import CalendarClassification, ClassifiedMessage, Conversation
+from model_registry import registry
+
+
+START = datetime(2024, 1, 2, 9, 0, tzinfo=timezone.utc)
+USERS = ["alice", "bob", "carol", "dave", "erin"]
+WORDS = ["meet", "tomorrow", "at", "noon", "call", "lunch", "bug", "deploy", "the", "model"]
+
+
+class FakeEncoder:
+    """Encodes a text as the normalised counts of its letters."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def encode(self, texts, show_progress_bar=False, normalize_embeddings=True):
+        self.calls += 1
+        embeddings = np.zeros((len(texts), 26), dtype=np.float32)
+        for idx, text in enumerate(texts):
+            for letter in text:
+                if "a" <= letter <= "z":
+                    embeddings[idx, ord(letter) - ord("a")] += 1.0
+        return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+
+def random_message(rng: random.Random, seqid: int) -> ClassifiedMessage:
+    words = rng.sample(WORDS, rng.randint(1, 4))
+    if rng.random() < 0.3:
+        words.insert(0, f"@{rng.choice(USERS)}")
+    return ClassifiedMessage(
+        seqid=seqid,
+        ts=START + timedelta(seconds=seqid * rng.uniform(0, 10)),
+        user=rng.choice(USERS),
+        message=" ".join(words),
+        classification=CalendarClassification(label="LABEL_1", score=.9),
+    )
+
+
+def random_conversations(rng: random.Random, count: int) -> list[Conversation]:
+    conversations = []
+    for _ in range(count):
+        conversation = Conversation()
+        for _ in range(rng.randint(1, 4)):
+            add_message_to_conversation(conversation, random_message(rng, rng.randint(0, 40)))
+        conversations.append(conversation)
+    return conversations
+
+
+@pytest.fixture
+def encoder():
+    fake = FakeEncoder()
+    with patch.dict(registry._models, {SENTENCE_TRANSFORMER: fake}):
+        yield fake
+
+
+def test_decisions_match_rule_based_classifier(encoder):
+    rng = random.Random(7)
+    classifier = VectorizedRuleClassifier()
+    conversations = random_conversations(rng, 30)
+
+    for seqid in range(40, 80):
+        message = random_message(rng, seqid)
+        expected = [rule_based_classifier(conversation, message) for conversation in conversations]
+        assert classifier(conversations, message) == expected
+
+        # the arrays follow conversations being appended to, opened and closed
+        add_message_to_conversation(rng.choice(conversations), message)
+        if rng.random() < 0.3:
+            conversations.pop(rng.randrange(len(conversations)))
+        if rng.random() < 0.3:
+            conversations.extend(random_conversations(rng, 1))
+
+
+def test_score_matrix_matches_execute_rules(encoder):
+    rng = random.Random(3)
+    rules = [
+        *VectorizedRuleClassifier().rules,
+        Rule(name="keywords", function=has_matching_keywords, weight=0.5),
+        Rule(name="custom", function=lambda conversation, message: len(conversation.lines), weight=2.0),
+    ]
+    classifier = VectorizedRuleClassifier(rules)
+    conversations = random_conversations(rng, 10)
+    message = random_message(rng, 50)
+
+    matrix = classifier.score_matrix(conversations, message)
+
+    expected = [list(execute_rules(conversation, message, rules).values()) for conversation in conversations]
+    assert matrix.shape == (10, len(rules))
+    np.testing.assert_allclose(matrix, expected, rtol=1e-6)
+
+
+def test_pending_lines_are_encoded_in_one_batch(encoder):
+    rng = random.Random(5)
+    classifier = VectorizedRuleClassifier()
+    conversations = random_conversations(rng, 20)
+
+    classifier(conversations, random_message(rng, 50))
+
+    # one call for all the conversation lines, one for the message
+    assert encoder.calls == 2
+
+
+def test_disentangle_message_batched_adds_to_matches_or_opens_conversation(encoder):
+    conversation = Conversation()
+    first = random_message(random.Random(1), 1).model_copy(update={"user": "alice"})
+    add_message_to_conversation(conversation, first)
+    classifier = VectorizedRuleClassifier()
+
+    reply = first.model_copy(update={"seqid": 2, "user": "bob", "message": "@alice sure"})
+    updated = disentangle_message_batched([conversation], reply, classifier)
+    assert updated == [conversation]
+    assert conversation.lines[-1] is reply
+
+    unrelated = first.model_copy(
+        update={"seqid": 3, "user": "zed", "message": "zzz", "ts": first.ts + timedelta(hours=1)}
+    )
+    updated = disentangle_message_batched(updated, unrelated, classifier)
+    assert len(updated) == 2
+    assert updated[-1].lines == [unrelated]
+
+
+def test_keywords_are_only_tracked_for_a_keyword_rule(encoder):
+    rng = random.Random(9)
+    conversations = random_conversations(rng, 5)
+    message = random_message(rng, 50)
+
+    default = VectorizedRuleClassifier()
+    default(conversations, message)
+    assert default.arrays.keyword_ids == {}
+
+    with_keywords = VectorizedRuleClassifier(
+        [*default.rules, Rule(name="keywords", function=has_matching_keywords, weight=0.5)]
+    )
+    with_keywords(conversations, message)
+    assert with_keywords.arrays.keyword_ids
+
+
+def test_appended_conversations_keep_the_existing_rows(encoder):
+    rng = random.Random(11)
+    classifier = VectorizedRuleClassifier()
+    conversations = random_conversations(rng, 4)
+    classifier.arrays.sync(conversations)
+    last_ts = classifier.arrays.last_ts.copy()
+
+    for _ in range(3):
+        conversations.extend(random_conversations(rng, 1))
+        classifier.arrays.sync(conversations)
+
+    assert len(classifier.arrays.last_ts) == 7
+    np.testing.assert_array_equal(classifier.arrays.last_ts[:4], last_ts)
+    assert classifier.arrays.last_ts[4:].all()
+    # rows are appended into a buffer that doubles, not copied per conversation
+    assert classifier.arrays.last_ts.base is not None
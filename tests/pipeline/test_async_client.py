@@ -1,4 +1,5 @@
 import asyncio
+from datetime import datetime, timezone
 from unittest.mock import MagicMock, patch
 from uuid import uuid4
 
@@ -18,7 +19,9 @@ from datatypes import (
 from pipeline.async_client import (
     classified_message_to_conversation,
     classify_message,
+    classify_message_batches,
     conversation_manager,
+    extract_conversation_datetimes,
     listen,
     start_ingestion,
     store_probable_calendar_conversations,
@@ -153,6 +156,76 @@ async def test_classify_task_runs_when_new_message_arrives_in_valid_queue():
         task.cancel()
 
 
+def classify_as_negative(messages, batch_size):
+    return [
+        ClassifiedMessage(
+            **msg.model_dump(),
+            classification=CalendarClassification(label="LABEL_0", score=0.5),
+        )
+        for msg in messages
+    ]
+
+
+@pytest.mark.asyncio
+async def test_classify_message_batches_classifies_queued_messages_in_one_batch():
+    valid_queue = asyncio.Queue()
+    classified_queue = asyncio.Queue()
+    messages = [
+        Message(seqid=seqid, ts=1741874411, user="user1", message=f"hi {seqid}")
+        for seqid in range(5)
+    ]
+    for message in messages:
+        await valid_queue.put(message)
+
+    with patch("pipeline.async_client.classify_messages", side_effect=classify_as_negative) as mock_classify:
+        task = asyncio.create_task(
+            classify_message_batches(valid_queue, classified_queue, max_batch_size=8, max_wait_seconds=0.05)
+        )
+        await asyncio.sleep(.1)
+
+        assert mock_classify.call_count == 1
+        assert classified_queue.qsize() == 5
+        assert [classified_queue.get_nowait().seqid for _ in range(5)] == [0, 1, 2, 3, 4]
+
+        task.cancel()
+
+
+@pytest.mark.asyncio
+async def test_classify_message_batches_splits_batches_at_max_batch_size():
+    valid_queue = asyncio.Queue()
+    classified_queue = asyncio.Queue()
+    for seqid in range(5):
+        await valid_queue.put(Message(seqid=seqid, ts=1741874411, user="user1", message="hi"))
+
+    with patch("pipeline.async_client.classify_messages", side_effect=classify_as_negative) as mock_classify:
+        task = asyncio.create_task(
+            classify_message_batches(valid_queue, classified_queue, max_batch_size=2, max_wait_seconds=0.05)
+        )
+        await asyncio.sleep(.1)
+
+        assert [len(call.args[0]) for call in mock_classify.call_args_list] == [2, 2, 1]
+        assert classified_queue.qsize() == 5
+
+        task.cancel()
+
+
+@pytest.mark.asyncio
+async def test_classify_message_batches_flushes_partial_batch_on_kill_signal():
+    valid_queue = asyncio.Queue()
+    classified_queue = asyncio.Queue()
+    await valid_queue.put(Message(seqid=1, ts=1741874411, user="user1", message="hi"))
+    await valid_queue.put(None)
+
+    with patch("pipeline.async_client.classify_messages", side_effect=classify_as_negative):
+        await asyncio.wait_for(
+            classify_message_batches(valid_queue, classified_queue, max_batch_size=8, max_wait_seconds=10),
+            timeout=1,
+        )
+        await asyncio.sleep(0)
+
+    assert classified_queue.qsize() == 1
+
+
 @pytest.mark.asyncio
 async def test_match_conversation_updates_active_conversations():
     assert True
@@ -416,3 +489,97 @@ async def test_conversation_manager_add_event_updates_conversations_and_conv_seq
     assert len(conversations) == 1
     assert len(conversations[conv_id].lines) == 2
     task.cancel()
+
+
+def _suspended_conversation(seqid: int, text: str) -> Conversation:
+    message = ClassifiedMessage(
+        seqid=seqid,
+        ts=datetime(2024, 1, 2, 9, 0, tzinfo=timezone.utc),
+        user="user1",
+        message=text,
+        classification=CalendarClassification(label="LABEL_1", score=0.9),
+    )
+    return Conversation(lines=[message], users={message.user}, last_updated=message.ts, suspended=True)
+
+
+@pytest.mark.asyncio
+async def test_extract_conversation_datetimes_runs_llm_calls_concurrently_and_archives():
+    extraction_queue, archival_queue = asyncio.Queue(), asyncio.Queue()
+    event_datetime = datetime(2024, 1, 5, 10, 0, tzinfo=timezone.utc)
+    in_flight, peak = 0, 0
+
+    async def llm_extractor(_conversation):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return event_datetime
+
+    conversations = [_suspended_conversation(idx, "can we find a slot for a call?") for idx in range(4)]
+    for conversation in conversations:
+        await extraction_queue.put(conversation)
+    await extraction_queue.put(None)
+
+    with patch("pipeline.async_client.async_event_datetime_extractor", llm_extractor):
+        await extract_conversation_datetimes(extraction_queue, archival_queue, max_workers=2)
+
+    assert peak == 2
+    assert archival_queue.qsize() == 4
+    assert all(conversation.event_datetime == event_datetime for conversation in conversations)
+
+
+@pytest.mark.asyncio
+async def test_extract_conversation_datetimes_falls_back_on_timeouts_and_retries():
+    extraction_queue, archival_queue = asyncio.Queue(), asyncio.Queue()
+    calls = 0
+
+    async def slow_extractor(_conversation):
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(1)
+
+    conversation = _suspended_conversation(1, "free at 3 maybe?")
+    for item in (conversation, conversation, None):
+        await extraction_queue.put(item)
+
+    with patch("pipeline.async_client.async_event_datetime_extractor", slow_extractor):
+        await extract_conversation_datetimes(extraction_queue, archival_queue, max_workers=1, timeout_seconds=0.01)
+
+    # a failed extraction is not remembered, the llm is asked again next time
+    assert calls == 2
+    assert archival_queue.qsize() == 2
+    # the low confidence guess of the rules is kept when the llm does not answer in time
+    assert conversation.event_datetime == datetime(2024, 1, 2, 15, 0, tzinfo=timezone.utc)
+
+
+@pytest.mark.asyncio
+async def test_extract_conversation_datetimes_skips_unchanged_and_in_flight_conversations():
+    extraction_queue, archival_queue = asyncio.Queue(), asyncio.Queue()
+    event_datetime = datetime(2024, 1, 5, 10, 0, tzinfo=timezone.utc)
+    calls = 0
+
+    async def llm_extractor(_conversation):
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return event_datetime
+
+    conversation = _suspended_conversation(1, "free at 3 maybe?")
+    # the second worker gets it while the first one is extracting it
+    for item in (conversation, conversation, None):
+        await extraction_queue.put(item)
+
+    with patch("pipeline.async_client.async_event_datetime_extractor", llm_extractor):
+        await extract_conversation_datetimes(extraction_queue, archival_queue, max_workers=2)
+        assert calls == 1
+        assert conversation.event_datetime == event_datetime
+
+        # unchanged since the successful extraction
+        extraction_queue = asyncio.Queue()
+        for item in (conversation, None):
+            await extraction_queue.put(item)
+        await extract_conversation_datetimes(extraction_queue, archival_queue, max_workers=1)
+
+    assert calls == 1
+    assert archival_queue.qsize() == 3
@@ -0,0 +1,97 @@
+from datetime import datetime, timezone
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from calendar_event_classifier import (
+    CALENDAR_CLASSIFIER,
+    CALENDAR_PREFILTER,
+    ClassificationCache,
+    classification_cache,
+    classify_messages,
+    is_calendar_event,
+)
+from datatypes import CalendarClassification, Message
+from model_registry import registry
+
+
+def classification(label="LABEL_1", score=0.9) -> CalendarClassification:
+    return CalendarClassification(label=label, score=score)
+
+
+def test_cache_returns_stored_classification_and_counts_hits():
+    cache = ClassificationCache(max_size=2)
+    cache.put("meet at user", classification())
+
+    assert cache.get("meet at user") == classification()
+    assert cache.get("unknown") is None
+    assert (cache.stats.hits, cache.stats.misses) == (1, 1)
+    assert cache.stats.hit_rate == 0.5
+
+
+def test_cache_evicts_least_recently_used_entry():
+    cache = ClassificationCache(max_size=2)
+    cache.put("a", classification())
+    cache.put("b", classification())
+    cache.get("a")
+
+    cache.put("c", classification())
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+    assert cache.stats.evictions == 1
+
+
+def test_cache_entries_expire_after_ttl(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("calendar_event_classifier.time.monotonic", lambda: now[0])
+    cache = ClassificationCache(max_size=2, ttl_seconds=10)
+    cache.put("a", classification())
+
+    now[0] = 105.0
+    assert cache.get("a") is not None
+
+    now[0] = 111.0
+    assert cache.get("a") is None
+    assert len(cache) == 0
+    assert cache.stats.evictions == 1
+
+
+def test_disabled_cache_stores_nothing():
+    cache = ClassificationCache(max_size=0)
+    cache.put("a", classification())
+
+    assert cache.get("a") is None
+
+
+def message(seqid: int, text: str) -> Message:
+    return Message(seqid=seqid, ts=datetime.now(timezone.utc), user="user", message=text)
+
+
+@pytest.fixture
+def classifier():
+    classification_cache.clear()
+    classifier = MagicMock(
+        side_effect=lambda texts, batch_size: [{"label": "LABEL_1", "score": 0.9} for _ in texts]
+    )
+    with patch.dict(registry._models, {CALENDAR_CLASSIFIER: classifier, CALENDAR_PREFILTER: None}):
+        yield classifier
+    classification_cache.clear()
+
+
+def test_repeated_cleaned_text_skips_inference(classifier):
+    first = is_calendar_event(message(1, "meet @alice at https://meet.example.com"))
+    second = is_calendar_event(message(2, "Meet @bob at https://meet.example.org"))
+
+    assert classifier.call_count == 1
+    assert first.classification == second.classification
+    assert second.seqid == 2
+    assert second.message == "Meet @bob at https://meet.example.org"
+
+
+def test_classify_messages_classifies_duplicates_in_a_batch_once(classifier):
+    results = classify_messages([message(1, "sync now?"), message(2, "lol"), message(3, "sync now?")])
+
+    assert classifier.call_args.args[0] == ["lol", "sync now?"]
+    assert [result.seqid for result in results] == [1, 2, 3]
@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+
+from circuit_breaker import BreakerState, CircuitBreaker
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _breaker(clock: FakeClock, **kwargs) -> CircuitBreaker:
+    return CircuitBreaker("test", window=4, min_calls=4, reset_seconds=10, clock=clock, **kwargs)
+
+
+def test_breaker_opens_above_the_error_rate_and_rejects_calls():
+    breaker = _breaker(FakeClock(), max_error_rate=0.5)
+    for _ in range(2):
+        breaker.record_success(0.1)
+    for _ in range(2):
+        breaker.record_failure(0.1)
+    assert breaker.state == BreakerState.CLOSED
+
+    breaker.record_failure(0.1)
+
+    assert breaker.state == BreakerState.OPEN
+    assert breaker.allow() is False
+    assert breaker.stats.trips == 1
+    assert breaker.stats.rejected == 1
+
+
+def test_slow_calls_count_against_the_deadline_and_the_p95_budget():
+    slow = _breaker(FakeClock(), deadline_seconds=1.0, max_error_rate=0.5)
+    for _ in range(4):
+        slow.record_success(2.0)
+    assert slow.state == BreakerState.OPEN
+    assert slow.stats.slow_calls == 4
+
+    p95 = _breaker(FakeClock(), p95_budget_seconds=1.0)
+    for latency in (0.1, 0.1, 0.1, 5.0):
+        p95.record_success(latency)
+    assert p95.p95_seconds > 1.0
+    assert p95.state == BreakerState.OPEN
+
+
+@pytest.mark.parametrize("probe_fails, expected", [(False, BreakerState.CLOSED), (True, BreakerState.OPEN)])
+def test_breaker_half_opens_for_a_single_probe(probe_fails, expected):
+    clock = FakeClock()
+    breaker = _breaker(clock)
+    for _ in range(4):
+        breaker.record_failure()
+    clock.now = 10.0
+
+    assert breaker.state == BreakerState.HALF_OPEN
+    assert breaker.allow() is True
+    assert breaker.allow() is False
+
+    if probe_fails:
+        breaker.record_failure(0.1)
+    else:
+        breaker.record_success(0.1)
+
+    assert breaker.state == expected
+    assert breaker.allow() is (expected == BreakerState.CLOSED)
+
+
+def test_call_uses_the_fallback_on_errors_and_while_open():
+    breaker = _breaker(FakeClock(), max_error_rate=0.0)
+
+    def failing(value):
+        raise ConnectionError("ollama is down")
+
+    assert breaker.call(lambda value: value * 2, 3, fallback=lambda value: -1) == 6
+    assert breaker.call(failing, 3, fallback=lambda value: -1) == -1
+    assert breaker.stats.failures == 1
+    assert breaker.error_rate == 0.5
+
+
+@pytest.mark.asyncio
+async def test_acall_cancels_a_call_past_the_deadline():
+    breaker = _breaker(FakeClock(), deadline_seconds=0.01)
+    cancelled = asyncio.Event()
+
+    async def hanging(value):
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+        return value
+
+    assert await asyncio.wait_for(breaker.acall(hanging, 3, fallback=lambda value: -1), 1) == -1
+    assert cancelled.is_set()
+    assert breaker.stats.failures == 1
@@ -1,6 +1,21 @@
+import asyncio
 from datetime import datetime, timedelta, timezone
-from client import AppState, extract_calendar_datetime_from_conversations, mark_completed_conversations, mark_suspended_conversations
+from types import SimpleNamespace
+from ollama import ResponseError
+from pydantic import BaseModel
+import pytest
+from circuit_breaker import BreakerState
+from client import (
+    AppState,
+    aextract_calendar_datetime_from_conversations,
+    aprocess_classified_message,
+    extract_calendar_datetime_from_conversations,
+    mark_completed_conversations,
+    mark_suspended_conversations,
+    process_classified_message,
+)
 from datatypes import CalendarClassification, ClassifiedMessage, Conversation, Message
+from llm_gateway import LLMGateway, Priority
 from typing import Literal
 
 
@@ -83,3 +98,248 @@ def test_extract_calendar_datetime_from_conversations_extracts_only_for_suspende
     assert len(updated_state.calender_conversations) == 2
     assert updated_state.calender_conversations[0].event_datetime is not None
     assert updated_state.calender_conversations[1].event_datetime is None
+
+
+def test_open_disentangle_breaker_skips_the_llm(monkeypatch):
+    state = AppState()
+    for _ in range(state.disentangle_breaker.min_calls):
+        state.disentangle_breaker.record_failure()
+    message = create_classified_message("LABEL_1", datetime.now(timezone.utc))
+
+    def llm_classifier(_conversation, _message):
+        raise AssertionError("the llm should not be called while the breaker is open")
+
+    monkeypatch.setattr("client.llm_based_classifier", llm_classifier)
+    monkeypatch.setattr("client._disentangle_with_rules", lambda state, _message: state)
+
+    assert process_classified_message(state, message).llm_reachable is False
+    assert state.disentangle_breaker.stats.rejected == 1
+
+
+def _fall_back_to_rules(monkeypatch) -> list[ClassifiedMessage]:
+    disentangled = []
+
+    def rules(state, message):
+        disentangled.append(message)
+        return state
+
+    monkeypatch.setattr("client._disentangle_with_rules", rules)
+    return disentangled
+
+
+def test_llm_response_errors_fall_back_to_the_rules(monkeypatch):
+    state = AppState()
+    message = create_classified_message("LABEL_1", datetime.now(timezone.utc))
+    disentangled = _fall_back_to_rules(monkeypatch)
+
+    def failing_classifier(_conversation, _message):
+        raise ResponseError("model is loading", status_code=503)
+
+    def disentangle(conversations, message, classifier, *_args):
+        classifier(None, message)
+
+    monkeypatch.setattr("client.llm_based_classifier", failing_classifier)
+    monkeypatch.setattr("client.disentangle_message", disentangle)
+
+    assert process_classified_message(state, message).llm_reachable is False
+    assert disentangled == [message]
+    assert state.disentangle_breaker.stats.failures == 1
+
+
+@pytest.mark.asyncio
+async def test_malformed_llm_output_falls_back_to_the_rules(monkeypatch):
+    state = AppState()
+    message = create_classified_message("LABEL_1", datetime.now(timezone.utc))
+    disentangled = _fall_back_to_rules(monkeypatch)
+
+    class Output(BaseModel):
+        matches: bool
+
+    async def malformed_classifier(_conversation, _message):
+        return Output.model_validate_json('{"matches": ')
+
+    async def disentangle(conversations, message, classifier, *_args, **_kwargs):
+        await classifier(None, message)
+
+    monkeypatch.setattr("client.async_llm_based_classifier", malformed_classifier)
+    monkeypatch.setattr("client.disentangle_message_async", disentangle)
+
+    assert (await aprocess_classified_message(state, message)).llm_reachable is False
+    assert disentangled == [message]
+    assert state.disentangle_breaker.stats.failures == 1
+
+
+def test_half_open_probe_is_handed_back_when_no_llm_call_ran():
+    state = AppState()
+    breaker = state.disentangle_breaker
+    for _ in range(breaker.min_calls):
+        breaker.record_failure()
+    breaker._opened_at -= breaker.reset_seconds
+    # no open conversation to compare against, the llm is never asked
+    message = create_classified_message("LABEL_1", datetime.now(timezone.utc))
+
+    state = process_classified_message(state, message)
+
+    assert breaker.state == BreakerState.HALF_OPEN
+    assert breaker.stats.calls == breaker.min_calls
+    assert breaker.allow() is True
+
+
+@pytest.mark.asyncio
+async def test_cascade_decisions_without_the_llm_leave_the_breaker_alone(monkeypatch):
+    state = AppState()
+    start = datetime.now(timezone.utc)
+    state.calender_conversations = [create_conversation([create_classified_message("LABEL_1", start)])]
+    reply = create_classified_message("LABEL_1", start + timedelta(seconds=5)).model_copy(
+        update={"seqid": 2, "user": "user2", "message": "@user1 sure"}
+    )
+
+    async def llm_classifier(_conversation, _message):
+        raise AssertionError("the rules decide an explicit reply")
+
+    state.cascade_classifier.async_llm_classifier = llm_classifier
+    state = await aprocess_classified_message(state, reply, mode="cascade")
+
+    assert len(state.calender_conversations[0].lines) == 2
+    assert state.disentangle_breaker.stats.calls == 0
+
+
+@pytest.mark.asyncio
+async def test_rules_fallback_encodes_through_the_embedding_service(monkeypatch):
+    state = AppState()
+    message = create_classified_message("LABEL_1", datetime.now(timezone.utc))
+    disentangled = _fall_back_to_rules(monkeypatch)
+    encoded = []
+
+    class FakeEmbeddingService:
+        async def embed_messages(self, messages):
+            # the rules run after the texts are encoded
+            assert disentangled == []
+            encoded.extend(messages)
+
+    async def unreachable(*_args, **_kwargs):
+        raise ConnectionError("ollama is down")
+
+    monkeypatch.setattr("client.disentangle_message_async", unreachable)
+
+    await aprocess_classified_message(state, message, embedding_service=FakeEmbeddingService())
+
+    assert encoded == [message]
+    assert disentangled == [message]
+
+
+def test_extraction_keeps_the_previous_datetime_when_the_llm_fails(monkeypatch):
+    previous = datetime(2024, 1, 2, 9, 0, tzinfo=timezone.utc)
+    conversation = create_conversation([create_classified_message("LABEL_1", previous)], suspended=True)
+    conversation.event_datetime = previous
+
+    def failing_extractor(_conversation):
+        raise ConnectionError("ollama is down")
+
+    monkeypatch.setattr("client.event_datetime_extractor", failing_extractor)
+    state = extract_calendar_datetime_from_conversations(AppState(calender_conversations=[conversation]))
+
+    assert state.calender_conversations[0].event_datetime == previous
+    assert state.extraction_breaker.stats.failures == 1
+
+
+@pytest.mark.asyncio
+async def test_async_extraction_gives_up_on_a_hanging_llm(monkeypatch):
+    previous = datetime(2024, 1, 2, 9, 0, tzinfo=timezone.utc)
+    conversation = create_conversation([create_classified_message("LABEL_1", previous)], suspended=True)
+    conversation.event_datetime = previous
+    state = AppState(calender_conversations=[conversation])
+    state.extraction_breaker.deadline_seconds = 0.01
+
+    async def hanging_extractor(_conversation):
+        await asyncio.sleep(60)
+
+    monkeypatch.setattr("client.async_event_datetime_extractor", hanging_extractor)
+    state = await asyncio.wait_for(aextract_calendar_datetime_from_conversations(state, min_confidence=1.0), 1)
+
+    assert state.calender_conversations[0].event_datetime == previous
+    assert state.extraction_breaker.stats.failures == 1
+    assert state.extraction_stats.extractions == 0
+
+
+def test_extraction_only_reruns_when_lines_were_added(monkeypatch):
+    start = datetime.now(timezone.utc)
+    conversation = create_conversation([create_classified_message("LABEL_1", start)], suspended=True)
+    state = AppState(calender_conversations=[conversation])
+    calls = []
+    monkeypatch.setattr("client.event_datetime_extractor", lambda conversation: calls.append(conversation) or start)
+
+    for _ in range(3):
+        state = extract_calendar_datetime_from_conversations(state)
+    conversation.lines.append(create_classified_message("LABEL_1", start + timedelta(seconds=5)))
+    state = extract_calendar_datetime_from_conversations(state)
+
+    assert len(calls) == 2
+    assert state.extraction_stats.extractions == 2
+    assert state.extraction_stats.unchanged == 2
+    assert state.extraction_stats.hit_rate == 0.5
+
+
+def test_extraction_gated_on_temporal_cues_skips_lines_without_them(monkeypatch):
+    start = datetime.now(timezone.utc)
+    first = create_classified_message("LABEL_1", start).model_copy(update={"message": "can we find a time for a call this week?"})
+    conversation = create_conversation([first], suspended=True)
+    state = AppState(calender_conversations=[conversation])
+    calls = []
+    monkeypatch.setattr("client.event_datetime_extractor", lambda conversation: calls.append(conversation) or start)
+
+    state = extract_calendar_datetime_from_conversations(state, temporal_cues_only=True)
+    conversation.lines.append(create_classified_message("LABEL_1", start).model_copy(update={"message": "ok 👍"}))
+    state = extract_calendar_datetime_from_conversations(state, temporal_cues_only=True)
+
+    assert len(calls) == 1
+    assert state.calender_conversations[0].event_datetime == start
+    assert state.extraction_stats.no_temporal_cue == 1
+
+
+def test_confident_rule_extraction_skips_the_llm(monkeypatch):
+    start = datetime(2024, 1, 2, 9, 0, tzinfo=timezone.utc)
+    first = create_classified_message("LABEL_1", start).model_copy(update={"message": "sync tomorrow at 3pm?"})
+    state = AppState(calender_conversations=[create_conversation([first], suspended=True)])
+
+    def llm_extractor(_conversation):
+        raise AssertionError("the llm should not be asked about a confident rule extraction")
+
+    monkeypatch.setattr("client.event_datetime_extractor", llm_extractor)
+    state = extract_calendar_datetime_from_conversations(state, min_confidence=0.8)
+
+    assert state.calender_conversations[0].event_datetime == datetime(2024, 1, 3, 15, 0, tzinfo=timezone.utc)
+    assert state.extraction_stats.rule_extractions == 1
+
+
+@pytest.mark.asyncio
+async def test_async_extraction_waits_for_the_disentanglement_holding_the_gateway(monkeypatch):
+    gateway = LLMGateway(max_concurrency=1, model_limits={"qwq:32b": 1})
+    monkeypatch.setattr("llm_utils.get_llm_gateway", lambda: gateway)
+    monkeypatch.setattr("llm_utils.get_llm_cache", lambda: None)
+
+    async def chat(**_request):
+        content = '{"datetime_exists": true, "event_datetime": "2024-01-05T10:00:00"}'
+        return SimpleNamespace(message=SimpleNamespace(content=content), prompt_eval_count=1, eval_count=1)
+
+    monkeypatch.setattr(
+        "conversations.extract_date_time_llm_model.get_async_client", lambda: SimpleNamespace(chat=chat)
+    )
+    released = asyncio.Event()
+
+    async def disentangle():
+        async with gateway.aslot(Priority.INTERACTIVE, "qwq:32b"):
+            await asyncio.sleep(0.01)
+        released.set()
+
+    conversation = create_conversation([create_classified_message("LABEL_1", datetime.now(timezone.utc))], suspended=True)
+    state = AppState(calender_conversations=[conversation])
+    holder = asyncio.create_task(disentangle())
+    await asyncio.sleep(0)
+
+    state = await asyncio.wait_for(aextract_calendar_datetime_from_conversations(state, min_confidence=1.0), 1)
+
+    assert released.is_set()
+    assert state.calender_conversations[0].event_datetime == datetime(2024, 1, 5, 10, 0)
+    assert state.extraction_stats.extractions == 1
+    await holder
@@ -0,0 +1,83 @@
+import asyncio
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from datatypes import Message
+from embedding_service import EmbeddingService
+from inference_service import InferenceService
+
+
+class FakeEncoder:
+    """Encodes a text as its length and records the batches it was called with."""
+
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, texts):
+        self.batches.append(list(texts))
+        return np.array([[len(text)] for text in texts], dtype=np.float32)
+
+
+@pytest.fixture
+def inference_service():
+    service = InferenceService(max_workers=1, intra_op_threads=1)
+    yield service
+    service.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_concurrent_requests_are_coalesced(inference_service):
+    encoder = FakeEncoder()
+    service = EmbeddingService(encoder, max_batch_size=64, max_wait_seconds=0.05, inference_service=inference_service)
+
+    results = await asyncio.gather(*(service.encode(["a" * idx, "b"]) for idx in range(1, 6)))
+    await service.aclose()
+
+    assert len(encoder.batches) == 1
+    for idx, embeddings in enumerate(results, start=1):
+        assert embeddings.tolist() == [[idx], [1]]
+    assert service.stats.requests == 5
+    assert service.stats.batches == 1
+    assert service.stats.mean_batch_size == 10
+
+
+@pytest.mark.asyncio
+async def test_batches_are_bounded_by_size(inference_service):
+    encoder = FakeEncoder()
+    service = EmbeddingService(encoder, max_batch_size=4, max_wait_seconds=0.05, inference_service=inference_service)
+
+    results = await asyncio.gather(*(service.encode(["x" * idx] * 3) for idx in range(1, 4)))
+    await service.aclose()
+
+    # requests are never split, a request that does not fit waits for the next batch
+    assert [len(batch) for batch in encoder.batches] == [3, 3, 3]
+    assert [embeddings[:, 0].tolist() for embeddings in results] == [[1] * 3, [2] * 3, [3] * 3]
+
+
+@pytest.mark.asyncio
+async def test_errors_are_returned_to_waiters(inference_service):
+    def failing_encoder(texts):
+        raise RuntimeError("model failed")
+
+    service = EmbeddingService(failing_encoder, max_wait_seconds=0.01, inference_service=inference_service)
+
+    with pytest.raises(RuntimeError, match="model failed"):
+        await service.encode(["hello"])
+    await service.aclose()
+
+
+@pytest.mark.asyncio
+async def test_embed_messages_fills_missing_embeddings(inference_service):
+    encoder = FakeEncoder()
+    service = EmbeddingService(encoder, max_wait_seconds=0.01, inference_service=inference_service)
+    encoded = Message(seqid=1, ts=datetime.now(), user="a", message="done")
+    encoded.features.embedding = np.array([0.0])
+    message = Message(seqid=2, ts=datetime.now(), user="b", message="hello")
+
+    await service.embed_messages([encoded, message, message])
+    await service.aclose()
+
+    assert encoder.batches == [["hello"]]
+    assert message.features.embedding.tolist() == [5]
@@ -0,0 +1,51 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from inference_service import InferenceService
+
+
+@pytest.mark.asyncio
+async def test_run_executes_on_inference_thread():
+    service = InferenceService(max_workers=1, intra_op_threads=1)
+
+    thread_name = await service.run(lambda: threading.current_thread().name)
+
+    assert thread_name.startswith("inference")
+    service.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_run_passes_arguments():
+    service = InferenceService(max_workers=1, intra_op_threads=1)
+
+    result = await service.run(lambda a, b=0: a + b, 1, b=2)
+
+    assert result == 3
+    service.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_event_loop_keeps_running_while_model_computes():
+    service = InferenceService(max_workers=1, intra_op_threads=1)
+    ticks = []
+
+    async def ticker():
+        for _ in range(5):
+            ticks.append(time.perf_counter())
+            await asyncio.sleep(0.01)
+
+    await asyncio.gather(service.run(time.sleep, 0.1), ticker())
+
+    assert len(ticks) == 5
+    service.shutdown()
+
+
+def test_intra_op_threads_are_split_between_workers(monkeypatch):
+    monkeypatch.setattr("os.cpu_count", lambda: 8)
+    service = InferenceService(max_workers=4)
+
+    assert service.intra_op_threads == 2
+    service.shutdown()
@@ -0,0 +1,130 @@
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, Mock
+
+import pytest
+
+import llm_utils
+from llm_cache import LLMResponseCache
+from llm_utils import acached_chat, cached_chat
+
+
+REQUEST = {
+    "model": "qwq:32b",
+    "messages": [{"role": "user", "content": "does it match?"}],
+    "format": {"type": "object"},
+    "options": {"temperature": 0, "num_ctx": 8192},
+}
+
+
+def _response(content: str) -> SimpleNamespace:
+    return SimpleNamespace(message=SimpleNamespace(content=content), prompt_eval_count=10, eval_count=2)
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    llm_cache = LLMResponseCache(tmp_path / "llm.sqlite")
+    monkeypatch.setattr(llm_utils, "get_llm_cache", lambda: llm_cache)
+    yield llm_cache
+    llm_cache.close()
+
+
+def test_key_depends_on_model_prompt_format_and_options():
+    key = LLMResponseCache.key(**REQUEST)
+
+    assert key == LLMResponseCache.key(**{**REQUEST, "options": {"num_ctx": 8192, "temperature": 0}})
+    for field, value in [("model", "other"), ("messages", []), ("format", None), ("options", {})]:
+        assert key != LLMResponseCache.key(**{**REQUEST, field: value})
+
+
+def test_responses_persist_across_instances(tmp_path):
+    cache = LLMResponseCache(tmp_path / "llm.sqlite")
+    cache.put("key", '{"matches": true}')
+    cache.close()
+
+    reopened = LLMResponseCache(tmp_path / "llm.sqlite")
+    assert reopened.get("key") == '{"matches": true}'
+    assert reopened.get("missing") is None
+    assert reopened.stats.hit_rate == 0.5
+    assert reopened.size_bytes == len('{"matches": true}')
+    reopened.close()
+
+
+def test_least_recently_used_responses_are_evicted(tmp_path):
+    cache = LLMResponseCache(tmp_path / "llm.sqlite", max_bytes=25)
+    cache.put("a", "x" * 10)
+    cache.put("b", "x" * 10)
+    cache.get("a")
+    cache.put("c", "x" * 10)
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert cache.stats.evictions == 1
+    assert cache.size_bytes == 20
+    cache.close()
+
+
+def test_cached_chat_skips_the_llm_on_replay(cache):
+    chat = Mock(return_value=_response('{"matches": true}'))
+
+    first = cached_chat("test", chat, **REQUEST)
+    replay = cached_chat("test", chat, **REQUEST)
+
+    assert chat.call_count == 1
+    assert first.message.content == replay.message.content == '{"matches": true}'
+    assert cache.stats.hits == 1
+
+
+@pytest.mark.asyncio
+async def test_acached_chat_ignores_arguments_outside_the_key(cache):
+    chat = AsyncMock(return_value=_response('{"option": 2}'))
+
+    await acached_chat("test", chat, **REQUEST, keep_alive=True)
+    replay = await acached_chat("test", chat, **REQUEST, keep_alive=False)
+
+    assert chat.await_count == 1
+    assert replay.message.content == '{"option": 2}'
+
+
+def test_cached_chat_without_cache_always_calls_the_llm(monkeypatch):
+    monkeypatch.setattr(llm_utils, "get_llm_cache", lambda: None)
+    chat = Mock(return_value=_response("{}"))
+
+    cached_chat("test", chat, **REQUEST)
+    cached_chat("test", chat, **REQUEST)
+
+    assert chat.call_count == 2
+
+
+def test_hits_do_not_write_until_the_next_put(tmp_path):
+    cache = LLMResponseCache(tmp_path / "llm.sqlite", touch_batch=3)
+    for key in "abc":
+        cache.put(key, "x")
+    changes = cache._connection.total_changes
+
+    cache.get("a")
+    cache.get("b")
+    cache.get("a")
+    assert cache._connection.total_changes == changes
+
+    # the pending touches are written together once the batch is full
+    cache.get("c")
+    assert cache._connection.total_changes == changes + 3
+    cache.close()
+
+
+def test_only_valid_responses_are_cached(cache):
+    from pydantic import BaseModel
+
+    class Output(BaseModel):
+        matches: bool
+
+    chat = Mock(side_effect=[_response('{"matches": '), _response(""), _response('{"matches": true}')])
+
+    for _ in range(3):
+        cached_chat("test", chat, output_model=Output, **REQUEST)
+    replay = cached_chat("test", chat, output_model=Output, **REQUEST)
+
+    # the truncated and the empty answers are asked for again, the valid one is replayed
+    assert chat.call_count == 3
+    assert replay.message.content == '{"matches": true}'
+    assert len(cache) == 1
@@ -0,0 +1,140 @@
+import asyncio
+import threading
+
+import pytest
+
+from llm_gateway import LLMGateway, Priority, _model_limits
+
+
+async def _hold(gateway: LLMGateway, priority: Priority, model: str, order: list, release: asyncio.Event):
+    async with gateway.aslot(priority, model):
+        order.append((priority, model))
+        await release.wait()
+
+
+@pytest.mark.asyncio
+async def test_interactive_requests_are_served_first_without_starving_background():
+    gateway = LLMGateway(max_concurrency=1, weights={Priority.INTERACTIVE: 2, Priority.BACKGROUND: 1})
+    order, release = [], asyncio.Event()
+    release.set()
+    blocker = asyncio.Event()
+
+    holder = asyncio.create_task(_hold(gateway, Priority.BACKGROUND, "m", [], blocker))
+    await asyncio.sleep(0)
+    tasks = [asyncio.create_task(_hold(gateway, Priority.BACKGROUND, "m", order, release)) for _ in range(2)]
+    tasks += [asyncio.create_task(_hold(gateway, Priority.INTERACTIVE, "m", order, release)) for _ in range(4)]
+    await asyncio.sleep(0)
+    assert gateway.queue_depth(Priority.INTERACTIVE) == 4
+
+    blocker.set()
+    await asyncio.gather(holder, *tasks)
+
+    assert [priority for priority, _ in order] == [
+        Priority.INTERACTIVE, Priority.INTERACTIVE, Priority.BACKGROUND,
+        Priority.INTERACTIVE, Priority.INTERACTIVE, Priority.BACKGROUND,
+    ]
+    assert gateway.stats[Priority.INTERACTIVE].requests == 4
+    assert gateway.stats[Priority.BACKGROUND].requests == 3
+
+
+@pytest.mark.asyncio
+async def test_model_limit_lets_other_models_run():
+    gateway = LLMGateway(max_concurrency=2, model_limits={"big": 1})
+    order, blocker, release = [], asyncio.Event(), asyncio.Event()
+    release.set()
+
+    holder = asyncio.create_task(_hold(gateway, Priority.INTERACTIVE, "big", [], blocker))
+    await asyncio.sleep(0)
+    waiting_big = asyncio.create_task(_hold(gateway, Priority.INTERACTIVE, "big", order, release))
+    small = asyncio.create_task(_hold(gateway, Priority.INTERACTIVE, "small", order, release))
+    await small
+
+    assert order == [(Priority.INTERACTIVE, "small")]
+    blocker.set()
+    await asyncio.gather(holder, waiting_big)
+    assert order[-1] == (Priority.INTERACTIVE, "big")
+
+
+@pytest.mark.asyncio
+async def test_requests_waiting_past_their_deadline_expire():
+    gateway = LLMGateway(max_concurrency=1, deadlines={Priority.BACKGROUND: 0.01})
+    blocker = asyncio.Event()
+    holder = asyncio.create_task(_hold(gateway, Priority.INTERACTIVE, "m", [], blocker))
+    await asyncio.sleep(0)
+
+    with pytest.raises(TimeoutError):
+        async with gateway.aslot(Priority.BACKGROUND, "m"):
+            pass
+
+    blocker.set()
+    await holder
+    assert gateway.stats[Priority.BACKGROUND].expired == 1
+    assert gateway.queue_depth(Priority.BACKGROUND) == 0
+    async with gateway.aslot(Priority.BACKGROUND, "m"):
+        pass
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiters_leave_the_queue():
+    gateway = LLMGateway(max_concurrency=1)
+    blocker = asyncio.Event()
+    holder = asyncio.create_task(_hold(gateway, Priority.INTERACTIVE, "m", [], blocker))
+    await asyncio.sleep(0)
+    waiter = asyncio.create_task(_hold(gateway, Priority.INTERACTIVE, "m", [], blocker))
+    await asyncio.sleep(0)
+
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+
+    assert gateway.queue_depth(Priority.INTERACTIVE) == 0
+    blocker.set()
+    await holder
+
+
+def test_sync_slots_wait_for_a_free_slot():
+    gateway = LLMGateway(max_concurrency=1)
+    entered, release = threading.Event(), threading.Event()
+
+    def hold():
+        with gateway.slot(Priority.BACKGROUND, "m"):
+            entered.set()
+            release.wait()
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    entered.wait()
+    with pytest.raises(TimeoutError):
+        with gateway.slot(Priority.INTERACTIVE, "m", deadline_seconds=0.01):
+            pass
+    release.set()
+    thread.join()
+
+    with gateway.slot(Priority.INTERACTIVE, "m"):
+        pass
+    assert gateway.stats[Priority.INTERACTIVE].requests == 1
+    assert gateway.stats[Priority.BACKGROUND].service_seconds > 0
+
+
+@pytest.mark.asyncio
+async def test_sync_slots_refuse_to_block_the_loop_of_async_holders():
+    gateway = LLMGateway(max_concurrency=1)
+    release = asyncio.Event()
+    holder = asyncio.create_task(_hold(gateway, Priority.INTERACTIVE, "m", [], release))
+    await asyncio.sleep(0)
+
+    # waiting here would keep the holder from ever releasing its slot
+    with pytest.raises(RuntimeError):
+        with gateway.slot(Priority.BACKGROUND, "m"):
+            pass
+
+    assert gateway.queue_depth(Priority.BACKGROUND) == 0
+    release.set()
+    await holder
+    async with gateway.aslot(Priority.BACKGROUND, "m"):
+        pass
+
+
+def test_model_limits_setting():
+    assert _model_limits("qwq:32b=1, deepseek-r1:8b=2,") == {"qwq:32b": 1, "deepseek-r1:8b": 2}
+    assert _model_limits("") == {}
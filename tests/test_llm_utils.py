@@ -0,0 +1,37 @@
+from types import SimpleNamespace
+
+from pydantic import BaseModel
+
+import llm_utils
+from llm_utils import LLMUsageStats, record_usage, response_model
+
+
+class Lean(BaseModel):
+    decision: bool
+
+
+class Reasoned(Lean):
+    reason: str
+
+
+def test_reasoning_is_disabled_by_default(monkeypatch):
+    monkeypatch.delenv("LLM_REASONING", raising=False)
+    assert response_model(Lean, Reasoned) is Lean
+
+    monkeypatch.setenv("LLM_REASONING", "true")
+    assert response_model(Lean, Reasoned) is Reasoned
+
+
+def test_record_usage_accumulates_token_counts(monkeypatch):
+    usage: dict[str, LLMUsageStats] = {}
+    monkeypatch.setattr(llm_utils, "llm_usage", usage)
+
+    record_usage("disentangle", SimpleNamespace(prompt_eval_count=120, eval_count=4))
+    record_usage("disentangle", SimpleNamespace(prompt_eval_count=80, eval_count=6))
+    # responses without counts, e.g. served from a cache
+    record_usage("disentangle", SimpleNamespace(prompt_eval_count=None, eval_count=None))
+
+    assert usage["disentangle"].calls == 3
+    assert usage["disentangle"].prompt_tokens == 200
+    assert usage["disentangle"].response_tokens == 10
+    assert usage["disentangle"].mean_response_tokens == 10 / 3
@@ -0,0 +1,72 @@
+import subprocess
+import sys
+
+import pytest
+
+from model_registry import ModelRegistry
+
+
+def counting_loader(calls: list):
+    def load():
+        calls.append(1)
+        return object()
+    return load
+
+
+def test_model_is_loaded_on_first_use_only():
+    registry = ModelRegistry()
+    calls = []
+    registry.register("model", counting_loader(calls))
+
+    assert not registry.is_loaded("model")
+    assert calls == []
+
+    first = registry.get("model")
+    second = registry.get("model")
+
+    assert first is second
+    assert calls == [1]
+    assert registry.is_loaded("model")
+
+
+def test_warmup_loads_only_requested_models():
+    registry = ModelRegistry()
+    calls_a, calls_b = [], []
+    registry.register("a", counting_loader(calls_a))
+    registry.register("b", counting_loader(calls_b))
+
+    registry.warmup("a")
+
+    assert registry.is_loaded("a")
+    assert not registry.is_loaded("b")
+
+
+def test_warmup_without_names_loads_all_models():
+    registry = ModelRegistry()
+    registry.register("a", counting_loader([]))
+    registry.register("b", counting_loader([]))
+
+    registry.warmup()
+
+    assert registry.is_loaded("a") and registry.is_loaded("b")
+
+
+def test_get_unknown_model_raises():
+    with pytest.raises(KeyError):
+        ModelRegistry().get("missing")
+
+
+def test_importing_classifiers_does_not_load_models():
+    # run in a fresh interpreter, other tests share the process wide registry
+    check = (
+        "from model_registry import registry\n"
+        "import calendar_event_classifier as c\n"
+        "import conversations.disentanglement.rule_based_classifier as r\n"
+        "import sys\n"
+        "assert not registry.is_loaded(c.CALENDAR_CLASSIFIER)\n"
+        "assert not registry.is_loaded(r.SENTENCE_TRANSFORMER)\n"
+        "assert 'sentence_transformers' not in sys.modules\n"
+    )
+    result = subprocess.run([sys.executable, "-c", check], cwd="src", capture_output=True, text=True)
+
+    assert result.returncode == 0, result.stderr
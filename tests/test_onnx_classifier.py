@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("onnxruntime")
+
+from onnx_classifier import _to_predictions, parity_report
+
+
+def test_to_predictions_matches_pipeline_output_format():
+    logits = np.array([[2.0, 0.0], [0.0, 2.0]])
+
+    predictions = _to_predictions(logits, {0: "LABEL_0", 1: "LABEL_1"})
+
+    assert [prediction["label"] for prediction in predictions] == ["LABEL_0", "LABEL_1"]
+    assert predictions[0]["score"] == pytest.approx(0.8808, abs=1e-4)
+    assert predictions[1]["score"] == pytest.approx(0.8808, abs=1e-4)
+
+
+def fixed_classifier(predictions):
+    def classify(texts, batch_size=1):
+        return predictions[:len(texts)]
+    return classify
+
+
+def test_parity_report_measures_agreement_and_drift():
+    reference = fixed_classifier([
+        {"label": "LABEL_1", "score": 0.9},
+        {"label": "LABEL_0", "score": 0.8},
+    ])
+    candidate = fixed_classifier([
+        {"label": "LABEL_1", "score": 0.85},
+        {"label": "LABEL_1", "score": 0.6},
+    ])
+
+    report = parity_report(
+        ["meet at 3pm?", "lol"], [True, False], reference, candidate
+    )
+
+    assert report.messages == 2
+    assert report.label_agreement == 0.5
+    assert report.reference_accuracy == 1.0
+    assert report.candidate_accuracy == 0.5
+    # LABEL_1 probabilities: 0.9 vs 0.85 and 0.2 vs 0.6
+    assert report.mean_score_drift == pytest.approx(0.225)
+    assert report.max_score_drift == pytest.approx(0.4)
+    assert report.reference_msgs_per_sec > 0
+
+
+def test_session_threads_are_capped_per_worker(monkeypatch):
+    import onnx_classifier
+
+    sessions = []
+
+    class FakeSession:
+        def __init__(self, path, options, providers):
+            sessions.append(options)
+
+        def get_inputs(self):
+            return []
+
+    class FakeConfig:
+        id2label = {0: "LABEL_0", 1: "LABEL_1"}
+
+    monkeypatch.setattr(onnx_classifier.ort, "InferenceSession", FakeSession)
+    monkeypatch.setattr(onnx_classifier.AutoConfig, "from_pretrained", lambda path: FakeConfig)
+
+    onnx_classifier.OnnxTextClassifier("model.onnx", "model", tokenizer=None, intra_op_threads=2)
+
+    assert sessions[0].intra_op_num_threads == 2
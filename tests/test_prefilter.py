@@ -0,0 +1,132 @@
+from datetime import datetime, timezone
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+import calendar_event_classifier
+from calendar_event_classifier import (
+    CALENDAR_CLASSIFIER,
+    CALENDAR_PREFILTER,
+    classification_cache,
+    classify_messages,
+    is_calendar_event,
+)
+from datatypes import Message
+from model_registry import registry
+from prefilter import Prefilter, has_temporal_cue
+from text_utils import clean_text
+
+
+CALENDAR_TEXTS = [
+    "can we meet tomorrow at 3pm?",
+    "lets set up a call next week",
+    "does friday work for the sprint planning",
+    "i will send the invite for the demo",
+    "how about 8pm utc on discord",
+    "jump on a quick sync to go over the migration",
+    "are you around later to pair on this",
+    "lets get together to go over the design",
+]
+CHATTER_TEXTS = [
+    "lol",
+    "+1",
+    "thanks that fixed it",
+    "try apt-get install build-essential",
+    "which kernel are you running",
+    "nice",
+    "that package is broken in sid",
+    "reboot and check dmesg",
+]
+
+
+def trained_prefilter(recall_target: float = 1.0) -> Prefilter:
+    texts = CALENDAR_TEXTS + CHATTER_TEXTS
+    labels = [True] * len(CALENDAR_TEXTS) + [False] * len(CHATTER_TEXTS)
+    cleaned = [clean_text(text) for text in texts]
+    return Prefilter().fit(cleaned, labels).calibrate(texts, cleaned, labels, recall_target)
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("can we meet tomorrow?", True),
+        ("how about 10:30", True),
+        ("8pm UTC works", True),
+        ("next Tuesday then", True),
+        ("lol", False),
+        ("+1", False),
+        ("run make install", False),
+    ],
+)
+def test_has_temporal_cue(text, expected):
+    assert has_temporal_cue(text) == expected
+
+
+def test_obvious_negatives_are_labelled_without_classifier():
+    prefilter = trained_prefilter()
+    texts = ["lol", "nice", "can we meet tomorrow?"]
+
+    results = prefilter.classify(texts, [clean_text(text) for text in texts])
+
+    assert results[0] == {"label": "LABEL_0", "score": pytest.approx(results[0]["score"])}
+    assert results[1]["label"] == "LABEL_0"
+    assert results[2] is None
+    assert prefilter.stats.checked == 3
+    assert prefilter.stats.skipped == 2
+
+
+def test_calibration_keeps_recall_target_on_calibration_set():
+    prefilter = trained_prefilter(recall_target=1.0)
+
+    results = prefilter.classify(CALENDAR_TEXTS, [clean_text(text) for text in CALENDAR_TEXTS])
+
+    assert all(result is None for result in results)
+
+
+def test_lower_recall_target_never_lowers_threshold():
+    prefilter = trained_prefilter(recall_target=1.0)
+    strict_threshold = prefilter.threshold
+
+    prefilter.tune(0.5)
+
+    assert prefilter.threshold >= strict_threshold
+
+
+def test_untrained_threshold_skips_nothing():
+    prefilter = Prefilter().fit(["meet tomorrow", "lol"], [True, False])
+
+    assert prefilter.classify(["lol"], ["lol"]) == [None]
+
+
+@pytest.fixture
+def empty_classification_cache():
+    classification_cache.clear()
+    yield
+    classification_cache.clear()
+
+
+def message(seqid: int, text: str) -> Message:
+    return Message(seqid=seqid, ts=datetime.now(timezone.utc), user="user", message=text)
+
+
+def test_classify_messages_only_sends_unfiltered_messages_to_classifier(empty_classification_cache):
+    classifier = MagicMock(return_value=[{"label": "LABEL_1", "score": 0.9}])
+
+    with patch.dict(registry._models, {CALENDAR_CLASSIFIER: classifier, CALENDAR_PREFILTER: trained_prefilter()}):
+        results = classify_messages([message(1, "lol"), message(2, "can we meet tomorrow at 3pm?")])
+
+    assert classifier.call_args.args[0] == ["can we meet tomorrow at 3pm?"]
+    assert [result.classification.label for result in results] == ["LABEL_0", "LABEL_1"]
+    assert [result.seqid for result in results] == [1, 2]
+
+
+def test_is_calendar_event_skips_classifier_for_obvious_negative(empty_classification_cache):
+    classifier = MagicMock()
+
+    with patch.dict(registry._models, {CALENDAR_CLASSIFIER: classifier, CALENDAR_PREFILTER: trained_prefilter()}):
+        result = is_calendar_event(message(1, "lol"))
+        stats = calendar_event_classifier.prefilter_stats()
+
+    classifier.assert_not_called()
+    assert result.classification.label == "LABEL_0"
+    assert stats.skipped == 1
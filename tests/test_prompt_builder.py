@@ -0,0 +1,62 @@
+import logging
+
+import pytest
+
+from prompt_builder import chat_options, count_tokens, num_ctx_for, select_within_budget
+
+
+def test_count_tokens_counts_words_and_punctuation_with_margin():
+    assert count_tokens("") == 0
+    assert count_tokens("meet at 5?") == 6
+
+
+def test_select_within_budget_keeps_most_recent_in_order():
+    items = ["one", "two", "three", "four"]
+
+    assert select_within_budget(items, budget=4, render=str) == ["three", "four"]
+    assert select_within_budget(items, budget=100, render=str) == items
+
+
+def test_select_within_budget_prefers_relevant_and_always_keeps_last():
+    items = ["meet friday", "lol", "ok", "see you"]
+
+    selected = select_within_budget(items, budget=7, render=str, relevant=lambda item: "friday" in item)
+
+    assert selected == ["meet friday", "see you"]
+    assert select_within_budget(items, budget=0, render=str) == ["see you"]
+
+
+@pytest.mark.parametrize("words, expected", [(10, 2048), (2000, 4096), (4000, 8192)])
+def test_num_ctx_grows_in_powers_of_two(words, expected, monkeypatch):
+    monkeypatch.delenv("LLM_MAX_NUM_CTX", raising=False)
+    assert num_ctx_for("word " * words) == expected
+
+
+def test_num_ctx_is_capped_and_warns_on_truncation(monkeypatch, caplog):
+    monkeypatch.setenv("LLM_MAX_NUM_CTX", "4096")
+
+    with caplog.at_level(logging.WARNING):
+        assert chat_options("word " * 5000) == {"temperature": 0, "num_ctx": 4096}
+
+    assert "truncated" in caplog.text
+
+
+def test_num_ctx_warns_against_a_maximum_that_is_not_a_power_of_two(monkeypatch, caplog):
+    monkeypatch.setenv("LLM_MAX_NUM_CTX", "6000")
+
+    with caplog.at_level(logging.WARNING):
+        # about 6.8k tokens, fits in the next power of two but not in the maximum
+        assert num_ctx_for("word " * 5000) == 6000
+
+    assert "truncated" in caplog.text
+
+
+def test_num_ctx_only_grows_for_a_model(monkeypatch):
+    monkeypatch.delenv("LLM_MAX_NUM_CTX", raising=False)
+    monkeypatch.setattr("prompt_builder._num_ctx_high_water", {})
+
+    assert num_ctx_for("word " * 10, model="qwq:32b") == 2048
+    assert num_ctx_for("word " * 4000, model="qwq:32b") == 8192
+    # a short prompt keeps the loaded context instead of reloading the model
+    assert num_ctx_for("word " * 10, model="qwq:32b") == 8192
+    assert num_ctx_for("word " * 10, model="deepseek-r1:8b") == 2048
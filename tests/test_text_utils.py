@@ -1,4 +1,4 @@
-from text_utils import clean_text
+from text_utils import clean_text, clean_texts, mentions, message_tokens, tokenize
 
 
 def test_remove_urls():
@@ -12,3 +12,36 @@ def test_remove_mentions():
 
 def test_remove_special_chars():
     assert clean_text("Hell*, w(&ld!.") == "hell, wld!."
+
+
+def test_channel_swallows_url_following_its_name():
+    assert clean_text("#foohttp://example.com now") == "group now"
+
+
+def test_user_swallows_following_channel_and_url():
+    assert clean_text("@#chan hi") == "user hi"
+    assert clean_text("@bob#chan hi") == "user hi"
+    assert clean_text("@http://example.com") == "user"
+
+
+def test_failed_mentions_are_removed_as_special_chars():
+    assert clean_text("## @ @@bob") == "  user"
+
+
+def test_clean_texts_matches_clean_text():
+    texts = ["Check out http://example.com ", "hi @t_we ", "hey #channel", "Hell*, w(&ld!."]
+
+    assert clean_texts(texts) == [clean_text(text) for text in texts]
+
+
+def test_tokenize_lowercases_words():
+    assert tokenize("Meet @Bob at 3pm, ok?") == ["meet", "bob", "at", "3pm", "ok"]
+
+
+def test_message_tokens_are_distinct():
+    assert message_tokens("the model, the data") == frozenset({"the", "model", "data"})
+
+
+def test_mentions():
+    assert mentions("@alice, @bob_2: see you @alice") == frozenset({"alice", "bob_2"})
+    assert mentions("mail me at bob at example") == frozenset()